@@ -1,16 +1,22 @@
 # backend/api/messages.py
 
-from typing import List, Optional
+import asyncio
+import json
+from typing import Any, Dict, Iterator, List, Optional
 
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from supabase_client import supabase
 from uuid import uuid4
 from datetime import datetime, timezone
 from pydantic import BaseModel
 
-from services.llm.gpt_tool_service import generate_gpt_reply_with_tools
+from services.llm.gpt_tool_service import generate_gpt_reply_with_tools, stream_gpt_reply_with_tools
 from services.llm.summarization import maybe_update_summary, count_tokens
 from services.llm.title_generator import generate_conversation_title
+from services.llm.turn_context import TurnContextNotFound, get_conversation_client_id, prepare_reply
+from services.rag.embeddings import EmbeddingError
 from services.storage.uploads import upload_conversation_file
 
 router = APIRouter()
@@ -29,357 +35,250 @@ class MessageCreate(BaseModel):
 # ------------------------------
 # HELPERS
 # ------------------------------
-def _build_attached_docs_context(history: list[dict]) -> Optional[str]:
-    """
-    Given the recent history rows from `messages` (with id, role, content),
-    build a system message that surfaces titles and text snippets of any
-    documents attached to those messages via `message_documents`.
+def _insert_user_message(conversation_id: str, user_id: str, content: str) -> str:
+    """Persist the user's message first so the conversation has it in history."""
+    message_id = str(uuid4())
+    supabase.table("messages").insert({
+        "id": message_id,
+        "conversation_id": conversation_id,
+        "user_id": user_id,
+        "role": "user",
+        "content": {"text": content},
+        "tokens": count_tokens(content or ""),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }).execute()
+    return message_id
 
-    Returns a string to be used as a system message, or None if there are
-    no attached docs in this history window.
-    """
-    print("[ATTACH_DEBUG] building attached docs context")
 
-    if not history:
-        print("[ATTACH_DEBUG] history is empty, nothing to attach")
-        return None
+def _maybe_generate_title(conversation_id: str, content: str, role: Optional[str], msg_count: int) -> None:
+    """If it is the very first user message, generate a conversation title once (never raises)."""
+    try:
+        if msg_count == 1 and role == "user":
+            title = generate_conversation_title(content)
+            supabase.table("conversations").update({"title": title}).eq("id", conversation_id).execute()
+            print(f"[TITLE] auto generated conversation title: {title}")
+    except Exception as e:
+        print(f"[TITLE] failed to generate title: {e}")
 
-    message_ids = [m["id"] for m in history if "id" in m]
-    print(f"[ATTACH_DEBUG] history message ids: {message_ids}")
 
-    if not message_ids:
-        print("[ATTACH_DEBUG] no message ids found in history rows")
-        return None
+async def _prepare(conversation_id: str, content: str, client_id: Optional[str] = None) -> Dict[str, Any]:
+    """turn_context.prepare_reply with a missing conversation/client as a 404."""
+    try:
+        return await prepare_reply(conversation_id, content, client_id)
+    except TurnContextNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-    # 1) Fetch links from messages to documents
-    links_res = (
-        supabase.table("message_documents")
-        .select("message_id, document_id")
-        .in_("message_id", message_ids)
-        .execute()
-    )
-    links = links_res.data or []
-    print(f"[ATTACH_DEBUG] message_documents links count: {len(links)}")
-
-    if not links:
-        print("[ATTACH_DEBUG] no message_documents rows for these messages")
-        return None
-
-    # 2) Fetch the document rows
-    doc_ids = list({row["document_id"] for row in links})
-    if not doc_ids:
-        print("[ATTACH_DEBUG] no document ids collected from links")
-        return None
-
-    docs_res = (
-        supabase.table("knowledge_documents")
-        .select("id, title, raw_text")
-        .in_("id", doc_ids)
-        .execute()
-    )
-    docs = docs_res.data or []
-    print(f"[ATTACH_DEBUG] knowledge_documents rows count: {len(docs)}")
-
-    if not docs:
-        print("[ATTACH_DEBUG] no knowledge_documents found for these ids")
-        return None
-
-    docs_by_id = {d["id"]: d for d in docs}
-
-    # Map message_id -> list of docs
-    docs_by_msg: dict[str, list[dict]] = {}
-    for row in links:
-        mid = row["message_id"]
-        did = row["document_id"]
-        doc = docs_by_id.get(did)
-        if not doc:
-            continue
-        docs_by_msg.setdefault(mid, []).append(doc)
-
-    def safe_trim(text: str, max_chars: int) -> str:
-        if not text:
-            return ""
-        if len(text) <= max_chars:
-            return text
-        return text[:max_chars] + "... [truncated]"
-
-    lines: list[str] = []
-    # Simple char based budget so we do not explode context
-    total_chars_budget = 8000
-    used_chars = 0
-
-    # Walk history in chronological order, but only include messages that have docs
-    for m in history:
-        mid = m["id"]
-        if mid not in docs_by_msg:
-            continue
 
-        role = m["role"]
-        content_field = m.get("content") or {}
-        msg_text = ""
-        if isinstance(content_field, dict):
-            msg_text = content_field.get("text", "") or ""
-
-        header = f"Message ({role}): {safe_trim(msg_text, 300)}"
-        lines.append(header)
-        used_chars += len(header)
-        if used_chars >= total_chars_budget:
-            break
-
-        for doc in docs_by_msg[mid]:
-            title = doc.get("title") or "Untitled document"
-            raw_text = doc.get("raw_text") or ""
-            snippet = safe_trim(raw_text, 1500)
-            block = (
-                f"\nAttached document: {title}\n"
-                f"Content snippet:\n{snippet}\n"
-            )
-            lines.append(block)
-            used_chars += len(block)
-            if used_chars >= total_chars_budget:
-                break
-
-        if used_chars >= total_chars_budget:
-            break
-
-    if not lines:
-        print("[ATTACH_DEBUG] docs_by_msg is non empty but produced no lines")
-        return None
-
-    attached_docs_context = (
-        "You have direct access to the extracted text from files recently uploaded in this conversation. "
-        "Treat this text exactly as if the user had pasted it into the chat. "
-        "You may freely read, quote, summarize, and reason about it. "
-        "If the user asks about an uploaded file, answer using this text and do not say that you cannot access the file. "
-        "You do not need to call any tools to read this text, it is already provided here.\n\n"
-        "Attached documents and their content:\n\n"
-        + "\n".join(lines)
-    )
+async def _client_id_for(conversation_id: str) -> str:
+    try:
+        return await asyncio.to_thread(get_conversation_client_id, conversation_id)
+    except TurnContextNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-    print(f"[ATTACH_DEBUG] built attached_docs_context length: {len(attached_docs_context)} chars")
-    return attached_docs_context
 
+_background: set = set()
 
-# ------------------------------
-# ENDPOINTS
-# ------------------------------
-@router.post("/")
-def create_message(data: MessageCreate):
-    """
-    Insert a user message, build client context, and generate a grounded reply.
-    The model can optionally call tools (rag_search_tool) up to the configured budget.
-    A detailed tool audit is printed server side and returned in `debug.tool_audit`.
-    """
-    if not data.user_id:
-        raise HTTPException(status_code=400, detail="user_id is required")
-    user_id = data.user_id
 
-    # 1) Persist the user's message first so the conversation has it in history.
-    user_msg = {
-        "id": str(uuid4()),
-        "conversation_id": data.conversation_id,
-        "user_id": user_id,
-        "role": "user",
-        "content": {"text": data.content},
-        "tokens": count_tokens(data.content),
-        "created_at": datetime.now(timezone.utc).isoformat(),
-    }
-    supabase.table("messages").insert(user_msg).execute()
+def _spawn(fn, *args: Any) -> "asyncio.Task":
+    """Run a blocking call in a thread without awaiting it; the task is kept referenced until done."""
+    task = asyncio.create_task(asyncio.to_thread(fn, *args))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
 
-    # 1.1) If it is the very first user message, generate a conversation title once.
-    msg_count = (
-        supabase.table("messages")
-        .select("id", count="exact")
-        .eq("conversation_id", data.conversation_id)
-        .execute()
-        .count
-    )
-    if msg_count == 1 and data.role == "user":
-        try:
-            title = generate_conversation_title(data.content)
-            supabase.table("conversations").update({"title": title}).eq("id", data.conversation_id).execute()
-            print(f"[TITLE] auto generated conversation title: {title}")
-        except Exception as e:
-            print(f"[TITLE] failed to generate title: {e}")
 
-    # 2) Resolve the conversation's primary client (we still allow cross client refs in answers).
-    convo_result = (
-        supabase.table("conversations")
-        .select("client_id")
-        .eq("id", data.conversation_id)
-        .execute()
-    )
-    if not convo_result.data:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    client_id = convo_result.data[0]["client_id"]
-
-    # 2.5) Check how many uploaded documents this conversation has
-    upload_docs_count = (
-        supabase.table("knowledge_documents")
-        .select("id", count="exact")
-        .eq("source", "upload")
-        .eq("conversation_id", data.conversation_id)
-        .execute()
-        .count
-    )
-    has_uploaded_docs = upload_docs_count > 0
+async def _save_uploads(
+    message_id: str,
+    conversation_id: str,
+    client_id: str,
+    files: List[UploadFile],
+) -> List[Dict[str, Any]]:
+    """Upload each file (chunk + embed, Notion style) and link it to the message via message_documents."""
+    attached_docs = []
+    now_iso = datetime.now(timezone.utc).isoformat()
 
-    client_result = (
-        supabase.table("clients")
-        .select("*")
-        .eq("id", client_id)
-        .execute()
-    )
-    if not client_result.data:
-        raise HTTPException(status_code=404, detail="Client not found")
-    client = client_result.data[0]
-
-    # 3) Build the client context (QUORRA is internal; cross client comparisons are allowed).
-    products_list = ", ".join(client.get("products") or [])
-    client_context = f"""
-You are QUORRA, an internal Asera assistant. You may reference and compare across ANY clients when it helps answer the question accurately.
-
-- Name: {client.get('name')}
-- Status: {client.get('status')}
-- Account Manager: {client.get('account_manager')}
-- Priority: {client.get('priority')}
-- Contact Email: {client.get('contact_email')}
-- Products: {products_list}
-- Service End Date: {client.get('service_end_date')}
-- Description: {client.get('description')}
-
-# Retrieval and Grounding Rules
-- For adaptation or comparison you may bring in examples from other clients; clearly name those clients and cite the snippet IDs used.
-- Do not invent numbers or commitments. Only quote metrics or promises that appear in retrieved snippets.
-- For client websites, first try the internal "website" category via rag_search_tool.
-- For client website queries:
-  - Only use the web_fetch_tool if the user has pasted a URL in their latest message, in most cases use the rag_search_tool with the website category.
-  - Only use web_fetch_tool if BOTH:
-    (1) the user explicitly asks you to read or check a URL or website, and
-    (2) the domain of that URL appears in the user's latest message.
-  - Do not use web_fetch_tool just because you see a Website field in context.
-- Do not guess or invent URLs.
-""".strip()
-
-    # 4) Pull the current running summary (if we have created one already).
-    summary_result = (
-        supabase.table("conversation_summary")
-        .select("summary")
-        .eq("conversation_id", data.conversation_id)
-        .execute()
-    )
-    summary_text = summary_result.data[0]["summary"] if summary_result.data else None
+    for upload in files:
+        if not upload.filename:
+            continue
 
-    # 5) Fetch recent history (newest to oldest) and restore chronological order for the model.
-    history_result = (
-        supabase.table("messages")
-        .select("id, role, content, created_at")
-        .eq("conversation_id", data.conversation_id)
-        .order("created_at", desc=True)
-        .limit(10)
-        .execute()
-    )
-    history = list(reversed(history_result.data))
-
-    # 5.5) Build attached docs context from those last messages
-    attached_docs_context = _build_attached_docs_context(history)
-
-    # 6) Assemble GPT input
-    messages = [
-        {
-            "role": "system",
-            "content": (
-                "You are QUORRA, the Asera AI assistant. "
-                "Be concise, smart, and aware of past messages. "
-                "Do not print chunk IDs or any '(source: ...)' text in your answers. "
-                "If no snippet supports a claim, say so briefly. "
-                "You may call tools (like rag_search_tool) if you truly need more context; "
-                "otherwise answer directly. "
-                "You may compare across clients using internal data (SOPs, client records, meeting notes). "
-                "However, when using tools to query website content, you only have access to the website "
-                "data for the primary client of this conversation. "
-                "If the user asks for website details about a different client, explain that this chat is "
-                "scoped to the current client and that they should start a separate conversation for that other client."
-            ),
-        },
-        {"role": "system", "content": client_context},
-        {
-            "role": "system",
-            "content": (
-                f"This conversation currently has {upload_docs_count} uploaded file(s). "
-                "If this number is 0, do not use the 'upload' category in rag_search_tool, "
-                "because there is nothing to retrieve yet."
-            ),
-        },
-    ]
-    if summary_text:
-        messages.append(
-            {
-                "role": "system",
-                "content": f"Summary of previous conversation:\n{summary_text}",
-            }
-        )
+        file_bytes = await upload.read()
 
-    if attached_docs_context:
-        messages.append(
-            {
-                "role": "system",
-                "content": attached_docs_context,
-            }
-        )
+        # Upload + create document + chunk and embed (Notion style), off the event loop
+        try:
+            doc_id, storage_path = await asyncio.to_thread(
+                upload_conversation_file,
+                client_id=client_id,
+                conversation_id=conversation_id,
+                original_filename=upload.filename,
+                mime_type=upload.content_type or "application/octet-stream",
+                file_bytes=file_bytes,
+            )
+        except EmbeddingError as e:
+            # The document was removed again; the user can retry the upload
+            raise HTTPException(
+                status_code=502,
+                detail=f"Could not index '{upload.filename}' (embedding failed): {e}. Please upload it again.",
+            )
 
-    # Include the recent history (includes the user message we saved above).
-    for m in history:
-        messages.append({"role": m["role"], "content": m["content"]["text"]})
+        # Link message and document
+        await asyncio.to_thread(
+            supabase.table("message_documents").insert(
+                {
+                    "message_id": message_id,
+                    "document_id": doc_id,
+                    "created_at": now_iso,
+                }
+            ).execute
+        )
 
-    # 7) Generate GPT reply (tool capable)
-    try:
-        assistant_text, tool_audit = generate_gpt_reply_with_tools(
-            messages,
-            tool_context={
-                "primary_client_name": client.get("name"),
-                "primary_client_id": client_id,
-                "primary_client_website": client.get("website"),
-                "last_user_message": data.content,
-                "conversation_id": data.conversation_id,
-                "has_uploaded_docs": has_uploaded_docs,
-            },
+        attached_docs.append(
+            {"document_id": doc_id, "filename": upload.filename, "path": storage_path}
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"GPT or tool generation failed: {str(e)}")
+    return attached_docs
 
-    # 8) Persist the assistant reply
-    assistant_msg = {
-        "id": str(uuid4()),
-        "conversation_id": data.conversation_id,
+
+def _persist_assistant_reply(conversation_id: str, user_id: str, text: str) -> str:
+    assistant_id = str(uuid4())
+    supabase.table("messages").insert({
+        "id": assistant_id,
+        "conversation_id": conversation_id,
         "user_id": user_id,
         "role": "assistant",
-        "content": {"text": assistant_text},
-        "tokens": count_tokens(assistant_text),
+        "content": {"text": text},
+        "tokens": count_tokens(text),
         "created_at": datetime.now(timezone.utc).isoformat(),
-    }
-    supabase.table("messages").insert(assistant_msg).execute()
+    }).execute()
+    return assistant_id
 
-    # 9) Opportunistic summary maintenance (non fatal if it fails)
+
+def _update_summary(conversation_id: str) -> None:
+    """Opportunistic summary maintenance (non fatal if it fails)."""
     try:
-        maybe_update_summary(data.conversation_id)
+        maybe_update_summary(conversation_id)
     except Exception as e:
         print(f"[SUMMARY] update failed: {e}")
 
-    # 10) Return
+
+def _debug_info(prep: Dict[str, Any], tool_audit: List[Dict[str, Any]], **extra: Any) -> Dict[str, Any]:
+    attached_docs_context = prep["attached_docs_context"]
+    return {
+        "tool_audit": tool_audit,
+        **extra,
+        "upload_docs_count": prep["upload_docs_count"],
+        "has_uploaded_docs": prep["has_uploaded_docs"],
+        "context_source": prep["context_source"],
+        "attached_docs_context_preview": attached_docs_context[:500] if attached_docs_context else None,
+    }
+
+
+async def _generate_reply(conversation_id: str, user_id: str, prep: Dict[str, Any], **debug_extra: Any) -> Dict[str, Any]:
+    """Run the tool loop, persist the reply, and build the JSON response (blocking work in threads)."""
+    try:
+        assistant_text, tool_audit = await asyncio.to_thread(
+            generate_gpt_reply_with_tools,
+            prep["messages"],
+            tool_context=prep["tool_context"],
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"GPT or tool generation failed: {str(e)}")
+
+    await asyncio.to_thread(_persist_assistant_reply, conversation_id, user_id, assistant_text)
+    await asyncio.to_thread(_update_summary, conversation_id)
+
     return {
         "status": "success",
         "message": {"role": "assistant", "content": assistant_text},
-        "client": {"name": client.get("name")},
-        "debug": {
-            "tool_audit": tool_audit,
-            "upload_docs_count": upload_docs_count,
-            "has_uploaded_docs": has_uploaded_docs,
-            "attached_docs_context_preview": attached_docs_context[:500] if attached_docs_context else None,
-        },
+        "client": {"name": prep["client"].get("name")},
+        "debug": _debug_info(prep, tool_audit, **debug_extra),
     }
 
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _stream_reply(
+    conversation_id: str,
+    user_id: str,
+    user_message_id: str,
+    prep: Dict[str, Any],
+    **debug_extra: Any,
+) -> StreamingResponse:
+    """
+    SSE response for one reply. Events: `start`, then `tool_start` / `tool_end` while tools run,
+    `token` for each piece of the answer (`text_reset` = discard text so far), and finally
+    `done` (persisted message id, timings incl. ttft_ms, debug) or `error`.
+    The assistant message is persisted once the model finished; if the client disconnects
+    first, nothing is persisted. Summary maintenance runs after the stream is closed.
+    """
+
+    def events() -> Iterator[str]:
+        yield _sse("start", {"user_message_id": user_message_id, "client": {"name": prep["client"].get("name")}})
+        try:
+            for event in stream_gpt_reply_with_tools(prep["messages"], tool_context=prep["tool_context"]):
+                kind = event.pop("type")
+                if kind != "done":
+                    yield _sse(kind, event)
+                    continue
+                assistant_id = _persist_assistant_reply(conversation_id, user_id, event["text"])
+                yield _sse("done", {
+                    "status": "success",
+                    "message": {"id": assistant_id, "role": "assistant", "content": event["text"]},
+                    "timing": event["timing"],
+                    "debug": _debug_info(prep, event["audit"], **debug_extra),
+                })
+        except Exception as e:
+            print(f"❌ Streamed reply failed: {e}")
+            yield _sse("error", {"detail": f"GPT or tool generation failed: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # no proxy buffering
+        background=BackgroundTask(_update_summary, conversation_id),
+    )
+
+
+# ------------------------------
+# ENDPOINTS
+# ------------------------------
+@router.post("/")
+async def create_message(data: MessageCreate):
+    """
+    Insert a user message, build client context, and generate a grounded reply.
+    The model can optionally call tools (rag_search_tool) up to the configured budget.
+    A detailed tool audit is printed server side and returned in `debug.tool_audit`.
+    Async: context reads run concurrently and blocking calls run in threads, so the
+    worker's event loop is free while this request waits on I/O.
+    """
+    if not data.user_id:
+        raise HTTPException(status_code=400, detail="user_id is required")
+
+    await asyncio.to_thread(_insert_user_message, data.conversation_id, data.user_id, data.content)
+    prep = await _prepare(data.conversation_id, data.content)
+    # Title (first message only) runs alongside the reply; ready by the time we respond
+    title = _spawn(_maybe_generate_title, data.conversation_id, data.content, data.role, prep["message_count"])
+    try:
+        return await _generate_reply(data.conversation_id, data.user_id, prep)
+    finally:
+        await title
+
+
+@router.post("/stream")
+async def create_message_stream(data: MessageCreate):
+    """
+    Same as `POST /` but answers with server-sent events: tool progress while tools run,
+    then the answer token by token (see `_stream_reply` for the event types).
+    """
+    if not data.user_id:
+        raise HTTPException(status_code=400, detail="user_id is required")
+
+    user_message_id = await asyncio.to_thread(_insert_user_message, data.conversation_id, data.user_id, data.content)
+    prep = await _prepare(data.conversation_id, data.content)
+    _spawn(_maybe_generate_title, data.conversation_id, data.content, data.role, prep["message_count"])
+    return _stream_reply(data.conversation_id, data.user_id, user_message_id, prep)
+
+
 @router.get("/{conversation_id}")
 def get_messages(conversation_id: str):
     """Fetch all messages for a specific conversation."""
@@ -414,226 +313,31 @@ async def create_message_with_files(
     """
     if not user_id:
         raise HTTPException(status_code=400, detail="user_id is required")
-    
-    now_iso = datetime.now(timezone.utc).isoformat()
-
-    # 1) Insert the user's message (even if content is empty and it is "just files")
-    message_id = str(uuid4())
-    user_msg = {
-        "id": message_id,
-        "conversation_id": conversation_id,
-        "user_id": user_id,
-        "role": "user",
-        "content": {"text": content},
-        "tokens": count_tokens(content or ""),
-        "created_at": now_iso,
-    }
-    supabase.table("messages").insert(user_msg).execute()
-
-    # 2) Resolve client_id from conversation
-    convo_result = (
-        supabase.table("conversations")
-        .select("client_id")
-        .eq("id", conversation_id)
-        .execute()
-    )
-    if not convo_result.data:
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    client_id = convo_result.data[0]["client_id"]
-
-    # 3) Upload each file and link it via message_documents
-    attached_docs = []
-
-    for upload in files:
-        if not upload.filename:
-            continue
-
-        file_bytes = await upload.read()
-
-        # Upload + create document + chunk and embed (Notion style)
-        doc_id, storage_path = upload_conversation_file(
-            client_id=client_id,
-            conversation_id=conversation_id,
-            original_filename=upload.filename,
-            mime_type=upload.content_type or "application/octet-stream",
-            file_bytes=file_bytes,
-        )
-
-        # Link message and document
-        supabase.table("message_documents").insert(
-            {
-                "message_id": message_id,
-                "document_id": doc_id,
-                "created_at": now_iso,
-            }
-        ).execute()
 
-        attached_docs.append(
-            {"document_id": doc_id, "filename": upload.filename, "path": storage_path}
-        )
+    # Insert the user's message (even if content is empty and it is "just files")
+    message_id = await asyncio.to_thread(_insert_user_message, conversation_id, user_id, content)
+    client_id = await _client_id_for(conversation_id)
+    attached_docs = await _save_uploads(message_id, conversation_id, client_id, files)
+    prep = await _prepare(conversation_id, content, client_id)
+    return await _generate_reply(conversation_id, user_id, prep, attached_documents=attached_docs)
 
-    # 3.5) Re count uploaded docs after this upload, so the model sees fresh state
-    upload_docs_count = (
-        supabase.table("knowledge_documents")
-        .select("id", count="exact")
-        .eq("source", "upload")
-        .eq("conversation_id", conversation_id)
-        .execute()
-        .count
-    )
-    has_uploaded_docs = upload_docs_count > 0
-    
-    # 4) Fetch client context (same as existing create_message)
-    client_result = (
-        supabase.table("clients")
-        .select("*")
-        .eq("id", client_id)
-        .execute()
-    )
-    if not client_result.data:
-        raise HTTPException(status_code=404, detail="Client not found")
-    client = client_result.data[0]
-
-    products_list = ", ".join(client.get("products") or [])
-    client_context = f"""
-You are QUORRA, an internal Asera assistant. You may reference and compare across ANY clients when it helps answer the question accurately.
-
-- Name: {client.get('name')}
-- Status: {client.get('status')}
-- Account Manager: {client.get('account_manager')}
-- Priority: {client.get('priority')}
-- Contact Email: {client.get('contact_email')}
-- Products: {products_list}
-- Service End Date: {client.get('service_end_date')}
-- Description: {client.get('description')}
-
-# Retrieval and Grounding Rules
-- For adaptation or comparison you may bring in examples from other clients; clearly name those clients and cite the snippet IDs used.
-- Do not invent numbers or commitments. Only quote metrics or promises that appear in retrieved snippets.
-- For client websites, first try the internal "website" category via rag_search_tool.
-- For client website queries:
-  - Only use the web_fetch_tool if the user has pasted a URL in their latest message, in most cases use the rag_search_tool with the website category.
-  - Only use web_fetch_tool if BOTH:
-    (1) the user explicitly asks you to read or check a URL or website, and
-    (2) the domain of that URL appears in the user's latest message.
-  - Do not use web_fetch_tool just because you see a Website field in context.
-- Do not guess or invent URLs.
-""".strip()
-
-    # 5) Pull summary (if any)
-    summary_result = (
-        supabase.table("conversation_summary")
-        .select("summary")
-        .eq("conversation_id", conversation_id)
-        .execute()
-    )
-    summary_text = summary_result.data[0]["summary"] if summary_result.data else None
 
-    # 6) Fetch recent history (includes this new message)
-    history_result = (
-        supabase.table("messages")
-        .select("id, role, content, created_at")
-        .eq("conversation_id", conversation_id)
-        .order("created_at", desc=True)
-        .limit(10)
-        .execute()
-    )
-    history = list(reversed(history_result.data))
-
-    # 6.5) Build attached docs context from those last messages
-    attached_docs_context = _build_attached_docs_context(history)
-
-    # 7) Build messages for GPT
-    messages = [
-        {
-            "role": "system",
-            "content": (
-                "You are QUORRA, the Asera AI assistant. "
-                "Be concise, smart, and aware of past messages. "
-                "Do not print chunk IDs or any '(source: ...)' text in your answers. "
-                "If no snippet supports a claim, say so briefly. "
-                "You may call tools (like rag_search_tool) if you truly need more context; "
-                "otherwise answer directly. "
-                "You may compare across clients using internal data (SOPs, client records, meeting notes). "
-                "However, when using tools to query website content, you only have access to the website "
-                "data for the primary client of this conversation. "
-                "If the user asks for website details about a different client, explain that this chat is "
-                "scoped to the current client and that they should start a separate conversation for that other client."
-            ),
-        },
-        {"role": "system", "content": client_context},
-        {
-            "role": "system",
-            "content": (
-                f"This conversation currently has {upload_docs_count} uploaded file(s). "
-                "If this number is 0, do not use the 'upload' category in rag_search_tool."
-            ),
-        },
-    ]
-    if summary_text:
-        messages.append(
-            {
-                "role": "system",
-                "content": f"Summary of previous conversation:\n{summary_text}",
-            }
-        )
-
-    if attached_docs_context:
-        messages.append(
-            {
-                "role": "system",
-                "content": attached_docs_context,
-            }
-        )
-
-    for m in history:
-        messages.append({"role": m["role"], "content": m["content"]["text"]})
-
-    # 8) Ask GPT (tools enabled, now with conversation_id in tool_context)
-    try:
-        assistant_text, tool_audit = generate_gpt_reply_with_tools(
-            messages,
-            tool_context={
-                "primary_client_name": client.get("name"),
-                "primary_client_id": client_id,
-                "primary_client_website": client.get("website"),
-                "last_user_message": content,
-                "conversation_id": conversation_id,
-                "has_uploaded_docs": has_uploaded_docs,
-            },
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"GPT or tool generation failed: {str(e)}"
-        )
-
-    # 9) Persist assistant reply
-    assistant_msg = {
-        "id": str(uuid4()),
-        "conversation_id": conversation_id,
-        "user_id": user_id,
-        "role": "assistant",
-        "content": {"text": assistant_text},
-        "tokens": count_tokens(assistant_text),
-        "created_at": datetime.now(timezone.utc).isoformat(),
-    }
-    supabase.table("messages").insert(assistant_msg).execute()
-
-    # 10) Maybe update summary (non fatal)
-    try:
-        maybe_update_summary(conversation_id)
-    except Exception as e:
-        print(f"[SUMMARY] update failed: {e}")
+@router.post("/with-files/stream")
+async def create_message_with_files_stream(
+    conversation_id: str = Form(...),
+    content: str = Form(""),
+    user_id: Optional[str] = Form(None),
+    files: List[UploadFile] = File(default_factory=list),
+):
+    """
+    Streaming variant of `POST /with-files`: files are uploaded and indexed before the
+    stream opens, then the reply is sent as server-sent events like `POST /stream`.
+    """
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id is required")
 
-    return {
-        "status": "success",
-        "message": {"role": "assistant", "content": assistant_text},
-        "client": {"name": client.get("name")},
-        "debug": {
-            "tool_audit": tool_audit,
-            "attached_documents": attached_docs,
-            "upload_docs_count": upload_docs_count,
-            "has_uploaded_docs": has_uploaded_docs,
-            "attached_docs_context_preview": attached_docs_context[:500] if attached_docs_context else None,
-        },
-    }
+    message_id = await asyncio.to_thread(_insert_user_message, conversation_id, user_id, content)
+    client_id = await _client_id_for(conversation_id)
+    attached_docs = await _save_uploads(message_id, conversation_id, client_id, files)
+    prep = await _prepare(conversation_id, content, client_id)
+    return _stream_reply(conversation_id, user_id, message_id, prep, attached_documents=attached_docs)
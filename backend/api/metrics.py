@@ -0,0 +1,29 @@
+from fastapi import APIRouter
+
+from services.llm.gpt_tool_service import get_stream_stats
+from services.llm.prompt_assembly import get_prompt_cache_stats
+from services.rag.core import get_result_cache
+from services.rag.embeddings import get_embedding_cache
+from services.rag.intent_router import get_intent_router_stats
+from services.rag.knowledge_version import current_knowledge_version
+from services.rag.speculative import get_speculative_stats
+
+router = APIRouter()
+
+
+@router.get("/")
+def get_metrics():
+    """
+    Retrieval cache counters, intent router / speculative retrieval hits, prompt-prefix cache
+    (cached prompt tokens) and streamed-reply latency (TTFT) for this API worker.
+    """
+    embedding_cache = get_embedding_cache()
+    return {
+        "knowledge_version": current_knowledge_version(),
+        "rag_result_cache": get_result_cache().stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "intent_router": get_intent_router_stats(),
+        "speculative_retrieval": get_speculative_stats(),
+        "prompt_cache": get_prompt_cache_stats(),
+        "streamed_replies": get_stream_stats(),
+    }
@@ -1,3 +1,8 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -5,8 +10,22 @@ from fastapi.middleware.cors import CORSMiddleware
 from api.clients import router as clients_router
 from api.conversations import router as conversations_router
 from api.messages import router as messages_router
+from api.metrics import router as metrics_router
+
+# Threads for blocking calls awaited via asyncio.to_thread (async message pipeline).
+# The loop's default executor is only min(32, cpus + 4) threads; 40 matches FastAPI's pool for sync routes.
+IO_THREADS = int(os.getenv("IO_THREADS", "40"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io")
+    )
+    yield
+
 
-app = FastAPI(title="QUORRA LLM API")
+app = FastAPI(title="QUORRA LLM API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,3 +44,4 @@ def health():
 app.include_router(clients_router, prefix="/clients", tags=["Clients"])
 app.include_router(conversations_router, prefix="/conversations", tags=["Conversations"])
 app.include_router(messages_router, prefix="/messages", tags=["Messages"])
+app.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
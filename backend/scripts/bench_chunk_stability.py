@@ -0,0 +1,127 @@
+# backend/scripts/bench_chunk_stability.py
+"""
+Replay a series of document edits and report how many chunks survive each edit
+for the fixed-window chunker vs the content-defined ("cdc") chunker.
+
+A chunk "survives" when an identical chunk exists after the edit, i.e. the sync
+would reuse its row and embedding instead of re-embedding it.
+
+Usage (from backend/):
+    python -m scripts.bench_chunk_stability [path/to/document.txt]
+"""
+
+import random
+import sys
+from collections import Counter
+from typing import Callable, List, Tuple
+
+from services.rag.chunking import chunk_text_cdc, chunk_text_fixed
+
+WORDS = (
+    "client campaign budget launch review follow up deliverable timeline landing page "
+    "conversion email sequence retargeting audience creative approval invoice report "
+    "dashboard meeting agreed promised owner deadline analytics ads funnel brand"
+).split()
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+
+
+def synthetic_meeting_note(seed: int = 7, sections: int = 12) -> str:
+    rng = random.Random(seed)
+    lines: List[str] = []
+    for s in range(sections):
+        lines.append(f"## Section {s + 1}: {rng.choice(WORDS).title()} update")
+        for _ in range(rng.randint(2, 5)):
+            lines.append(_paragraph(rng))
+    return "\n".join(lines)
+
+
+def _edits(seed: int = 11) -> List[Tuple[str, Callable[[List[str]], List[str]]]]:
+    rng = random.Random(seed)
+
+    def insert_top(lines):
+        return lines[:1] + [_paragraph(rng)] + lines[1:]
+
+    def edit_middle_sentence(lines):
+        i = len(lines) // 2
+        while lines[i].startswith("#"):
+            i += 1
+        out = list(lines)
+        out[i] = out[i].replace(".", ". " + _sentence(rng), 1)
+        return out
+
+    def delete_paragraph(lines):
+        i = len(lines) // 3
+        return lines[:i] + lines[i + 1:]
+
+    def insert_section_middle(lines):
+        i = len(lines) // 2
+        return lines[:i] + ["## New section: action items", _paragraph(rng), _paragraph(rng)] + lines[i:]
+
+    def append_tail(lines):
+        return lines + [_paragraph(rng)]
+
+    def typo_fix_top(lines):
+        out = list(lines)
+        out[1] = out[1].replace("client", "Client", 1)
+        return out
+
+    return [
+        ("insert paragraph near top", insert_top),
+        ("edit one sentence mid-doc", edit_middle_sentence),
+        ("delete a paragraph", delete_paragraph),
+        ("insert section mid-doc", insert_section_middle),
+        ("append paragraph at end", append_tail),
+        ("fix a typo near top", typo_fix_top),
+    ]
+
+
+def survival(before: List[str], after: List[str]) -> Tuple[float, int, int]:
+    """(fraction of old chunks reused, chunks to embed, total new chunks)."""
+    old, new = Counter(before), Counter(after)
+    reused = sum((old & new).values())
+    return (reused / len(before) if before else 1.0), len(after) - reused, len(after)
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = synthetic_meeting_note()
+
+    chunkers = {"fixed": chunk_text_fixed, "cdc": chunk_text_cdc}
+    lines = text.split("\n")
+    print(f"Document: {len(text)} chars, {len(lines)} lines")
+    for name, fn in chunkers.items():
+        print(f"  {name:<5} → {len(fn(text))} chunks")
+
+    print(f"\n{'edit':<28} | {'fixed survive':>13} {'re-embed':>8} | {'cdc survive':>13} {'re-embed':>8}")
+    print("-" * 78)
+    totals = {name: [0.0, 0] for name in chunkers}
+    edits = _edits()
+    for label, edit in edits:
+        new_lines = edit(lines)
+        row = [f"{label:<28}"]
+        for name, fn in chunkers.items():
+            frac, to_embed, total = survival(fn("\n".join(lines)), fn("\n".join(new_lines)))
+            totals[name][0] += frac
+            totals[name][1] += to_embed
+            row.append(f"{frac:>13.0%} {f'{to_embed}/{total}':>8}")
+        print(" | ".join(row))
+        lines = new_lines  # edits accumulate, like a real document's history
+
+    print("-" * 78)
+    for name, (frac_sum, embedded) in totals.items():
+        print(f"{name:<5} mean survival={frac_sum / len(edits):.0%}  chunks re-embedded={embedded}")
+
+
+if __name__ == "__main__":
+    main()
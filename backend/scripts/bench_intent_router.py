@@ -0,0 +1,240 @@
+# backend/scripts/bench_intent_router.py
+"""
+End-to-end latency and tool-call counts of generate_gpt_reply_with_tools with the local
+intent router (services/rag/intent_router.py) off and on.
+
+The real tool loop, rag_search_tool, turn memo and router run; OpenAI and the search backend
+are replaced by stand-ins with sampled latencies (lognormal around --model-ms / --embed-ms /
+--search-ms):
+- embeddings live in a synthetic topic space: one center per label (the router's labels),
+  a query sits at its label's center plus a random pull toward another label (--ambiguity)
+  and noise (--noise); the router's seed examples are placed the same way
+- the stand-in model searches its query's true category unless a result for that category is
+  already in the prompt (so a wrong pre-run costs a model-initiated search), answers directly
+  for "none" turns, and otherwise answers after one search
+- --none-share of the turns need no retrieval
+
+Reports p50/p95 per turn, model calls and model-initiated tool calls per turn, how many turns
+the router pre-ran and how often its category was right. With learning on (INTENT_ROUTER_LEARN),
+the router also learns from the model's choices during the run, as it would in production.
+Needs the backend .env like the app itself (nothing is sent to Supabase or OpenAI).
+
+Usage (from backend/):
+    python -m scripts.bench_intent_router [--turns 200] [--concurrency 8] [--model-ms 500] [--embed-ms 150] [--search-ms 120]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import services.llm.gpt_tool_service as gpt_tool_service
+import services.rag.intent_router as intent_router
+import services.rag.tools.rag_search_tool as rag_search_tool
+from services.rag.core import RagChunk, RagResult
+from services.rag.vectors import unit
+
+DIMS = 256
+
+
+# -----------------------------
+# Stand-ins
+# -----------------------------
+class World:
+    """Synthetic embedding space + latencies shared by the stand-ins."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.labels = list(intent_router.SEED_EXAMPLES)
+        rng = np.random.default_rng(args.seed)
+        self.centers = {label: unit(rng.normal(size=DIMS)) for label in self.labels}
+        self.truth: Dict[str, str] = {}          # text → label
+        self.vectors: Dict[str, np.ndarray] = {}
+        self.cached: set = set()                 # texts the embedding cache would have
+        self.lock = threading.Lock()
+        self.rng = random.Random(args.seed)
+        for label, examples in intent_router.SEED_EXAMPLES.items():
+            for text in examples:
+                self.add(text, label)
+
+    def sleep(self, median_ms: float) -> None:
+        with self.lock:
+            delay = median_ms * self.rng.lognormvariate(0.0, 0.3)
+        time.sleep(delay / 1000)
+
+    def add(self, text: str, label: str) -> None:
+        rng = np.random.default_rng(int(hashlib.md5(text.encode()).hexdigest()[:8], 16))
+        other = self.labels[rng.integers(len(self.labels))]
+        pull = rng.uniform(0, self.args.ambiguity)
+        vec = self.centers[label] + pull * self.centers[other] + self.args.noise * rng.normal(size=DIMS) / np.sqrt(DIMS)
+        self.truth[text] = label
+        self.vectors[text] = unit(vec)
+
+    def embed(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        """One embeddings request (skipped when every text is cached, like the embedding cache)."""
+        with self.lock:
+            missing = [t for t in texts if t not in self.cached]
+            self.cached.update(texts)
+        if missing:
+            self.sleep(self.args.embed_ms)
+        out = []
+        for t in texts:
+            if t not in self.vectors:  # the model's rewrites: near their user message
+                base = t.split(" | ")[0]
+                self.add(t, self.truth.get(base, "none"))
+            out.append(self.vectors[t].tolist())
+        return out
+
+    def search_many(self, bodies: List[Any], vectors: Optional[List[List[float]]] = None) -> List[RagResult]:
+        if vectors is None:
+            self.embed([b.query for b in bodies])
+        self.sleep(self.args.search_ms)
+        return [
+            RagResult(query=b.query, results=[
+                RagChunk(
+                    chunk_id=f"{b.query}-{b.category}-{i}", document_id=f"doc-{b.category}", chunk_index=i,
+                    document_title=f"{b.category or 'GLOBAL'} doc", category=b.category,
+                    similarity=0.8 - 0.05 * i, content=f"Evidence {i} for {b.query}",
+                )
+                for i in range(4)
+            ])
+            for b in bodies
+        ]
+
+
+class StandInModel:
+    """chat.completions.create: search the true category once, then answer."""
+
+    def __init__(self, world: World) -> None:
+        self.world = world
+
+    def create(self, **kwargs: Any) -> SimpleNamespace:
+        self.world.sleep(self.world.args.model_ms)
+        messages = kwargs["messages"]
+        text = next(m["content"] for m in reversed(messages) if m["role"] == "user")
+        label = self.world.truth[text]
+        searched = {
+            json.loads(m["content"]).get("category")
+            for m in messages if m["role"] == "tool"
+        }
+        if label == "none" or label in searched or "tools" not in kwargs:
+            return _completion("Here is the answer.", None)
+        call = {
+            "id": f"call_{random.getrandbits(48):x}",
+            "type": "function",
+            "function": {"name": "rag_search_tool", "arguments": json.dumps({"query": f"{text} | rewritten", "category": label})},
+        }
+        return _completion("", [SimpleNamespace(model_dump=lambda: call)])
+
+
+def _completion(content: str, tool_calls: Optional[List[Any]]) -> SimpleNamespace:
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+
+# -----------------------------
+# Bench
+# -----------------------------
+def make_turns(world: World, n: int, none_share: float) -> List[str]:
+    rng = random.Random(world.args.seed + 1)
+    categories = [label for label in world.labels if label != "none"]
+    turns = []
+    for i in range(n):
+        label = "none" if rng.random() < none_share else rng.choice(categories)
+        text = f"turn {i}: a {label} question"
+        world.add(text, label)
+        turns.append(text)
+    return turns
+
+
+def run_pattern(world: World, turns: List[str], router_on: bool, concurrency: int) -> Dict[str, Any]:
+    gpt_tool_service.INTENT_ROUTER_ENABLED = router_on
+    intent_router._router = intent_router.IntentRouter(embed=world.embed)  # fresh centroids per pattern
+    world.cached = set()
+    rows: List[Dict[str, Any]] = []
+
+    def one(text: str) -> None:
+        tool_context = {"conversation_id": text, "primary_client_id": "client-1", "has_uploaded_docs": True}
+        start = time.perf_counter()
+        _, audit = gpt_tool_service.generate_gpt_reply_with_tools(
+            [{"role": "system", "content": "You are QUORRA."}, {"role": "user", "content": text}],
+            tool_context=tool_context,
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        pre = next((a for a in audit if a.get("router")), None)
+        rows.append({
+            "ms": elapsed,
+            "model_tool_calls": sum(1 for a in audit if not a.get("router")),
+            "pre_ran": pre is not None,
+            "pre_right": pre is not None and pre["router"]["label"] == world.truth[text],
+        })
+
+    model = StandInModel(world)
+    model_calls = []
+
+    def counted_create(**kwargs: Any) -> SimpleNamespace:
+        model_calls.append(1)
+        return model.create(**kwargs)
+
+    gpt_tool_service._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=counted_create)))
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, turns))
+
+    ms = np.array([r["ms"] for r in rows])
+    pre = [r for r in rows if r["pre_ran"]]
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "model_calls": len(model_calls) / len(rows),
+        "model_tool_calls": sum(r["model_tool_calls"] for r in rows) / len(rows),
+        "pre_ran": len(pre) / len(rows),
+        "pre_right": (sum(r["pre_right"] for r in pre) / len(pre)) if pre else None,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--model-ms", type=float, default=500.0, help="median chat completion latency")
+    ap.add_argument("--embed-ms", type=float, default=150.0, help="median embeddings request latency")
+    ap.add_argument("--search-ms", type=float, default=120.0, help="median vector search latency")
+    ap.add_argument("--none-share", type=float, default=0.2, help="share of turns that need no retrieval")
+    ap.add_argument("--ambiguity", type=float, default=1.0, help="max pull of a query toward another label")
+    ap.add_argument("--noise", type=float, default=1.5, help="spread of queries around their label")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    world = World(args)
+    rag_search_tool.embed_texts = world.embed
+    rag_search_tool.rag_search_many = world.search_many
+    rag_search_tool.rag_search = lambda body: world.search_many([body])[0]
+    gpt_tool_service.SPECULATIVE_ENABLED = False
+    turns = make_turns(world, args.turns, args.none_share)
+
+    print(
+        f"{args.turns} turns ({args.none_share:.0%} need no retrieval), {args.concurrency} in flight, "
+        f"model ~{args.model_ms:g}ms, embed ~{args.embed_ms:g}ms, search ~{args.search_ms:g}ms, "
+        f"min confidence {intent_router.INTENT_ROUTER_MIN_CONFIDENCE:g}"
+    )
+    print(f"{'router':>6} | {'p50 ms':>8} | {'p95 ms':>8} | {'model calls':>11} | {'model tools':>11} | {'pre-ran':>7} | {'right':>6}")
+    print("-" * 74)
+    for router_on in (False, True):
+        r = run_pattern(world, turns, router_on, args.concurrency)
+        right = f"{r['pre_right']:.0%}" if r["pre_right"] is not None else "-"
+        print(
+            f"{'on' if router_on else 'off':>6} | {r['p50']:>8.1f} | {r['p95']:>8.1f} | "
+            f"{r['model_calls']:>11.2f} | {r['model_tool_calls']:>11.2f} | {r['pre_ran']:>7.0%} | {right:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# backend/scripts/bench_matryoshka.py
+"""
+Benchmark two-stage Matryoshka search in the local index against the full-width first pass,
+at the top_k values rag_search_tool uses (normal = 12, website_full = 48).
+
+The synthetic corpus mimics text-embedding-3's Matryoshka layout: per-dimension variance
+decays along the vector, so a prefix carries most of the signal. Real embeddings should be
+checked with `--from-index` (reads the vectors of an existing RAG_INDEX_DIR instead).
+
+Usage (from backend/):
+    python -m scripts.bench_matryoshka [--rows 20000] [--dims 1536] [--short 256] [--queries 200] [--hnsw]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import services.rag.local_index as local_index
+from services.rag.local_index import LocalVectorIndex
+
+# rag_search_tool's DEFAULT_TOP_K / WEBSITE_FULL_TOP_K (not imported: it pulls in Supabase)
+DEFAULT_TOP_K = 12
+WEBSITE_FULL_TOP_K = 48
+
+
+def synthetic_corpus(rows: int, dims: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors whose per-dimension scale decays like a Matryoshka embedding."""
+    rng = np.random.default_rng(seed)
+    decay = (1.0 + np.arange(dims, dtype=np.float32)) ** -0.5
+    centers = rng.normal(size=(max(rows // 100, 8), dims)).astype(np.float32)
+    assign = rng.integers(0, len(centers), rows)
+    data = (centers[assign] + 0.6 * rng.normal(size=(rows, dims)).astype(np.float32)) * decay
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def index_corpus(root: str) -> np.ndarray:
+    index = LocalVectorIndex(root)
+    index.refresh()
+    if not index._live:
+        raise SystemExit(f"No segments in {root}")
+    return np.concatenate([np.asarray(seg.vectors) for seg in index._live])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--dims", type=int, default=1536)
+    ap.add_argument("--short", type=int, default=256, help="Matryoshka prefix length")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--hnsw", action="store_true", help="build the HNSW graph instead of brute force")
+    ap.add_argument("--from-index", default="", help="benchmark the vectors of an existing index dir")
+    args = ap.parse_args()
+
+    corpus = index_corpus(args.from_index) if args.from_index else synthetic_corpus(args.rows, args.dims)
+    n, dims = corpus.shape
+    local_index.HNSW_MIN_ROWS = 0 if args.hnsw else n + 1
+
+    rng = np.random.default_rng(1)
+    # Queries: corpus points plus noise of norm ~0.5 (a paraphrase, not an exact copy)
+    queries = corpus[rng.integers(0, n, args.queries)] + (0.5 / np.sqrt(dims)) * rng.normal(
+        size=(args.queries, dims)
+    ).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    ranked = [np.argsort(-(corpus @ q)) for q in queries]
+
+    rows = [
+        {"chunk_id": str(i), "document_id": str(i // 10), "chunk_index": i % 10,
+         "doc_title": "", "category": "sops", "content": "", "embedding": corpus[i]}
+        for i in range(n)
+    ]
+
+    configs = [
+        ("full / float32", "none", 0),
+        ("full / int8", "int8", 0),
+        (f"{args.short}-d / float32", "none", args.short),
+        (f"{args.short}-d / int8", "int8", args.short),
+    ]
+    print(f"Corpus: {n} x {dims}, {args.queries} queries, {'HNSW' if args.hnsw else 'brute force'}, "
+          f"rerank x{local_index.RERANK_FACTOR} (full) / x{local_index.MATRYOSHKA_RERANK_FACTOR} (prefix)")
+    print(f"{'first pass':<16} | {'scan MB':>8} | {'top_k':>5} | {'p50 ms':>7} | {'p95 ms':>7} | {'recall':>7}")
+    print("-" * 66)
+    for label, mode, short in configs:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = LocalVectorIndex(tmp, quantization=mode, matryoshka_dims=short)
+            index.rebuild(rows)
+            index.refresh()
+            seg = index._live[0]
+            first = seg.short if short else seg.coarse
+            scanned = first.nbytes if first is not None else seg.vectors.nbytes
+
+            for k in (DEFAULT_TOP_K, WEBSITE_FULL_TOP_K):
+                index.search(queries[0], top_k=k)  # warm the page cache
+                latencies, recalls = [], []
+                for q, order in zip(queries, ranked):
+                    start = time.perf_counter()
+                    res = index.search(q, top_k=k)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    exact = set(order[:k].tolist())
+                    recalls.append(len({int(r["chunk_id"]) for r in res} & exact) / k)
+                p50, p95 = np.percentile(latencies, [50, 95])
+                print(f"{label:<16} | {scanned / 2**20:>8.1f} | {k:>5} | {p50:>7.2f} | {p95:>7.2f} | "
+                      f"{np.mean(recalls):>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# backend/scripts/bench_message_pipeline.py
+"""
+Measure the Supabase part of a chat turn (everything before the model is called) for three
+request patterns:
+- sequential: the reads one after another (the old synchronous create_message order)
+- async:      services/llm/turn_context.py with separate queries, independent ones concurrently
+- rpc:        turn_context.py with the single get_turn_context RPC (sql/006)
+
+Supabase is replaced by an in-process stand-in that sleeps a sampled round-trip time per
+request (lognormal around --rtt-ms), so only the request pattern is measured; its RPC is
+answered in Python, at the cost of one round trip. Each turn
+gets a fresh conversation with 9 messages, one of them with an attached document, so every
+read of the real turn happens: insert, message count, conversation, upload count, client, summary,
+history, message_documents links, documents.
+
+Reports round trips and p50/p95 per turn, for one turn at a time and for --concurrency turns in flight.
+Blocking calls run on a --threads pool (IO_THREADS in app.py; FastAPI's pool for sync routes).
+Needs the backend .env like the app itself (the app modules are imported; nothing is sent
+to Supabase or OpenAI).
+
+Usage (from backend/):
+    python -m scripts.bench_message_pipeline [--turns 200] [--rtt-ms 20] [--concurrency 8] [--threads 40]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import copy
+import io
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+import api.messages as messages_api
+import services.llm.turn_context as turn_context
+
+CLIENT_ID = "00000000-0000-0000-0000-00000000c11e"
+
+
+# -----------------------------
+# Supabase stand-in
+# -----------------------------
+class _Query:
+    def __init__(self, db: "StandIn", table: str) -> None:
+        self.db, self.table, self.filters = db, table, []
+        self.op, self.payload, self.count, self.order_by, self.max_rows = "select", None, None, None, None
+
+    def select(self, _cols: str = "*", count: str = None) -> "_Query":
+        self.op, self.count = "select", count
+        return self
+
+    def eq(self, key: str, value: Any) -> "_Query":
+        self.filters.append(lambda r: r.get(key) == value)
+        return self
+
+    def in_(self, key: str, values: List[Any]) -> "_Query":
+        values = set(values)
+        self.filters.append(lambda r: r.get(key) in values)
+        return self
+
+    def order(self, key: str, desc: bool = False) -> "_Query":
+        self.order_by = (key, desc)
+        return self
+
+    def limit(self, n: int) -> "_Query":
+        self.max_rows = n
+        return self
+
+    def insert(self, payload: Dict[str, Any]) -> "_Query":
+        self.op, self.payload = "insert", payload
+        return self
+
+    def update(self, payload: Dict[str, Any]) -> "_Query":
+        self.op, self.payload = "update", payload
+        return self
+
+    def execute(self) -> SimpleNamespace:
+        self.db.round_trip()
+        with self.db.lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            if self.op == "insert":
+                rows.append(dict(self.payload))
+                return SimpleNamespace(data=[copy.deepcopy(self.payload)], count=None)
+            matched = [r for r in rows if all(f(r) for f in self.filters)]
+            if self.op == "update":
+                for r in matched:
+                    r.update(self.payload)
+                return SimpleNamespace(data=copy.deepcopy(matched), count=None)
+            if self.order_by:
+                key, desc = self.order_by
+                matched = sorted(matched, key=lambda r: r.get(key), reverse=desc)
+            count = len(matched) if self.count else None
+            if self.max_rows is not None:
+                matched = matched[: self.max_rows]
+            return SimpleNamespace(data=copy.deepcopy(matched), count=count)
+
+
+class StandIn:
+    """Enough of the supabase client for api/messages.py, with a sleep per round trip."""
+
+    def __init__(self, rtt_ms: float, seed: int) -> None:
+        self.rtt_ms = rtt_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.trips = 0
+
+    def round_trip(self) -> None:
+        with self.lock:
+            self.trips += 1
+            delay = self.rtt_ms * self.rng.lognormvariate(0.0, 0.35)
+        time.sleep(delay / 1000)
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> SimpleNamespace:
+        assert name == "get_turn_context", name
+        return SimpleNamespace(execute=lambda: self._turn_context(params))
+
+    def _turn_context(self, params: Dict[str, Any]) -> SimpleNamespace:
+        self.round_trip()
+        cid, limit = params["in_conversation"], params["history_limit"]
+        with self.lock:
+            t = self.tables
+            convo = next((c for c in t["conversations"] if c["id"] == cid), None)
+            msgs = [m for m in t["messages"] if m["conversation_id"] == cid]
+            recent = sorted(msgs, key=lambda m: m["created_at"], reverse=True)[:limit]
+            recent_ids = {m["id"] for m in recent}
+            docs = {d["id"]: d for d in t["knowledge_documents"]}
+            data = {
+                "conversation": convo,
+                "client": next((c for c in t["clients"] if convo and c["id"] == convo["client_id"]), None),
+                "summary": next((s["summary"] for s in t["conversation_summary"] if s["conversation_id"] == cid), None),
+                "message_count": len(msgs),
+                "upload_docs_count": sum(1 for d in docs.values() if d["source"] == "upload" and d["conversation_id"] == cid),
+                "history": copy.deepcopy(list(reversed(recent))),
+                "attached_docs": [
+                    {"message_id": md["message_id"], "document_id": md["document_id"],
+                     "title": docs[md["document_id"]]["title"], "raw_text": docs[md["document_id"]]["raw_text"][: params["doc_chars"]]}
+                    for md in t["message_documents"] if md["message_id"] in recent_ids
+                ],
+            }
+        return SimpleNamespace(data=data)
+
+
+def seed_conversation(db: StandIn) -> str:
+    """A fresh conversation with 9 messages (one with an upload); the turn adds the 10th."""
+    cid = str(uuid.uuid4())
+    t = db.tables
+    with db.lock:
+        if not t.get("clients"):
+            t["clients"] = [{"id": CLIENT_ID, "name": "Acme", "website": "https://acme.example", "products": ["SEO"]}]
+        t.setdefault("conversations", []).append({"id": cid, "client_id": CLIENT_ID})
+        t.setdefault("conversation_summary", []).append({"conversation_id": cid, "summary": "Earlier: pricing questions."})
+        t.setdefault("knowledge_documents", []).append({
+            "id": f"doc-{cid}", "title": "brief.pdf", "raw_text": "Campaign brief. " * 50,
+            "source": "upload", "conversation_id": cid,
+        })
+        for i in range(9):
+            t.setdefault("messages", []).append({
+                "id": f"{cid}-m{i}", "conversation_id": cid, "role": "user" if i % 2 == 0 else "assistant",
+                "content": {"text": f"message {i}"}, "created_at": f"2025-01-01T00:00:{i:02d}+00:00",
+            })
+        t.setdefault("message_documents", []).append({"message_id": f"{cid}-m7", "document_id": f"doc-{cid}"})
+    return cid
+
+
+def drop_conversation(db: StandIn, cid: str) -> None:
+    """Keep the stand-in small: its scans are CPU work that would skew later turns."""
+    with db.lock:
+        for name, rows in db.tables.items():
+            if name != "clients":
+                db.tables[name] = [
+                    r for r in rows
+                    if cid not in (r.get("conversation_id"), r.get("id"), r.get("document_id"))
+                    and not str(r.get("message_id", "")).startswith(cid)
+                ]
+
+
+# -----------------------------
+# The request patterns
+# -----------------------------
+def sequential_turn(conversation_id: str, content: str) -> None:
+    """The old create_message order: every read waits for the previous one."""
+    tc = turn_context
+    messages_api._insert_user_message(conversation_id, "bench-user", content)
+    tc._count("messages", conversation_id=conversation_id)
+    client_id = tc.get_conversation_client_id(conversation_id)
+    tc._count("knowledge_documents", source="upload", conversation_id=conversation_id)
+    tc._get_client(client_id)
+    tc._get_summary(conversation_id)
+    history = tc._get_history(conversation_id)
+    tc._get_attached_docs(history)                      # links + documents
+
+
+async def prepared_turn(conversation_id: str, content: str) -> None:
+    """What the endpoints do now: insert, then turn_context.prepare_reply."""
+    await asyncio.to_thread(messages_api._insert_user_message, conversation_id, "bench-user", content)
+    await turn_context.prepare_reply(conversation_id, content)
+
+
+async def measure(db: StandIn, run_one: Callable[[str, str], Any], turns: int, concurrency: int, threads: int) -> np.ndarray:
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=threads))
+    latencies: List[float] = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with gate:
+            conversation_id = seed_conversation(db)
+            start = time.perf_counter()
+            await run_one(conversation_id, f"turn {i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+            drop_conversation(db, conversation_id)
+
+    await asyncio.gather(*(one(i) for i in range(turns)))
+    return np.array(latencies)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=200)
+    ap.add_argument("--rtt-ms", type=float, default=20.0, help="median Supabase round trip")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--threads", type=int, default=40)
+    args = ap.parse_args()
+
+    db = StandIn(args.rtt_ms, seed=0)
+    messages_api.supabase = db
+    turn_context.supabase = db
+
+    patterns = {
+        # a sync handler runs in FastAPI's thread pool; model that with to_thread
+        "sequential": (False, lambda cid, content: asyncio.to_thread(sequential_turn, cid, content)),
+        "async": (False, prepared_turn),
+        "rpc": (True, prepared_turn),
+    }
+    print(f"{args.turns} turns, Supabase round trip ~{args.rtt_ms:g}ms (lognormal)")
+    print(f"{'pattern':>10} | {'in flight':>9} | {'trips':>5} | {'p50 ms':>8} | {'p95 ms':>8}")
+    print("-" * 54)
+    for concurrency in sorted({1, args.concurrency}):
+        for name, (use_rpc, run_one) in patterns.items():
+            turn_context.TURN_CONTEXT_RPC = use_rpc
+            trips_before = db.trips
+            with contextlib.redirect_stdout(io.StringIO()):   # the pipeline's debug prints
+                lat = asyncio.run(measure(db, run_one, args.turns, concurrency, args.threads))
+            trips = (db.trips - trips_before) / args.turns
+            print(
+                f"{name:>10} | {concurrency:>9} | {trips:>5.1f} | "
+                f"{np.percentile(lat, 50):>8.1f} | {np.percentile(lat, 95):>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# backend/scripts/bench_partitioned_index.py
+"""
+Benchmark partitioned scans in the local index as the number of clients grows.
+
+Each client gets the same number of website chunks, plus a fixed pool of global SOP chunks.
+For every client count we time:
+  * scoped    → website search for one client (what rag_search_tool sends for category=website)
+  * global    → unfiltered search (fans out over all partitions and merges top-k)
+  * mask scan → the pre-partitioning strategy for the scoped query: build a filter mask over
+                the whole segment, then scan the surviving rows (shown for comparison)
+
+Scoped latency should stay roughly flat while global latency grows with the corpus.
+
+Usage (from backend/):
+    python -m scripts.bench_partitioned_index [--clients 10,100,1000] [--per-client 100] [--dims 384]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import services.rag.local_index as local_index
+from services.rag.local_index import LocalVectorIndex
+
+
+def build_rows(clients: int, per_client: int, global_rows: int, dims: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    n = clients * per_client + global_rows
+    vectors = rng.normal(size=(n, dims)).astype(np.float32)
+    for i in range(n):
+        scoped = i < clients * per_client
+        rows.append({
+            "chunk_id": str(i), "document_id": str(i // 10), "chunk_index": i % 10, "doc_title": "",
+            "category": "website" if scoped else "sops",
+            "client_id": f"client-{i // per_client}" if scoped else None,
+            "content": "", "embedding": vectors[i],
+        })
+    return rows
+
+
+def time_queries(fn, queries) -> float:
+    fn(queries[0])  # warm up
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(latencies, 50))
+
+
+def mask_scan(seg, columns, client_id: str, q: np.ndarray, k: int) -> np.ndarray:
+    """Old path for a scoped query: per-row filter mask over the segment, then scan survivors."""
+    categories, clients = columns  # precomputed once, like the old per-segment code columns
+    idx = np.flatnonzero((categories == "website") & (clients == client_id))
+    sims = seg.coarse.dot(q, idx)
+    return idx[np.argsort(-sims)[:k]]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", default="10,100,1000")
+    ap.add_argument("--per-client", type=int, default=100)
+    ap.add_argument("--global-rows", type=int, default=5000)
+    ap.add_argument("--dims", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--k", type=int, default=12)
+    args = ap.parse_args()
+
+    local_index.HNSW_MIN_ROWS = 1 << 30  # brute force only: isolate the partitioning effect
+    rng = np.random.default_rng(1)
+    queries = rng.normal(size=(args.queries, args.dims)).astype(np.float32)
+
+    print(f"{args.per_client} website chunks/client + {args.global_rows} global chunks, "
+          f"dims={args.dims}, k={args.k}, p50 latency")
+    print(f"{'clients':>8} | {'rows':>8} | {'scoped ms':>9} | {'global ms':>9} | {'mask scan ms':>12}")
+    print("-" * 60)
+    for clients in (int(c) for c in args.clients.split(",")):
+        rows = build_rows(clients, args.per_client, args.global_rows, args.dims)
+        with tempfile.TemporaryDirectory() as tmp:
+            index = LocalVectorIndex(tmp, quantization="int8", matryoshka_dims=0)
+            index.rebuild(rows)
+            index.refresh()
+            seg = index._live[0]
+            target = f"client-{clients // 2}"
+            columns = (
+                np.array([r.get("category") or "" for r in seg.rows]),
+                np.array([r.get("client_id") or "" for r in seg.rows]),
+            )
+
+            scoped = time_queries(
+                lambda q: index.search(q, top_k=args.k, category="website", client_id=target), queries,
+            )
+            global_ = time_queries(lambda q: index.search(q, top_k=args.k), queries)
+            masked = time_queries(lambda q: mask_scan(seg, columns, target, q, args.k), queries)
+            print(f"{clients:>8} | {len(rows):>8} | {scoped:>9.2f} | {global_:>9.2f} | {masked:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
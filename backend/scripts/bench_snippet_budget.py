@@ -0,0 +1,74 @@
+# backend/scripts/bench_snippet_budget.py
+"""
+Compare the char-capped top-N packer with token-budget packing on candidate lists whose
+chunks vary a lot in length (short SOP bullets next to long meeting-note chunks).
+
+Reports, per setting: tokens in the snippets block actually sent to the model, snippets
+included, summed similarity of what was included, and the best similarity kept.
+
+Usage (from backend/):
+    python -m scripts.bench_snippet_budget [--final 6] [--trials 50] [--budgets 600,1000,1500]
+"""
+
+import argparse
+import random
+
+import numpy as np
+
+from services.rag.embeddings import count_embedding_tokens
+from services.rag.snippets import pack_snippets_with_meta
+
+_WORDS = [f"w{i}" for i in range(3000)]
+
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 24))).capitalize() + "."
+
+
+def candidates(rng: random.Random, n: int = 24):
+    rows = []
+    for i in range(n):
+        content = " ".join(sentence(rng) for _ in range(rng.choice((1, 2, 4, 8, 16, 24))))
+        rows.append({
+            "chunk_id": f"c{i}", "document_id": f"d{i}", "chunk_index": 0, "doc_title": f"Doc {i}",
+            "similarity": 0.78 - 0.012 * i + rng.uniform(-0.01, 0.01), "content": content,
+            "tokens": count_embedding_tokens(content),  # what sync stores per chunk
+        })
+    rows.sort(key=lambda r: r["similarity"], reverse=True)
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--final", type=int, default=6)
+    ap.add_argument("--trials", type=int, default=50)
+    ap.add_argument("--budgets", default="600,1000,1500")
+    args = ap.parse_args()
+
+    rng = random.Random(0)
+    trials = [candidates(rng) for _ in range(args.trials)]
+    settings = [("char cap top-N", 0)] + [(f"budget {b}", int(b)) for b in args.budgets.split(",")]
+
+    print(f"{args.trials} candidate lists, final={args.final}")
+    print(f"{'setting':<15} | {'block tok':>9} | {'snippets':>8} | {'sum sim':>7} | {'best_sim':>8}")
+    print("-" * 60)
+    for label, budget in settings:
+        block_tokens, count, total_sim, best = [], [], [], []
+        for rows in trials:
+            block, meta = pack_snippets_with_meta(
+                rows, min_similarity=0.0, final_count=args.final, mmr=False, max_per_document=0,
+                token_budget=budget,
+            )
+            block_tokens.append(meta["block_tokens"])
+            count.append(meta["included_count"])
+            total_sim.append(sum(
+                float(line.split("similarity:")[1].split(",")[0]) for line in block.splitlines()[1:-1]
+                if "similarity:" in line
+            ))
+            best.append(meta["best_similarity_included"])
+        print(f"{label:<15} | {np.mean(block_tokens):>9.0f} | {np.mean(count):>8.2f} | "
+              f"{np.mean(total_sim):>7.3f} | {np.mean(best):>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# backend/scripts/bench_snippet_merge.py
+"""
+Measure what merging adjacent chunks does to the snippets block.
+
+Candidates are fixed-mode chunks (MAX_CHARS windows with OVERLAP) of a few meeting notes,
+with each note's hits clustered around one spot, so runs like chunk_index 3, 4, 5 of the
+same note are common — the case the merge targets. Notes vary in length, so some runs
+include short tail chunks.
+
+Reports block tokens, snippet lines and overlap chars removed for the normal and website_full
+snippet counts, with RAG_SNIPPET_MERGE_ADJACENT off and on.
+
+Usage (from backend/):
+    python -m scripts.bench_snippet_merge [--docs 4] [--trials 50]
+"""
+
+import argparse
+import random
+
+import numpy as np
+
+import services.rag.snippets as snippets
+from services.rag.chunking import chunk_text_fixed
+
+_WORDS = [f"w{i}" for i in range(3000)]
+
+# Tool defaults (rag_search_tool pulls in Supabase on import): normal / website_full
+MODES = [("normal", 12, 6), ("website_full", 48, 18)]
+
+
+def note(rng: random.Random) -> str:
+    lines = []
+    for _ in range(rng.randint(10, 80)):
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 20)))
+        lines.append(words.capitalize() + ".")
+    return "\n".join(lines)
+
+
+def candidates(rng: random.Random, docs: int, top_k: int):
+    rows = []
+    for d in range(docs):
+        chunks = chunk_text_fixed(note(rng))
+        hot = rng.randrange(len(chunks))
+        base = 0.7 - 0.03 * d
+        for i, ch in enumerate(chunks):
+            rows.append({
+                "chunk_id": f"{d}-{i}", "document_id": str(d), "chunk_index": i, "doc_title": f"Note {d}",
+                "similarity": base - 0.02 * abs(i - hot) + rng.uniform(-0.01, 0.01), "content": ch,
+            })
+    rows.sort(key=lambda r: r["similarity"], reverse=True)
+    return rows[:top_k]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=4)
+    ap.add_argument("--trials", type=int, default=50)
+    args = ap.parse_args()
+
+    rng = random.Random(0)
+    print(f"{args.trials} candidate lists, {args.docs} notes each, char-capped packing")
+    print(f"{'mode':<13} | {'merge':>5} | {'block tok':>9} | {'lines':>5} | {'overlap chars':>13} | {'best_sim':>8}")
+    print("-" * 70)
+    for mode, top_k, final in MODES:
+        trials = [candidates(rng, args.docs, top_k) for _ in range(args.trials)]
+        for merge in (False, True):
+            snippets.SNIPPET_MERGE_ADJACENT = merge
+            tokens, lines, removed, best = [], [], [], []
+            for rows in trials:
+                block, meta = snippets.pack_snippets_with_meta(
+                    rows, min_similarity=0.0, final_count=final, mmr=False, max_per_document=0,
+                    token_budget=0,
+                )
+                tokens.append(meta["block_tokens"])
+                lines.append(meta["included_count"])
+                removed.append(meta["overlap_chars_removed"])
+                best.append(meta["best_similarity_included"])
+            print(f"{mode:<13} | {'on' if merge else 'off':>5} | {np.mean(tokens):>9.0f} | "
+                  f"{np.mean(lines):>5.1f} | {np.mean(removed):>13.0f} | {np.mean(best):>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# backend/scripts/bench_snippet_mmr.py
+"""
+Show what the MMR / per-document-cap stage in pack_snippets_with_meta does to a typical
+candidate list: neighbouring, overlapping chunks (chunk_text's 300-char overlap) of a few
+documents crowding the top of the ranking.
+
+Reports, per setting: included tokens, distinct documents, how many included chunks are
+direct neighbours of another included one (also inside merged passages), and the best
+similarity kept (the tool's `best_similarity` audit number).
+
+Usage (from backend/):
+    python -m scripts.bench_snippet_mmr [--docs 8] [--final 6] [--trials 50]
+"""
+
+import argparse
+import random
+
+import numpy as np
+
+from services.rag.chunking import chunk_text_fixed
+from services.rag.snippets import pack_snippets_with_meta
+
+_WORDS = [f"w{i}" for i in range(3000)]
+
+
+def candidates(rng: random.Random, docs: int):
+    """Chunks of `docs` documents; one hot spot per document, neighbours score almost as high."""
+    rows = []
+    for d in range(docs):
+        text = "\n".join(
+            " ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 20))) for _ in range(120)
+        )
+        chunks = chunk_text_fixed(text)
+        hot = rng.randrange(len(chunks))
+        base = 0.75 - 0.04 * d + rng.uniform(-0.02, 0.02)
+        for i, ch in enumerate(chunks):
+            sim = base - 0.015 * abs(i - hot) ** 1.5 + rng.uniform(-0.005, 0.005)
+            rows.append({"chunk_id": f"{d}-{i}", "document_id": str(d), "chunk_index": i,
+                         "doc_title": f"Doc {d}", "similarity": sim, "content": ch})
+    rows.sort(key=lambda r: r["similarity"], reverse=True)
+    return rows[:48]
+
+
+def adjacent_pairs(chunk_ids) -> int:
+    """
+    Included chunks that are direct neighbours (overlapping chunks) of another included one.
+    Counted from meta["included_chunk_ids"], so chunks merged into one passage
+    (RAG_SNIPPET_MERGE_ADJACENT, on by default) still count.
+    """
+    ids = {tuple(map(int, cid.split("-"))) for cid in chunk_ids}
+    return sum((d, i + 1) in ids for d, i in ids)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=8)
+    ap.add_argument("--final", type=int, default=6)
+    ap.add_argument("--trials", type=int, default=50)
+    args = ap.parse_args()
+
+    settings = [
+        ("top-N (current)", dict(mmr=False, max_per_document=0)),
+        ("doc cap 2", dict(mmr=False, max_per_document=2)),
+        ("MMR λ=0.9", dict(mmr=True, mmr_lambda=0.9, max_per_document=0)),
+        ("MMR λ=0.7", dict(mmr=True, mmr_lambda=0.7, max_per_document=0)),
+        ("MMR λ=0.7 + cap 2", dict(mmr=True, mmr_lambda=0.7, max_per_document=2)),
+        ("MMR λ=0.5", dict(mmr=True, mmr_lambda=0.5, max_per_document=0)),
+    ]
+    rng = random.Random(0)
+    trials = [candidates(rng, args.docs) for _ in range(args.trials)]
+
+    print(f"{args.trials} candidate lists, {args.docs} docs each, final={args.final}")
+    print(f"{'setting':<18} | {'tokens':>7} | {'docs':>5} | {'adjacent':>8} | {'best_sim':>8}")
+    print("-" * 59)
+    for label, kw in settings:
+        tokens, docs, dup, best = [], [], [], []
+        for rows in trials:
+            _, meta = pack_snippets_with_meta(rows, min_similarity=0.0, final_count=args.final, **kw)
+            tokens.append(meta["included_tokens"])
+            docs.append(meta["included_documents"])
+            dup.append(adjacent_pairs(meta["included_chunk_ids"]))
+            best.append(meta["best_similarity_included"])
+        print(f"{label:<18} | {np.mean(tokens):>7.0f} | {np.mean(docs):>5.2f} | {np.mean(dup):>8.2f} | "
+              f"{np.mean(best):>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
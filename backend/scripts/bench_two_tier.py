@@ -0,0 +1,62 @@
+# backend/scripts/bench_two_tier.py
+"""
+Simulate two-tier retrieval (documents by summary embedding, then only their chunks) on a
+synthetic meeting-note archive, to size RAG_TWO_TIER_DOCS before turning it on.
+
+Each document has a topic; its chunks are the topic plus noise, and the "summary embedding"
+is the normalized mean of its chunks (a stand-in for embedding the LLM summary). Queries are
+perturbed chunks. For each doc_count we report how many chunks the second tier ranks and
+recall@k against the flat search over every chunk.
+
+Usage (from backend/):
+    python -m scripts.bench_two_tier [--docs 5000] [--chunks 8] [--dims 256] [--k 12]
+"""
+
+import argparse
+
+import numpy as np
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=5000)
+    ap.add_argument("--chunks", type=int, default=8)
+    ap.add_argument("--dims", type=int, default=256)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--doc-counts", default="5,10,20,50")
+    ap.add_argument("--spread", type=float, default=1.0, help="chunk noise relative to the topic")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    topics = normalize(rng.normal(size=(args.docs, args.dims)))
+    noise = rng.normal(size=(args.docs, args.chunks, args.dims)) / np.sqrt(args.dims)
+    chunks = normalize(topics[:, None, :] + args.spread * noise)  # chunks wander off the topic
+    summaries = normalize(chunks.mean(axis=1))
+    flat = chunks.reshape(-1, args.dims)
+    doc_of = np.repeat(np.arange(args.docs), args.chunks)
+
+    picks = rng.integers(0, len(flat), size=args.queries)
+    queries = normalize(flat[picks] + rng.normal(size=(args.queries, args.dims)) / np.sqrt(args.dims))
+
+    exact = [set(np.argsort(-(flat @ q))[:args.k]) for q in queries]
+    print(f"{args.docs} docs × {args.chunks} chunks = {len(flat)} chunks, k={args.k}")
+    print(f"{'doc_count':>9} | {'chunks ranked':>13} | {'recall@k':>8}")
+    print("-" * 38)
+    print(f"{'flat':>9} | {len(flat):>13} | {1.0:>8.3f}")
+    for doc_count in (int(d) for d in args.doc_counts.split(",")):
+        recalls = []
+        for q, truth in zip(queries, exact):
+            top_docs = np.argsort(-(summaries @ q))[:doc_count]
+            idx = np.flatnonzero(np.isin(doc_of, top_docs))
+            found = set(idx[np.argsort(-(flat[idx] @ q))[:args.k]])
+            recalls.append(len(found & truth) / args.k)
+        print(f"{doc_count:>9} | {doc_count * args.chunks:>13} | {np.mean(recalls):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,37 @@ Tool-calling runner for QUORRA.
 - Gives the model ONE tool for now: `rag_search_tool` (defined in services/tools/rag_search_tool.py)
 - Enforces server guardrails (max tool calls, no source leakage, etc. — set to 0 for no cap)
 - Prints an audit trail of tool calls (category, query, counts, best similarity…)
+- Tool calls of one model step run concurrently on a bounded pool (TOOL_MAX_CONCURRENCY), each
+  with a timeout (TOOL_TIMEOUT_SECONDS); results go back to the model in tool_call order, and
+  audit entries record wall_ms / queue_ms per call
+- When one model turn asks for several RAG searches, they are served together via
+  rag_search_tool.run_many (one embedding request, concurrent searches)
+- Each call gets a fresh turn memo (services/rag/turn_memo.py): repeated near-identical RAG
+  queries are answered with a reference, and no chunk is sent to the model twice
+- Opt-in speculative retrieval (RAG_SPECULATIVE, services/rag/speculative.py): the RAG search for
+  the latest user message starts on the tool pool while the first completion is in flight; a
+  matching tool call gets that result, and the audit records hit / similarity / saved_ms
+- Opt-in local intent router (INTENT_ROUTER, services/rag/intent_router.py): when it is confident
+  the user's message needs retrieval in a given category, that search runs before the first
+  completion and its result is already in the first prompt (one model call instead of two);
+  the audit entry carries `router`
+- `stream_gpt_reply_with_tools(...)` runs the same loop with streamed completions and yields
+  events (tool_start / tool_end / token / text_reset / done) for the SSE endpoints; the done
+  event carries timings, including time-to-first-token (TTFT)
+- The prompt is assembled most-stable-first (services/llm/prompt_assembly.py) and sent with a
+  per-client prompt_cache_key; every completion's prompt / cached token counts are printed, added
+  to the timings and totalled for /metrics
 """
 
 from __future__ import annotations
+import json
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Tuple
+from uuid import uuid4
 
 from openai import OpenAI
 
@@ -19,8 +45,20 @@ from services.rag.tools.rag_search_tool import (
     TOOL_NAME as RAG_TOOL_NAME,
     get_tool_definition as rag_tool_def,
     run as rag_tool_run,
+    run_many as rag_tool_run_many,
+    speculate as rag_tool_speculate,
 )
 
+from services.llm.prompt_assembly import prompt_cache_key, record_usage, tool_policy_message
+from services.rag.intent_router import (
+    INTENT_ROUTER_ENABLED,
+    INTENT_ROUTER_LEARN,
+    INTENT_ROUTER_MIN_CONFIDENCE,
+    NO_RETRIEVAL,
+    get_intent_router,
+)
+from services.rag.speculative import SPECULATIVE_ENABLED, SpeculativeSearch
+from services.rag.turn_memo import TURN_MEMO_ENABLED, TurnMemo
 from services.rag.tools.web_fetch_tool import (   
     TOOL_NAME as WEB_TOOL_NAME,
     get_tool_definition as web_tool_def,
@@ -34,9 +72,15 @@ from services.rag.tools.web_fetch_tool import (
 MAX_TOOL_CALLS_PER_TURN = int(os.getenv("MAX_TOOL_CALLS_PER_TURN", "3"))
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # any tool-capable model
 PRINT_MODEL_DECISION = True  # print what the model *planned* each time
+STREAM_STATS_WINDOW = 200  # recent streamed replies kept for the TTFT percentiles in /metrics
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))  # shared by all requests of this worker
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "20"))  # per call, counted from when it starts
 # -----------------------------
 
+Event = Dict[str, Any]
+
 _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_tool_pool = ThreadPoolExecutor(max_workers=max(1, TOOL_MAX_CONCURRENCY), thread_name_prefix="tool")
 
 # Tool registry (name → handler)
 _TOOL_REGISTRY = {
@@ -64,85 +108,455 @@ _TOOLS_IN_USE = [
 ]
 
 
-def generate_gpt_reply_with_tools(
-    messages: List[Dict[str, str]],
-    *,
-    tool_context: Optional[Dict[str, Any]] = None,
-    max_calls: int = MAX_TOOL_CALLS_PER_TURN,
-    model: str = OPENAI_MODEL,
-) -> Tuple[str, List[Dict[str, Any]]]:
+def _registry_entry(tool_name: str) -> Optional[Dict[str, Any]]:
+    return next(
+        (t for t in _TOOLS_IN_USE if t["def"]["function"]["name"] == tool_name),
+        None,
+    )
+
+
+def _run_rag_batch(raw_args_list: List[str], tool_context: Dict[str, Any]) -> List[Any]:
     """
-    Main tool-calling loop.
-    - `messages` must already include your system + client context + summary + history.
-    - We append tool results back into this running `messages` list as the model calls tools.
-    - Returns (assistant_text, audit_list).
+    All RAG calls of one model step as one batch (one embedding request + concurrent searches).
+    On failure each call runs on its own, as before; per-call errors come back as exceptions.
+    """
+    try:
+        payloads = rag_tool_run_many(raw_args_list, tool_context=tool_context)
+        print(f"⚡ Ran {len(raw_args_list)} RAG calls as one batch")
+        return payloads
+    except Exception as e:
+        print(f"⚠️ Batched RAG calls failed ({e}); running them one by one")
+    out: List[Any] = []
+    for raw_args in raw_args_list:
+        try:
+            out.append(rag_tool_run(raw_args, tool_context=tool_context))
+        except Exception as e:
+            out.append(e)
+    return out
 
-    audit_list contains dicts like:
-      {
-        "idx": 1,
-        "tool": "rag_search_tool",
-        "args": {"query": "...", "category": "...", ...},
-        "ok": True,
-        "error": None,
-        "result_meta": {...}  # kept, total, best_similarity, titles…
-      }
 
-    If `max_calls <= 0`, no hard cap is enforced (the model can call tools as needed).
+def _submit(fn: Callable[[Dict[str, Any]], Any], tool_context: Dict[str, Any]) -> Dict[str, Any]:
     """
-    tool_context = tool_context or {}
-    audit: List[Dict[str, Any]] = []
+    Run fn(tool_context) on the tool pool, recording when it was queued, started and finished.
+    The job gets its own fork of the turn memo; `_collect` merges it back only when the result
+    arrives in time, so a timed-out job that keeps running cannot change what later calls see.
+    """
+    job: Dict[str, Any] = {"submitted": time.perf_counter(), "started": None, "finished": None, "memo": None}
+    memo = tool_context.get("turn_memo")
+    if memo is not None:
+        view = memo.fork()
+        tool_context = {**tool_context, "turn_memo": view}
+        job["memo"] = (memo, view)
+
+    def timed():
+        job["started"] = time.perf_counter()
+        try:
+            return fn(tool_context)
+        finally:
+            job["finished"] = time.perf_counter()
+
+    job["future"] = _tool_pool.submit(timed)
+    return job
+
 
-    # Decide how to phrase the tool policy and what "budget" means
-    if max_calls <= 0:
-        policy_suffix = (
-            "There is no strict upper limit on tool calls this turn, "
-            "but avoid unnecessary or repetitive calls. "
-            "For broad or complex questions (such as understanding a client's full website), "
-            "it's often better to call the RAG tool multiple times with different, focused queries "
-            "instead of relying on a single call."
+def _submit_tool_calls(
+    tool_calls: List[Dict[str, Any]],
+    tool_context: Dict[str, Any],
+) -> Dict[str, Tuple[Dict[str, Any], Optional[int]]]:
+    """
+    Start every known tool call of one model step. Returns {tool_call_id: (job, index)}, where
+    index is the call's position in the shared RAG batch job (None for a job of its own).
+    All RAG calls share one job, so they see each other's queries in one memo fork.
+    """
+    pending: Dict[str, Tuple[Dict[str, Any], Optional[int]]] = {}
+    rag_calls = [tc for tc in tool_calls if tc["function"]["name"] == RAG_TOOL_NAME]
+    if len(rag_calls) >= 2:
+        raw_args_list = [tc["function"]["arguments"] or "{}" for tc in rag_calls]
+        job = _submit(lambda ctx: _run_rag_batch(raw_args_list, ctx), tool_context)
+        for i, tc in enumerate(rag_calls):
+            pending[tc["id"]] = (job, i)
+
+    for tc in tool_calls:
+        entry = _registry_entry(tc["function"]["name"])
+        if tc["id"] in pending or entry is None:
+            continue
+        raw_args = tc["function"]["arguments"] or "{}"
+        pending[tc["id"]] = (
+            _submit(lambda ctx, run=entry["run"], raw_args=raw_args: run(raw_args, tool_context=ctx), tool_context),
+            None,
         )
+    return pending
+
+
+def _collect(job: Dict[str, Any], index: Optional[int]) -> Dict[str, Any]:
+    """
+    Wait for a tool job. The timeout runs from when the job started (not from when it was
+    queued); a timed-out call keeps running in the background and its result is dropped, along
+    with its memo fork. Returns {"payload", "error", "wall_ms", "queue_ms"}.
+    """
+    payload, error = None, None
+    while True:
+        started = job["started"]
+        limit = (started or time.perf_counter()) + TOOL_TIMEOUT_SECONDS
+        try:
+            result = job["future"].result(timeout=max(0.0, limit - time.perf_counter()))
+            if job["memo"] is not None:  # first call of the job collected in time
+                turn_memo, view = job["memo"]
+                turn_memo.merge(view)
+                job["memo"] = None
+            payload = result[index] if index is not None else result
+            if isinstance(payload, Exception):
+                payload, error = None, str(payload)
+            break
+        except FuturesTimeout:
+            if job["started"] is not None and job["started"] == started:
+                error = f"timed out after {TOOL_TIMEOUT_SECONDS:g}s"
+                job["memo"] = None  # whatever it does from now on is not merged
+                break
+            # it was still queued when we started waiting: its own timeout starts now
+        except Exception as e:
+            error = str(e)
+            job["memo"] = None
+            break
+
+    now = time.perf_counter()
+    started = job["started"] or now
+    return {
+        "payload": payload,
+        "error": error,
+        "wall_ms": round(((job["finished"] or now) - started) * 1000, 1),
+        "queue_ms": round((started - job["submitted"]) * 1000, 1),
+    }
+
+
+def _record_outcome(
+    tc: Dict[str, Any],
+    outcome: Dict[str, Any],
+    messages: List[Dict[str, Any]],
+    audit: List[Dict[str, Any]],
+    **audit_extra: Any,
+) -> Event:
+    """Append a collected tool call's result to the messages and the audit; returns its tool_end event."""
+    tool_name = tc["function"]["name"]
+    raw_args = tc["function"]["arguments"] or "{}"
+    timings = {"wall_ms": outcome["wall_ms"], "queue_ms": outcome["queue_ms"]}
+    if outcome["error"] is None:
+        result_payload = outcome["payload"]
+        # tool result must be stringified JSON for OpenAI
+        result_json = result_payload["json"]
+        result_meta = result_payload.get("meta", {})
+        print(f"✅ Tool '{tool_name}' executed ({outcome['wall_ms']}ms, queued {outcome['queue_ms']}ms).")
+        messages.append({
+            "role": "tool",
+            "tool_call_id": tc["id"],
+            "name": tool_name,
+            "content": result_json,  # JSON string
+        })
+        audit.append({
+            "idx": len(audit) + 1,
+            "tool": tool_name,
+            "args": result_payload.get("effective_args", raw_args),
+            "ok": True,
+            "error": None,
+            **timings,
+            **audit_extra,
+            "result_meta": result_meta,
+        })
     else:
-        policy_suffix = (
-            f"You can call at most {max_calls} tool times this turn. "
-            "Use as few calls as you can while still answering reliably, "
-            "but for broad or complex questions (such as understanding a client's full website), "
-            "it's reasonable to call the RAG tool multiple times with different, focused queries."
-        )
+        err = f"Tool '{tool_name}' error: {outcome['error']}"
+        print(f"❌ {err}")
+        messages.append({
+            "role": "tool",
+            "tool_call_id": tc["id"],
+            "name": tool_name,
+            "content": json.dumps({"ok": False, "error": outcome["error"]}),
+        })
+        audit.append({
+            "idx": len(audit) + 1,
+            "tool": tool_name,
+            "args": raw_args,
+            "ok": False,
+            "error": outcome["error"],
+            **timings,
+            **audit_extra,
+        })
+    entry = audit[-1]
+    return {
+        "type": "tool_end",
+        "idx": entry["idx"],
+        "tool": tool_name,
+        "ok": entry["ok"],
+        "error": entry["error"],
+        "wall_ms": entry["wall_ms"],
+        "included": (entry.get("result_meta") or {}).get("included"),
+    }
+
+
+def _latest_user_text(messages: List[Dict[str, Any]]) -> Optional[str]:
+    last_user = next((m for m in reversed(messages) if m.get("role") == "user"), None)
+    text = last_user.get("content") if last_user else None
+    return text.strip() if isinstance(text, str) and text.strip() else None
+
+
+def _route_first_step(
+    messages: List[Dict[str, Any]],
+    tool_context: Dict[str, Any],
+    audit: List[Dict[str, Any]],
+) -> Generator[Event, None, Optional[Dict[str, Any]]]:
+    """
+    Classify the latest user message with the local intent router. When it is confident that
+    retrieval is needed, run rag_search_tool for it now and add the call and its result to the
+    first prompt (the model sees it exactly like its own search), saving the model hop that
+    would otherwise decide to search. Returns the route (+ "pre_ran"), or None.
+    """
+    text = _latest_user_text(messages)
+    if text is None:
+        return None
+    router = get_intent_router()
+    try:
+        route = router.route(text, allowed=router.allowed(tool_context))
+    except Exception as e:
+        print(f"⚠️ Intent router failed ({e}); the model decides")
+        return None
+    route["pre_ran"] = False
+    pre_run = route["retrieve"] and route["confidence"] >= INTENT_ROUTER_MIN_CONFIDENCE
+    print(
+        f"🧭 Intent router: {route['label']} ({route['confidence']:.2f}) | "
+        f"{'pre-running retrieval' if pre_run else 'model decides'}"
+    )
+    if not pre_run:
+        return route
+
+    raw_args = json.dumps({"query": text, "category": route["label"]})
+    tc = {"id": f"call_router_{uuid4().hex[:12]}", "type": "function", "function": {"name": RAG_TOOL_NAME, "arguments": raw_args}}
+    yield {"type": "tool_start", "idx": len(audit) + 1, "tool": RAG_TOOL_NAME, "args": raw_args}
+    outcome = _collect(_submit(lambda ctx: rag_tool_run(raw_args, tool_context=ctx), tool_context), None)
+    messages.append({"role": "assistant", "content": "", "tool_calls": [tc]})
+    yield _record_outcome(
+        tc, outcome, messages, audit,
+        router={"label": route["label"], "confidence": round(route["confidence"], 3)},
+    )
+    route["pre_ran"] = outcome["error"] is None
+    return route
+
+
+def _learn_route(route: Dict[str, Any], tool_calls: List[Dict[str, Any]]) -> None:
+    """
+    Teach the router what the model chose when the router was not confident. A confident route
+    that needed no retrieval is left alone: the model may just have chosen differently this time.
+    """
+    if not INTENT_ROUTER_LEARN or route["confidence"] >= INTENT_ROUTER_MIN_CONFIDENCE:
+        return
+    if not tool_calls:
+        label = NO_RETRIEVAL
+    else:
+        rag = next((tc for tc in tool_calls if tc["function"]["name"] == RAG_TOOL_NAME), None)
+        try:
+            args = json.loads(rag["function"]["arguments"] or "{}") if rag else {}
+        except Exception:
+            args = {}
+        label = (args.get("category") or "").strip().lower()  # GLOBAL / other tools: nothing to learn
+    get_intent_router().learn(route["vec"], label)
+
+
+def _start_speculation(
+    messages: List[Dict[str, Any]],
+    tool_context: Dict[str, Any],
+) -> Optional[SpeculativeSearch]:
+    """Start the RAG search for the latest user message on the tool pool (None if there is none)."""
+    text = _latest_user_text(messages)
+    if text is None:
+        return None
+    try:
+        speculative = rag_tool_speculate(text, tool_context=tool_context).start(_tool_pool)
+    except Exception as e:
+        print(f"⚠️ Speculative retrieval not started: {e}")
+        return None
+    tool_context["speculative"] = speculative
+    return speculative
+
+
+class _StreamStats:
+    """TTFT / total time of recent streamed replies (this worker), for /metrics."""
+
+    def __init__(self, window: int) -> None:
+        self.streams = 0
+        self._lock = threading.Lock()
+        self._ttft_ms: "deque[float]" = deque(maxlen=window)
+        self._total_ms: "deque[float]" = deque(maxlen=window)
+
+    def record(self, ttft_ms: Optional[float], total_ms: float) -> None:
+        with self._lock:
+            self.streams += 1
+            if ttft_ms is not None:
+                self._ttft_ms.append(ttft_ms)
+            self._total_ms.append(total_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ttft, total = sorted(self._ttft_ms), sorted(self._total_ms)
+        pct = lambda xs, q: round(xs[min(len(xs) - 1, int(q * len(xs)))], 1) if xs else None
+        return {
+            "streams": self.streams,
+            "window": len(total),
+            "ttft_ms_p50": pct(ttft, 0.50),
+            "ttft_ms_p95": pct(ttft, 0.95),
+            "total_ms_p50": pct(total, 0.50),
+            "total_ms_p95": pct(total, 0.95),
+        }
+
+
+_stream_stats = _StreamStats(STREAM_STATS_WINDOW)
+
+
+def get_stream_stats() -> Dict[str, Any]:
+    return _stream_stats.stats()
+
+
+def _record_usage(usage: Any, timing: Dict[str, Any]) -> None:
+    counts = record_usage(usage)
+    if counts is None:
+        return
+    prompt_tokens, cached_tokens = counts
+    timing["prompt_tokens"] += prompt_tokens
+    timing["cached_tokens"] += cached_tokens
+    share = f"{cached_tokens / prompt_tokens:.0%}" if prompt_tokens else "-"
+    print(f"🧮 Prompt: {prompt_tokens} tokens | cached={cached_tokens} ({share})")
+
+
+def _model_step(
+    messages: List[Dict[str, Any]],
+    *,
+    model: str,
+    with_tools: bool,
+    stream: bool,
+    timing: Dict[str, Any],
+    cache_key: Optional[str] = None,
+) -> Generator[Event, None, Tuple[str, List[Dict[str, Any]]]]:
+    """
+    One completion. Returns (content, tool_calls as dicts); when streaming, yields a token
+    event per content delta and stamps timing["ttft_ms"] on the first one.
+    Prompt and cached prompt tokens are added to timing (and the worker's prompt cache stats).
+    """
+    kwargs: Dict[str, Any] = {"model": model, "messages": messages, "temperature": 0.2}
+    if with_tools:
+        kwargs["tools"] = _tool_definitions_for_openai()
+        kwargs["tool_choice"] = "auto"  # let the model decide
+    if cache_key:
+        kwargs["prompt_cache_key"] = cache_key
+    timing["model_calls"] += 1
+
+    if not stream:
+        resp = _client.chat.completions.create(**kwargs)
+        _record_usage(getattr(resp, "usage", None), timing)
+        msg = resp.choices[0].message
+        # edge-case: sometimes content is None; normalize to empty string
+        return msg.content or "", [tc.model_dump() for tc in msg.tool_calls or []]
+
+    content: List[str] = []
+    calls: Dict[int, Dict[str, Any]] = {}  # tool calls arrive in fragments, keyed by index
+    # include_usage: a last chunk (no choices) carries the usage, incl. cached tokens
+    for chunk in _client.chat.completions.create(**kwargs, stream=True, stream_options={"include_usage": True}):
+        _record_usage(getattr(chunk, "usage", None), timing)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            if timing["ttft_ms"] is None:
+                timing["ttft_ms"] = (time.perf_counter() - timing["start"]) * 1000
+            content.append(delta.content)
+            yield {"type": "token", "text": delta.content}
+        for frag in delta.tool_calls or []:
+            call = calls.setdefault(frag.index, {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+            if frag.id:
+                call["id"] = frag.id
+            if frag.function and frag.function.name:
+                call["function"]["name"] += frag.function.name
+            if frag.function and frag.function.arguments:
+                call["function"]["arguments"] += frag.function.arguments
+    return "".join(content), [calls[i] for i in sorted(calls)]
+
 
-    preface_rule = {
-        "role": "system",
-        "content": (
-            "Tool policy: You may call tools to retrieve evidence. "
-            "Use them only if you need more context to answer reliably. "
-            + policy_suffix
-        ),
+def _tool_loop(
+    messages: List[Dict[str, str]],
+    *,
+    tool_context: Optional[Dict[str, Any]],
+    max_calls: int,
+    model: str,
+    stream: bool,
+) -> Iterator[Event]:
+    """
+    The tool-calling loop shared by the blocking and the streaming entry points.
+    Yields tool_start / tool_end (and token / text_reset when streaming) events and ends
+    with {"type": "done", "text", "audit", "timing"}.
+    """
+    tool_context = dict(tool_context or {})
+    if TURN_MEMO_ENABLED:
+        tool_context["turn_memo"] = TurnMemo()  # this turn only; never shared across requests
+    audit: List[Dict[str, Any]] = []
+    timing: Dict[str, Any] = {
+        "start": time.perf_counter(), "ttft_ms": None, "model_calls": 0, "tool_ms": 0.0,
+        "prompt_tokens": 0, "cached_tokens": 0,
     }
+    cache_key = prompt_cache_key(tool_context)
 
-    messages = [preface_rule, *messages]
+    def done(text: str) -> Event:
+        total_ms = (time.perf_counter() - timing.pop("start")) * 1000
+        timing["total_ms"] = round(total_ms, 1)
+        timing["tool_ms"] = round(timing["tool_ms"], 1)
+        if route is not None:
+            timing["router"] = {k: route[k] for k in ("label", "confidence", "pre_ran")}
+        if speculative is not None:
+            timing["speculative"] = speculative.finish()
+        if stream:
+            if timing["ttft_ms"] is not None:
+                timing["ttft_ms"] = round(timing["ttft_ms"], 1)
+            _stream_stats.record(timing["ttft_ms"], total_ms)
+            print(
+                f"⏱️  Streamed reply: ttft={timing['ttft_ms']}ms | total={timing['total_ms']}ms | "
+                f"model_calls={timing['model_calls']} | tools={len(audit)} ({timing['tool_ms']}ms) | "
+                f"prompt_tokens={timing['prompt_tokens']} (cached {timing['cached_tokens']})"
+            )
+        return {"type": "done", "text": text, "audit": audit, "timing": timing}
+
+    # The policy depends only on the budget, so it is the most stable block: it goes first
+    messages = [tool_policy_message(max_calls), *messages]
 
     # If max_calls <= 0 → no cap: use infinity so the while-loop logic still works.
     calls_remaining = float("inf") if max_calls <= 0 else max_calls
 
+    # Local intent router: a confident retrieval route is searched before the first completion
+    route = None
+    if INTENT_ROUTER_ENABLED:
+        step_start = time.perf_counter()
+        route = yield from _route_first_step(messages, tool_context, audit)
+        timing["tool_ms"] += (time.perf_counter() - step_start) * 1000
+        if route is not None and route["pre_ran"]:
+            calls_remaining -= 1
+    # Overlaps the first completion; only used if the model asks for a close enough search
+    speculative = (
+        _start_speculation(messages, tool_context)
+        if SPECULATIVE_ENABLED and not (route and route["pre_ran"]) else None
+    )
+
     while True:
         # 1) Ask the model what to do next (answer or tool-call)
-        resp = _client.chat.completions.create(
-            model=model,
-            messages=messages,
-            tools=_tool_definitions_for_openai(),
-            tool_choice="auto",  # let the model decide
-            temperature=0.2,
+        content, tool_calls = yield from _model_step(
+            messages, model=model, with_tools=True, stream=stream, timing=timing, cache_key=cache_key,
         )
-        choice = resp.choices[0]
-        msg = choice.message
+        if route is not None and timing["model_calls"] == 1:
+            _learn_route(route, tool_calls)
 
         # 2) If the model returned a normal answer (no tool calls), we're done
-        if not msg.tool_calls:
-            # edge-case: sometimes content is None; normalize to empty string
-            final_text = msg.content or ""
-            return final_text, audit
+        if not tool_calls:
+            yield done(content)
+            return
 
-        # 3) Otherwise, the model wants to call one or more tools
-        tool_calls = msg.tool_calls
+        # 3) Otherwise, the model wants to call one or more tools.
+        # Text streamed before the tool calls was a preamble, not the answer.
+        if stream and content:
+            timing["ttft_ms"] = None  # TTFT counts the answer's first token
+            yield {"type": "text_reset"}
         if PRINT_MODEL_DECISION:
             budget_str = (
                 "unlimited"
@@ -157,30 +571,33 @@ def generate_gpt_reply_with_tools(
         # We append the model's tool-call message to history first
         messages.append({
             "role": "assistant",
-            "content": msg.content or "",
-            "tool_calls": [
-                tc.model_dump() if hasattr(tc, "model_dump") else tc
-                for tc in tool_calls
-            ],
+            "content": content,
+            "tool_calls": tool_calls,
         })
 
-        # Execute each tool call in order
-        for tc in tool_calls:
-            tool_name = tc.function.name
-            raw_args = tc.function.arguments or "{}"
+        # Calls over the budget are not run, but every tool_call_id still needs an answer
+        in_budget = tool_calls if calls_remaining == float("inf") else tool_calls[: max(0, int(calls_remaining))]
+        over_budget = tool_calls[len(in_budget):]
 
-            # Resolve and run
-            registry_entry = next(
-                (t for t in _TOOLS_IN_USE if t["def"]["function"]["name"] == tool_name),
-                None,
-            )
-            if not registry_entry:
+        # Start all calls at once (several RAG calls → one embedding request + concurrent searches)
+        step_start = time.perf_counter()
+        pending = _submit_tool_calls(in_budget, tool_context)
+        for i, tc in enumerate(in_budget):
+            if tc["id"] in pending:
+                yield {"type": "tool_start", "idx": len(audit) + i + 1, "tool": tc["function"]["name"], "args": tc["function"]["arguments"] or "{}"}
+
+        # Collect in the original order
+        for tc in in_budget:
+            tool_name = tc["function"]["name"]
+            raw_args = tc["function"]["arguments"] or "{}"
+
+            if tc["id"] not in pending:
                 # Unknown tool: tell the model it failed and let it decide a new step.
                 err_note = f"Unknown tool '{tool_name}'."
                 print(f"⚠️  {err_note}")
                 messages.append({
                     "role": "tool",
-                    "tool_call_id": tc.id,
+                    "tool_call_id": tc["id"],
                     "name": tool_name,
                     "content": f'{{"ok": false, "error": "{err_note}"}}',
                 })
@@ -191,62 +608,93 @@ def generate_gpt_reply_with_tools(
                     "ok": False,
                     "error": err_note,
                 })
+                yield {"type": "tool_end", "idx": len(audit), "tool": tool_name, "ok": False, "error": err_note}
                 continue
 
-            # Execute Python function
-            try:
-                result_payload = registry_entry["run"](raw_args, tool_context=tool_context)
-                # tool result must be stringified JSON for OpenAI
-                result_json = result_payload["json"]
-                result_meta = result_payload.get("meta", {})
-                print(f"✅ Tool '{tool_name}' executed.")
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": tool_name,
-                    "content": result_json,  # JSON string
-                })
-                audit.append({
-                    "idx": len(audit) + 1,
-                    "tool": tool_name,
-                    "args": result_payload.get("effective_args", raw_args),
-                    "ok": True,
-                    "error": None,
-                    "result_meta": result_meta,
-                })
-            except Exception as e:
-                err = f"Tool '{tool_name}' error: {e}"
-                print(f"❌ {err}")
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": tool_name,
-                    "content": f'{{"ok": false, "error": "{str(e)}"}}',
-                })
-                audit.append({
-                    "idx": len(audit) + 1,
-                    "tool": tool_name,
-                    "args": raw_args,
-                    "ok": False,
-                    "error": str(e),
-                })
+            yield _record_outcome(tc, _collect(*pending[tc["id"]]), messages, audit)
+        timing["tool_ms"] += (time.perf_counter() - step_start) * 1000
 
-            # Decrease the budget after each executed tool.
-            # If max_calls <= 0, calls_remaining is infinity, so this never reaches <= 0.
-            calls_remaining -= 1
-            if max_calls > 0 and calls_remaining <= 0:
-                print("⏳ Tool budget reached. Asking model to finish with available info.")
-                messages.append({
-                    "role": "system",
-                    "content": "Tool budget reached. Finish your answer with the information you have.",
-                })
-                # Ask once more for final answer
-                final = _client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0.2,
-                )
-                return final.choices[0].message.content or "", audit
+        for tc in over_budget:
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tc["id"],
+                "name": tc["function"]["name"],
+                "content": '{"ok": false, "error": "Tool budget reached; this call was not run."}',
+            })
+
+        # Decrease the budget by the calls executed in this step (unknown tools never ran).
+        # If max_calls <= 0, calls_remaining is infinity, so this never reaches <= 0.
+        calls_remaining -= len(pending)
+        if max_calls > 0 and calls_remaining <= 0:
+            print("⏳ Tool budget reached. Asking model to finish with available info.")
+            messages.append({
+                "role": "system",
+                "content": "Tool budget reached. Finish your answer with the information you have.",
+            })
+            # Ask once more for final answer
+            final_text, _ = yield from _model_step(
+                messages, model=model, with_tools=False, stream=stream, timing=timing, cache_key=cache_key,
+            )
+            yield done(final_text)
+            return
 
         # Loop again: the newly appended tool results are now in `messages`;
         # the model may either make another tool call (if budget left) or answer.
+
+
+def generate_gpt_reply_with_tools(
+    messages: List[Dict[str, str]],
+    *,
+    tool_context: Optional[Dict[str, Any]] = None,
+    max_calls: int = MAX_TOOL_CALLS_PER_TURN,
+    model: str = OPENAI_MODEL,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Main tool-calling loop.
+    - `messages` must already include your system + client context + summary + history.
+    - We append tool results back into this running `messages` list as the model calls tools.
+    - Returns (assistant_text, audit_list).
+
+    audit_list contains dicts like:
+      {
+        "idx": 1,
+        "tool": "rag_search_tool",
+        "args": {"query": "...", "category": "...", ...},
+        "ok": True,
+        "error": None,
+        "wall_ms": 412.0,     # time the call ran
+        "queue_ms": 0.3,      # time it waited for a free tool worker
+        "result_meta": {...}  # kept, total, best_similarity, titles… (+ speculative_hit,
+                              # speculative_similarity, speculative_saved_ms with RAG_SPECULATIVE)
+      }
+
+    If `max_calls <= 0`, no hard cap is enforced (the model can call tools as needed).
+    """
+    for event in _tool_loop(messages, tool_context=tool_context, max_calls=max_calls, model=model, stream=False):
+        if event["type"] == "done":
+            return event["text"], event["audit"]
+    raise RuntimeError("tool loop ended without a reply")
+
+
+def stream_gpt_reply_with_tools(
+    messages: List[Dict[str, str]],
+    *,
+    tool_context: Optional[Dict[str, Any]] = None,
+    max_calls: int = MAX_TOOL_CALLS_PER_TURN,
+    model: str = OPENAI_MODEL,
+) -> Iterator[Event]:
+    """
+    Streaming variant of `generate_gpt_reply_with_tools` (same loop, same guardrails).
+    Yields, in order of occurrence:
+      {"type": "tool_start", "idx", "tool", "args"}          a tool call is about to run
+      {"type": "tool_end", "idx", "tool", "ok", "error", "included"}
+      {"type": "token", "text"}                              a delta of the model's text
+      {"type": "text_reset"}                                 the text so far was a preamble to
+                                                             tool calls; the answer starts over
+      {"type": "done", "text", "audit", "timing"}            last event; timing has ttft_ms,
+                                                             total_ms, model_calls, tool_ms,
+                                                             prompt_tokens, cached_tokens
+    """
+    return _tool_loop(messages, tool_context=tool_context, max_calls=max_calls, model=model, stream=True)
+
+
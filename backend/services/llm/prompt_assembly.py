@@ -0,0 +1,187 @@
+# services/llm/prompt_assembly.py
+"""
+Prompt assembly for a chat turn, ordered for provider-side prompt caching.
+
+- OpenAI caches the longest previously seen prompt prefix (from 1024 tokens, in 128-token
+  steps), so blocks go from most to least stable:
+    1. tool policy (the tool loop adds it; changes only with MAX_TOOL_CALLS_PER_TURN)
+    2. static rules: assistant persona + retrieval/grounding rules (same for every turn)
+    3. client context (same for every turn with this client)
+    4. running summary (changes when the summary is refreshed)
+    5. uploads: upload count + attached documents (change when files are uploaded)
+    6. recent history, ending with the user's new message
+- `prompt_cache_key(tool_context)` groups requests that share the client prefix
+  (PROMPT_CACHE_KEY), so they are more likely to land on the same cache
+- `record_usage(usage)` reads `usage.prompt_tokens_details.cached_tokens` of every completion;
+  totals for /metrics via `get_prompt_cache_stats()`
+"""
+
+from __future__ import annotations
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+PROMPT_CACHE_KEY_ENABLED = os.getenv("PROMPT_CACHE_KEY", "true").lower() in ("1", "true", "yes")
+# -----------------------------
+
+ASSISTANT_RULES = (
+    "You are QUORRA, the Asera AI assistant. "
+    "Be concise, smart, and aware of past messages. "
+    "Do not print chunk IDs or any '(source: ...)' text in your answers. "
+    "If no snippet supports a claim, say so briefly. "
+    "You may call tools (like rag_search_tool) if you truly need more context; "
+    "otherwise answer directly. "
+    "You may compare across clients using internal data (SOPs, client records, meeting notes). "
+    "However, when using tools to query website content, you only have access to the website "
+    "data for the primary client of this conversation. "
+    "If the user asks for website details about a different client, explain that this chat is "
+    "scoped to the current client and that they should start a separate conversation for that other client."
+)
+
+GROUNDING_RULES = """
+You are QUORRA, an internal Asera assistant. You may reference and compare across ANY clients when it helps answer the question accurately.
+
+# Retrieval and Grounding Rules
+- For adaptation or comparison you may bring in examples from other clients; clearly name those clients and cite the snippet IDs used.
+- Do not invent numbers or commitments. Only quote metrics or promises that appear in retrieved snippets.
+- For client websites, first try the internal "website" category via rag_search_tool.
+- For client website queries:
+  - Only use the web_fetch_tool if the user has pasted a URL in their latest message, in most cases use the rag_search_tool with the website category.
+  - Only use web_fetch_tool if BOTH:
+    (1) the user explicitly asks you to read or check a URL or website, and
+    (2) the domain of that URL appears in the user's latest message.
+  - Do not use web_fetch_tool just because you see a Website field in context.
+- Do not guess or invent URLs.
+""".strip()
+
+
+def tool_policy_message(max_calls: int) -> Dict[str, str]:
+    """The tool loop's policy preface; first in the prompt (depends on the budget only)."""
+    if max_calls <= 0:
+        policy_suffix = (
+            "There is no strict upper limit on tool calls this turn, "
+            "but avoid unnecessary or repetitive calls. "
+            "For broad or complex questions (such as understanding a client's full website), "
+            "it's often better to call the RAG tool multiple times with different, focused queries "
+            "instead of relying on a single call."
+        )
+    else:
+        policy_suffix = (
+            f"You can call at most {max_calls} tool times this turn. "
+            "Use as few calls as you can while still answering reliably, "
+            "but for broad or complex questions (such as understanding a client's full website), "
+            "it's reasonable to call the RAG tool multiple times with different, focused queries."
+        )
+    return {
+        "role": "system",
+        "content": (
+            "Tool policy: You may call tools to retrieve evidence. "
+            "Use them only if you need more context to answer reliably. "
+            + policy_suffix
+        ),
+    }
+
+
+def client_context_block(client: Dict[str, Any]) -> str:
+    products_list = ", ".join(client.get("products") or [])
+    return f"""
+Primary client of this conversation:
+- Name: {client.get('name')}
+- Status: {client.get('status')}
+- Account Manager: {client.get('account_manager')}
+- Priority: {client.get('priority')}
+- Contact Email: {client.get('contact_email')}
+- Products: {products_list}
+- Service End Date: {client.get('service_end_date')}
+- Description: {client.get('description')}
+""".strip()
+
+
+def uploads_block(upload_docs_count: int, attached_docs_context: Optional[str]) -> str:
+    note = (
+        f"This conversation currently has {upload_docs_count} uploaded file(s). "
+        "If this number is 0, do not use the 'upload' category in rag_search_tool, "
+        "because there is nothing to retrieve yet."
+    )
+    return f"{note}\n\n{attached_docs_context}" if attached_docs_context else note
+
+
+def build_messages(
+    *,
+    client: Dict[str, Any],
+    summary_text: Optional[str],
+    upload_docs_count: int,
+    attached_docs_context: Optional[str],
+    history: List[Dict[str, Any]],
+) -> List[Dict[str, str]]:
+    """The turn's messages, most stable block first (see the module docstring)."""
+    messages = [
+        {"role": "system", "content": ASSISTANT_RULES},
+        {"role": "system", "content": GROUNDING_RULES},
+        {"role": "system", "content": client_context_block(client)},
+    ]
+    if summary_text:
+        messages.append({"role": "system", "content": f"Summary of previous conversation:\n{summary_text}"})
+    messages.append({"role": "system", "content": uploads_block(upload_docs_count, attached_docs_context)})
+
+    # Recent history (includes the user message saved for this turn)
+    for m in history:
+        messages.append({"role": m["role"], "content": m["content"]["text"]})
+    return messages
+
+
+def prompt_cache_key(tool_context: Dict[str, Any]) -> Optional[str]:
+    """Requests for the same client share the prompt up to the client block."""
+    client_id = tool_context.get("primary_client_id")
+    if not PROMPT_CACHE_KEY_ENABLED or not client_id:
+        return None
+    return f"quorra-client-{client_id}"
+
+
+class _PromptCacheStats:
+    """Prompt tokens vs cached prompt tokens over all completions of this worker."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.completions = 0
+        self.completions_cached = 0   # completions with any cached tokens
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, prompt_tokens: int, cached_tokens: int) -> None:
+        with self._lock:
+            self.completions += 1
+            self.completions_cached += int(cached_tokens > 0)
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "completions": self.completions,
+                "completions_cached": self.completions_cached,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_share": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+            }
+
+
+_stats = _PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> Dict[str, Any]:
+    return _stats.stats()
+
+
+def record_usage(usage: Any) -> Optional[Tuple[int, int]]:
+    """(prompt_tokens, cached_tokens) of one completion's usage (None when it has none)."""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+    _stats.record(prompt_tokens, cached_tokens)
+    return prompt_tokens, cached_tokens
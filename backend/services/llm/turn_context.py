@@ -0,0 +1,320 @@
+# services/llm/turn_context.py
+"""
+Context for one chat turn, shared by every /messages endpoint.
+
+- `prepare_reply(conversation_id, content)` returns the model input (system prompts + recent
+  history, assembled by services/llm/prompt_assembly.py), the tool context and the debug
+  fields the endpoints report
+- All reads come from one `get_turn_context` RPC (sql/006_turn_context.sql): conversation →
+  client, summary, message count, upload count, last HISTORY_LIMIT messages and the documents
+  attached to them. With the user's insert that is two round trips per turn instead of ~10.
+- If the RPC is missing or fails (migration not applied yet) the same data is read with
+  separate queries, issued concurrently
+- Raises TurnContextNotFound when the conversation or its client does not exist
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.llm.prompt_assembly import build_messages
+from supabase_client import supabase
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+TURN_CONTEXT_RPC = os.getenv("CHAT_TURN_CONTEXT_RPC", "true").lower() in ("1", "true", "yes")
+HISTORY_LIMIT = 10
+DOC_SNIPPET_CHARS = 1500       # per attached document in the prompt
+ATTACHED_DOCS_BUDGET = 8000    # chars for the whole attached-docs system message
+# -----------------------------
+
+
+class TurnContextNotFound(LookupError):
+    """The conversation (or its client) does not exist; `what` is "Conversation" or "Client"."""
+
+    def __init__(self, what: str) -> None:
+        super().__init__(f"{what} not found")
+        self.what = what
+
+
+# -----------------------------
+# Reads
+# -----------------------------
+def _turn_context_rpc(conversation_id: str) -> Optional[Dict[str, Any]]:
+    """One round trip (sql/006); None if the RPC is unavailable."""
+    try:
+        res = supabase.rpc(
+            "get_turn_context",
+            {
+                "in_conversation": conversation_id,
+                "history_limit": HISTORY_LIMIT,
+                # a little over the snippet size so we can still tell the text was cut
+                "doc_chars": DOC_SNIPPET_CHARS + 100,
+            },
+        ).execute()
+        return res.data or None
+    except Exception as e:
+        print(f"⚠️ get_turn_context RPC failed ({e}); falling back to separate queries")
+        return None
+
+
+def get_conversation_client_id(conversation_id: str) -> str:
+    """Resolve the conversation's primary client (we still allow cross client refs in answers)."""
+    convo_result = (
+        supabase.table("conversations")
+        .select("client_id")
+        .eq("id", conversation_id)
+        .execute()
+    )
+    if not convo_result.data:
+        raise TurnContextNotFound("Conversation")
+    return convo_result.data[0]["client_id"]
+
+
+def _get_client(client_id: str) -> Optional[Dict[str, Any]]:
+    client_result = (
+        supabase.table("clients")
+        .select("*")
+        .eq("id", client_id)
+        .execute()
+    )
+    return client_result.data[0] if client_result.data else None
+
+
+def _count(table: str, **filters: Any) -> int:
+    query = supabase.table(table).select("id", count="exact")
+    for key, value in filters.items():
+        query = query.eq(key, value)
+    return query.execute().count
+
+
+def _get_summary(conversation_id: str) -> Optional[str]:
+    """The current running summary (if we have created one already)."""
+    summary_result = (
+        supabase.table("conversation_summary")
+        .select("summary")
+        .eq("conversation_id", conversation_id)
+        .execute()
+    )
+    return summary_result.data[0]["summary"] if summary_result.data else None
+
+
+def _get_history(conversation_id: str) -> List[Dict[str, Any]]:
+    """Recent history (newest to oldest from the DB), in chronological order for the model."""
+    history_result = (
+        supabase.table("messages")
+        .select("id, role, content, created_at")
+        .eq("conversation_id", conversation_id)
+        .order("created_at", desc=True)
+        .limit(HISTORY_LIMIT)
+        .execute()
+    )
+    return list(reversed(history_result.data))
+
+
+def _get_attached_docs(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """{message_id, document_id, title, raw_text} for documents linked to the history messages."""
+    message_ids = [m["id"] for m in history if "id" in m]
+    if not message_ids:
+        return []
+    links = (
+        supabase.table("message_documents")
+        .select("message_id, document_id")
+        .in_("message_id", message_ids)
+        .execute()
+        .data or []
+    )
+    doc_ids = list({row["document_id"] for row in links})
+    if not doc_ids:
+        return []
+    docs = (
+        supabase.table("knowledge_documents")
+        .select("id, title, raw_text")
+        .in_("id", doc_ids)
+        .execute()
+        .data or []
+    )
+    docs_by_id = {d["id"]: d for d in docs}
+    return [
+        {
+            "message_id": row["message_id"],
+            "document_id": row["document_id"],
+            "title": docs_by_id[row["document_id"]].get("title"),
+            "raw_text": docs_by_id[row["document_id"]].get("raw_text"),
+        }
+        for row in links
+        if row["document_id"] in docs_by_id
+    ]
+
+
+async def _turn_context_queries(conversation_id: str, client_id: Optional[str]) -> Dict[str, Any]:
+    """The RPC's result from separate queries, independent ones concurrently."""
+
+    async def client_row() -> Tuple[str, Optional[Dict[str, Any]]]:
+        cid = client_id or await asyncio.to_thread(get_conversation_client_id, conversation_id)
+        return cid, await asyncio.to_thread(_get_client, cid)
+
+    async def history_with_docs() -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        history = await asyncio.to_thread(_get_history, conversation_id)
+        return history, await asyncio.to_thread(_get_attached_docs, history)
+
+    (cid, client), message_count, upload_docs_count, summary, (history, attached_docs) = await asyncio.gather(
+        client_row(),
+        asyncio.to_thread(_count, "messages", conversation_id=conversation_id),
+        asyncio.to_thread(_count, "knowledge_documents", source="upload", conversation_id=conversation_id),
+        asyncio.to_thread(_get_summary, conversation_id),
+        history_with_docs(),
+    )
+    return {
+        "conversation": {"id": conversation_id, "client_id": cid},
+        "client": client,
+        "summary": summary,
+        "message_count": message_count,
+        "upload_docs_count": upload_docs_count,
+        "history": history,
+        "attached_docs": attached_docs,
+    }
+
+
+async def load_turn_context(conversation_id: str, client_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Raw context of a turn: {conversation, client, summary, message_count, upload_docs_count,
+    history (chronological), attached_docs, source ("rpc" | "queries")}.
+    """
+    ctx = await asyncio.to_thread(_turn_context_rpc, conversation_id) if TURN_CONTEXT_RPC else None
+    source = "rpc"
+    if ctx is None:
+        ctx = await _turn_context_queries(conversation_id, client_id)
+        source = "queries"
+    if not ctx.get("conversation"):
+        raise TurnContextNotFound("Conversation")
+    if not ctx.get("client"):
+        raise TurnContextNotFound("Client")
+    return {**ctx, "source": source}
+
+
+# -----------------------------
+# Prompt assembly
+# -----------------------------
+def build_attached_docs_context(
+    history: List[Dict[str, Any]],
+    attached_docs: List[Dict[str, Any]],
+) -> Optional[str]:
+    """
+    System message with titles and text snippets of the documents attached to the history
+    messages, walking the history in chronological order. None if there are none.
+    """
+    if not attached_docs:
+        return None
+
+    # Map message_id -> list of docs
+    docs_by_msg: Dict[str, List[Dict[str, Any]]] = {}
+    for doc in attached_docs:
+        docs_by_msg.setdefault(doc["message_id"], []).append(doc)
+
+    def safe_trim(text: str, max_chars: int) -> str:
+        if not text:
+            return ""
+        if len(text) <= max_chars:
+            return text
+        return text[:max_chars] + "... [truncated]"
+
+    lines: list[str] = []
+    # Simple char based budget so we do not explode context
+    total_chars_budget = ATTACHED_DOCS_BUDGET
+    used_chars = 0
+
+    # Walk history in chronological order, but only include messages that have docs
+    for m in history:
+        mid = m["id"]
+        if mid not in docs_by_msg:
+            continue
+
+        role = m["role"]
+        content_field = m.get("content") or {}
+        msg_text = ""
+        if isinstance(content_field, dict):
+            msg_text = content_field.get("text", "") or ""
+
+        header = f"Message ({role}): {safe_trim(msg_text, 300)}"
+        lines.append(header)
+        used_chars += len(header)
+        if used_chars >= total_chars_budget:
+            break
+
+        for doc in docs_by_msg[mid]:
+            title = doc.get("title") or "Untitled document"
+            raw_text = doc.get("raw_text") or ""
+            snippet = safe_trim(raw_text, DOC_SNIPPET_CHARS)
+            block = (
+                f"\nAttached document: {title}\n"
+                f"Content snippet:\n{snippet}\n"
+            )
+            lines.append(block)
+            used_chars += len(block)
+            if used_chars >= total_chars_budget:
+                break
+
+        if used_chars >= total_chars_budget:
+            break
+
+    if not lines:
+        print("[ATTACH_DEBUG] docs_by_msg is non empty but produced no lines")
+        return None
+
+    attached_docs_context = (
+        "You have direct access to the extracted text from files recently uploaded in this conversation. "
+        "Treat this text exactly as if the user had pasted it into the chat. "
+        "You may freely read, quote, summarize, and reason about it. "
+        "If the user asks about an uploaded file, answer using this text and do not say that you cannot access the file. "
+        "You do not need to call any tools to read this text, it is already provided here.\n\n"
+        "Attached documents and their content:\n\n"
+        + "\n".join(lines)
+    )
+
+    print(f"[ATTACH_DEBUG] built attached_docs_context length: {len(attached_docs_context)} chars")
+    return attached_docs_context
+
+
+async def prepare_reply(conversation_id: str, content: str, client_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Everything the tool loop needs for one reply: client context, running summary,
+    recent history (with attached docs) and the tool context.
+    Returns {client, messages, tool_context, message_count, upload_docs_count,
+    has_uploaded_docs, attached_docs_context, context_source}.
+    """
+    ctx = await load_turn_context(conversation_id, client_id)
+    client = ctx["client"]
+    upload_docs_count = ctx["upload_docs_count"]
+    has_uploaded_docs = upload_docs_count > 0
+    history = ctx["history"]
+    attached_docs_context = build_attached_docs_context(history, ctx["attached_docs"])
+
+    # Most stable blocks first, so the provider can reuse the cached prompt prefix
+    messages = build_messages(
+        client=client,
+        summary_text=ctx["summary"],
+        upload_docs_count=upload_docs_count,
+        attached_docs_context=attached_docs_context,
+        history=history,
+    )
+
+    return {
+        "client": client,
+        "messages": messages,
+        "tool_context": {
+            "primary_client_name": client.get("name"),
+            "primary_client_id": ctx["conversation"]["client_id"],
+            "primary_client_website": client.get("website"),
+            "last_user_message": content,
+            "conversation_id": conversation_id,
+            "has_uploaded_docs": has_uploaded_docs,
+        },
+        "message_count": ctx["message_count"],
+        "upload_docs_count": upload_docs_count,
+        "has_uploaded_docs": has_uploaded_docs,
+        "attached_docs_context": attached_docs_context,
+        "context_source": ctx["source"],
+    }
@@ -0,0 +1,125 @@
+# services/rag/chunking.py
+"""
+Chunkers shared by the Notion sync and uploads.
+
+- "fixed" (default): MAX_CHARS windows with an OVERLAP stride (the original behaviour)
+- "cdc": content-defined chunking. A gear rolling hash runs over the text, and a chunk
+  boundary is placed at a paragraph/heading break whenever the hash at that break hits
+  the boundary mask (within min/max size limits). Boundaries therefore depend only on
+  the text just before them, so a local edit only changes the chunks around it.
+
+No overlap is added in "cdc" mode: boundaries already sit on paragraph breaks.
+"""
+
+from __future__ import annotations
+import os
+import random
+import re
+from typing import List
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+CHUNKING_MODE = os.getenv("CHUNKING_MODE", "fixed").strip().lower()  # fixed | cdc
+
+MAX_CHARS = 2000     # target chunk size (fixed mode)
+OVERLAP   = 300      # overlapping stride (fixed mode)
+
+CDC_MIN_CHARS = int(os.getenv("CDC_MIN_CHARS", "800"))
+CDC_MAX_CHARS = int(os.getenv("CDC_MAX_CHARS", "2400"))
+# A break is a boundary when (hash & mask) == 0 → roughly 1 in 2**bits breaks qualifies
+CDC_MASK_BITS = int(os.getenv("CDC_MASK_BITS", "3"))
+# -----------------------------
+
+_MASK64 = (1 << 64) - 1
+# Fixed seed: boundaries must be identical across processes and runs
+_GEAR = [random.Random(0x51A7 + i).getrandbits(64) for i in range(256)]
+
+_HEADING_RE = re.compile(r"^(#{1,6}\s|\d+(\.\d+)*[.)]\s|[A-Z][^.!?:]{0,80}:?$)")
+
+
+def chunk_text_fixed(text: str) -> List[str]:
+    """Split long text into overlapping character chunks."""
+    chunks: List[str] = []
+    n = len(text)
+    if n == 0:
+        return chunks
+    start = 0
+    while start < n:
+        end = min(start + MAX_CHARS, n)
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end == n:
+            break
+        start = max(0, end - OVERLAP)
+    return chunks
+
+
+def _is_heading(line: str) -> bool:
+    line = line.strip()
+    return bool(line) and len(line) <= 80 and bool(_HEADING_RE.match(line))
+
+
+def _split_oversized(block: str, limit: int) -> List[str]:
+    """Hard-split a single paragraph that is longer than `limit` (prefer sentence ends)."""
+    out: List[str] = []
+    while len(block) > limit:
+        cut = max(block.rfind(". ", 0, limit), block.rfind("\n", 0, limit))
+        cut = cut + 1 if cut > limit // 2 else limit
+        out.append(block[:cut].strip())
+        block = block[cut:].strip()
+    if block:
+        out.append(block)
+    return out
+
+
+def chunk_text_cdc(
+    text: str,
+    *,
+    min_chars: int = CDC_MIN_CHARS,
+    max_chars: int = CDC_MAX_CHARS,
+    mask_bits: int = CDC_MASK_BITS,
+) -> List[str]:
+    """Content-defined chunks aligned to paragraph/heading breaks."""
+    mask = (1 << mask_bits) - 1
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    h = 0  # rolling gear hash over the whole text
+
+    def flush() -> None:
+        nonlocal current, size
+        chunk = "\n".join(current).strip()
+        if chunk:
+            chunks.append(chunk)
+        current, size = [], 0
+
+    for line in text.split("\n"):
+        for piece in _split_oversized(line, max_chars) if len(line) > max_chars else [line]:
+            # Headings start a new chunk once the current one is big enough
+            if current and size >= min_chars and _is_heading(piece):
+                flush()
+            # Never let a chunk grow past max_chars
+            if current and size + len(piece) + 1 > max_chars:
+                flush()
+
+            current.append(piece)
+            size += len(piece) + 1
+
+            # Roll the hash through this line and its break; with a 64-bit shift only the
+            # last ~64 chars still affect it, so the decision at a break is purely local
+            for ch in piece + "\n":
+                h = ((h << 1) + _GEAR[ord(ch) & 0xFF]) & _MASK64
+            if size >= min_chars and (h >> 40) & mask == 0:
+                flush()
+
+    flush()
+    return chunks
+
+
+def chunk_text(text: str, mode: str = "") -> List[str]:
+    """Chunk with the configured mode (CHUNKING_MODE) unless `mode` is given."""
+    if (mode or CHUNKING_MODE) == "cdc":
+        return chunk_text_cdc(text)
+    return chunk_text_fixed(text)
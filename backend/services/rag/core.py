@@ -1,12 +1,41 @@
 # backend/services/rag_core.py
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Any, Dict
+import numpy as np
 from pydantic import BaseModel
 from supabase_client import supabase
-from openai import OpenAI
-import os
+from services.rag.embeddings import (  # 1536 dims
+    EMBED_MODEL,
+    MATRYOSHKA_DIMS,
+    embed_text,
+    embed_texts,
+    matryoshka_prefix,
+)
+from services.rag.index_sync import LEXICAL_INDEX_ENABLED
+from services.rag.knowledge_version import current_knowledge_version
+from services.rag.lexical_index import get_lexical_index
+from services.rag.local_index import MATRYOSHKA_RERANK_FACTOR, get_local_index
+from services.rag.result_cache import ResultCache, normalize_query
+
+# "rpc" = Supabase match_knowledge_chunks, "local" = in-process index (services/rag/local_index.py)
+RAG_SEARCH_BACKEND = os.getenv("RAG_SEARCH_BACKEND", "rpc").strip().lower()
+# Hybrid retrieval: BM25 hits (services/rag/lexical_index.py) fused with the vector ranking
+RAG_HYBRID_SEARCH = os.getenv("RAG_HYBRID_SEARCH", "false").lower() in ("1", "true", "yes")
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))  # reciprocal rank fusion damping constant
+# Two-tier retrieval (sql/005): best documents by summary embedding first, then only their chunks
+RAG_TWO_TIER_SEARCH = os.getenv("RAG_TWO_TIER_SEARCH", "false").lower() in ("1", "true", "yes")
+RAG_TWO_TIER_DOCS = int(os.getenv("RAG_TWO_TIER_DOCS", "20"))
+# rag_search_many: how many searches (RPC / index lookups) run at once
+RAG_SEARCH_MAX_CONCURRENCY = int(os.getenv("RAG_SEARCH_MAX_CONCURRENCY", "4"))
+# Result cache (invalidated by knowledge version bumps from syncs/uploads)
+RAG_RESULT_CACHE_ENABLED = os.getenv("RAG_RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RAG_RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RAG_RESULT_CACHE_MAX_ENTRIES", "2000"))
+RAG_RESULT_CACHE_TTL_SECONDS = float(os.getenv("RAG_RESULT_CACHE_TTL_SECONDS", "3600"))
 
-_oai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-EMBED_MODEL = "text-embedding-3-small"  # 1536 dims
+_result_cache = ResultCache(RAG_RESULT_CACHE_MAX_ENTRIES, RAG_RESULT_CACHE_TTL_SECONDS)
 
 class RagQuery(BaseModel):
     query: str
@@ -14,7 +43,11 @@ class RagQuery(BaseModel):
     category: Optional[str] = None
     client_id: Optional[str] = None
     min_similarity: float = 0.0
-    conversation_id: Optional[str] = None  
+    conversation_id: Optional[str] = None
+    backend: Optional[str] = None  # "rpc" | "local"; None → RAG_SEARCH_BACKEND
+    hybrid: Optional[bool] = None  # fuse BM25 + vector results; None → RAG_HYBRID_SEARCH
+    two_tier: Optional[bool] = None  # documents by summary, then their chunks; None → RAG_TWO_TIER_SEARCH
+    include_embeddings: bool = False  # attach chunk vectors (used by the snippet MMR stage)
 
 class RagChunk(BaseModel):
     chunk_id: str
@@ -26,17 +59,67 @@ class RagChunk(BaseModel):
     client_id: Optional[str] = None
     similarity: float
     content: str
+    embedding: Optional[List[float]] = None  # only with RagQuery.include_embeddings
+    tokens: Optional[int] = None  # stored per-chunk token count, when the backend returns it
 
 class RagResult(BaseModel):
     query: str
     results: List[RagChunk]
 
 def _embed(text: str) -> List[float]:
-    resp = _oai.embeddings.create(model=EMBED_MODEL, input=text)
-    return resp.data[0].embedding
+    # Repeated queries are served from the shared embedding cache
+    return embed_text(text, model=EMBED_MODEL)
 
-def rag_search(body: RagQuery) -> RagResult:
-    vec = _embed(body.query)
+def _search_rpc_two_stage(body: RagQuery, vec: List[float]) -> Optional[List[Dict[str, Any]]]:
+    """Short-vector shortlist + full re-rank in Postgres (sql/002); None if the RPC is unavailable."""
+    try:
+        rpc = supabase.rpc(
+            "match_knowledge_chunks_two_stage",
+            {
+                "query_embedding": vec,
+                "query_embedding_short": matryoshka_prefix(vec, MATRYOSHKA_DIMS),
+                "match_count": body.top_k,
+                "shortlist_count": body.top_k * MATRYOSHKA_RERANK_FACTOR,
+                "in_category": body.category,
+                "in_client": body.client_id,
+                "in_conversation": body.conversation_id,
+            },
+        ).execute()
+        return rpc.data or []
+    except Exception as e:
+        print(f"⚠️ Two-stage match RPC failed ({e}); falling back to match_knowledge_chunks")
+        return None
+
+
+def _search_rpc_two_tier(body: RagQuery, vec: List[float]) -> Optional[List[Dict[str, Any]]]:
+    """Top documents by summary embedding, then their chunks (sql/005); None if unavailable."""
+    try:
+        rpc = supabase.rpc(
+            "match_knowledge_chunks_two_tier",
+            {
+                "query_embedding": vec,
+                "match_count": body.top_k,
+                "doc_count": max(RAG_TWO_TIER_DOCS, body.top_k),
+                "in_category": body.category,
+                "in_client": body.client_id,
+                "in_conversation": body.conversation_id,
+            },
+        ).execute()
+        return rpc.data or []
+    except Exception as e:
+        print(f"⚠️ Two-tier match RPC failed ({e}); falling back to chunk search")
+        return None
+
+
+def _search_rpc(body: RagQuery, vec: List[float]) -> List[Dict[str, Any]]:
+    if RAG_TWO_TIER_SEARCH if body.two_tier is None else body.two_tier:
+        rows = _search_rpc_two_tier(body, vec)
+        if rows is not None:
+            return rows
+    if MATRYOSHKA_DIMS:
+        rows = _search_rpc_two_stage(body, vec)
+        if rows is not None:
+            return rows
     rpc = supabase.rpc(
         "match_knowledge_chunks",
         {
@@ -47,10 +130,124 @@ def rag_search(body: RagQuery) -> RagResult:
             "in_conversation": body.conversation_id,
         },
     ).execute()
+    return rpc.data or []
+
+
+def _search_local(body: RagQuery, vec: List[float]) -> Optional[List[Dict[str, Any]]]:
+    """Local index search; None when the index is empty/unavailable (caller falls back to RPC)."""
+    try:
+        index = get_local_index()
+        if len(index) == 0:
+            print("⚠️ Local RAG index is empty; falling back to RPC")
+            return None
+        return index.search(
+            vec,
+            top_k=body.top_k,
+            category=body.category,
+            client_id=body.client_id,
+            conversation_id=body.conversation_id,
+            with_vectors=body.include_embeddings,
+        )
+    except Exception as e:
+        print(f"⚠️ Local RAG index search failed ({e}); falling back to RPC")
+        return None
+
+
+def _search_lexical(body: RagQuery) -> List[Dict[str, Any]]:
+    """BM25 candidates with the same filters; [] when the lexical index is unavailable."""
+    try:
+        return get_lexical_index().search(
+            body.query,
+            top_k=body.top_k,
+            category=body.category,
+            client_id=body.client_id,
+            conversation_id=body.conversation_id,
+        )
+    except Exception as e:
+        print(f"⚠️ Lexical RAG search failed ({e}); using vector results only")
+        return []
+
+
+def _fuse_rrf(
+    vector_rows: List[Dict[str, Any]],
+    lexical_rows: List[Dict[str, Any]],
+    vec: List[float],
+    top_k: int,
+) -> List[Dict[str, Any]]:
+    """
+    Reciprocal rank fusion: score = Σ 1 / (RRF_K + rank) over both rankings.
+    Lexical-only hits get their exact cosine similarity from the lexical index's stored
+    vectors, so similarity floors downstream mean the same thing as before.
+    """
+    scores: Dict[str, float] = {}
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for ranked in (vector_rows, lexical_rows):
+        for rank, r in enumerate(ranked, start=1):
+            cid = str(r["chunk_id"])
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (RRF_K + rank)
+            by_id.setdefault(cid, r)
+
+    lexical_only = [cid for cid, r in by_id.items() if r.get("similarity") is None]
+    if lexical_only:
+        q = np.asarray(vec, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        stored = get_lexical_index().vectors(lexical_only)
+        for cid in lexical_only:
+            v = stored.get(cid)
+            sim = float(v @ q / (np.linalg.norm(v) or 1.0)) if v is not None else 0.0
+            by_id[cid] = {**by_id[cid], "similarity": sim}
+
+    best = sorted(scores, key=lambda cid: scores[cid], reverse=True)[:top_k]
+    return [by_id[cid] for cid in best]
+
+
+def _attach_embeddings(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill in row["embedding"] where missing: lexical index copies first (when enabled), then Supabase."""
+    missing = [str(r["chunk_id"]) for r in rows if r.get("embedding") is None]
+    if not missing:
+        return rows
+    found: Dict[str, Any] = {}
+    if LEXICAL_INDEX_ENABLED:
+        try:
+            found.update(get_lexical_index().vectors(missing))
+        except Exception as e:
+            print(f"⚠️ Lexical index vectors unavailable ({e})")
+    rest = [cid for cid in missing if cid not in found]
+    if rest:
+        try:
+            res = supabase.table("knowledge_chunks").select("id, embedding").in_("id", rest).execute()
+            for r in res.data or []:
+                emb = r.get("embedding")
+                found[str(r["id"])] = json.loads(emb) if isinstance(emb, str) else emb  # pgvector text
+        except Exception as e:
+            print(f"⚠️ Could not fetch chunk embeddings ({e})")
+    out = []
+    for r in rows:
+        emb = found.get(str(r["chunk_id"]))
+        out.append({**r, "embedding": emb} if r.get("embedding") is None and emb is not None else r)
+    return out
+
+
+def _as_list(vec: Any) -> Optional[List[float]]:
+    return None if vec is None else [float(x) for x in vec]
+
+
+def _search_with_vector(body: RagQuery, vec: List[float]) -> RagResult:
+    hybrid = RAG_HYBRID_SEARCH if body.hybrid is None else body.hybrid
+    lexical_rows = _search_lexical(body) if hybrid else []
+
+    rows: Optional[List[Dict[str, Any]]] = None
+    if (body.backend or RAG_SEARCH_BACKEND) == "local":
+        rows = _search_local(body, vec)
+    if rows is None:
+        rows = _search_rpc(body, vec)
+    if lexical_rows:
+        rows = _fuse_rrf(rows, lexical_rows, vec, body.top_k)
 
-    rows: List[Dict[str, Any]] = rpc.data or []
     # Optional filter; tool usually sets 0.0 and filters later.
     rows = [r for r in rows if float(r["similarity"]) >= body.min_similarity]
+    if body.include_embeddings:
+        rows = _attach_embeddings(rows)
 
     out = [
         RagChunk(
@@ -63,7 +260,94 @@ def rag_search(body: RagQuery) -> RagResult:
             client_id=r.get("client_id"),
             similarity=float(r["similarity"]),
             content=r["content"],
+            embedding=_as_list(r.get("embedding")) if body.include_embeddings else None,
+            tokens=r.get("tokens"),
         )
         for r in rows
     ]
     return RagResult(query=body.query, results=out)
+
+
+def get_result_cache() -> ResultCache:
+    return _result_cache
+
+
+def _cache_key(body: RagQuery) -> tuple:
+    return (
+        normalize_query(body.query),
+        body.category,
+        body.client_id,
+        body.conversation_id,
+        body.top_k,
+        body.min_similarity,
+        body.backend or RAG_SEARCH_BACKEND,
+        RAG_HYBRID_SEARCH if body.hybrid is None else body.hybrid,
+        RAG_TWO_TIER_SEARCH if body.two_tier is None else body.two_tier,
+        body.include_embeddings,
+    )
+
+
+def _cache_version() -> Optional[int]:
+    """Knowledge version to tag/check cache entries with (None → don't cache)."""
+    return current_knowledge_version() if RAG_RESULT_CACHE_ENABLED else None
+
+
+def _cached(body: RagQuery, version: Optional[int]) -> Optional[RagResult]:
+    if version is None:
+        return None
+    hit = _result_cache.get(_cache_key(body), version)
+    # Same normalized query, but echo back the caller's exact wording
+    return hit.model_copy(update={"query": body.query}) if hit is not None else None
+
+
+def rag_search(body: RagQuery) -> RagResult:
+    version = _cache_version()
+    hit = _cached(body, version)
+    if hit is not None:
+        return hit
+
+    start = time.perf_counter()
+    result = _search_with_vector(body, _embed(body.query))
+    if version is not None:
+        _result_cache.put(_cache_key(body), version, result, (time.perf_counter() - start) * 1000)
+    return result
+
+
+def rag_search_many(
+    bodies: List[RagQuery],
+    vectors: Optional[List[List[float]]] = None,
+) -> List[RagResult]:
+    """
+    Several searches at once (e.g. parallel tool calls in one model turn):
+    all queries are embedded in a single request, the searches run concurrently,
+    and results come back in input order.
+    `vectors` (same order as `bodies`) skips the embedding step when the caller has them.
+    """
+    if not bodies:
+        return []
+    version = _cache_version()
+    results: List[Optional[RagResult]] = [_cached(b, version) for b in bodies]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if not todo:
+        return results  # type: ignore[return-value]
+
+    start = time.perf_counter()
+    misses = [bodies[i] for i in todo]
+    if vectors is not None:
+        vecs = [vectors[i] for i in todo]
+    else:
+        vecs = embed_texts([b.query for b in misses], model=EMBED_MODEL)
+    if len(misses) == 1 or RAG_SEARCH_MAX_CONCURRENCY <= 1:
+        fresh = [_search_with_vector(b, v) for b, v in zip(misses, vecs)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(RAG_SEARCH_MAX_CONCURRENCY, len(misses))) as pool:
+            # map() preserves submission order
+            fresh = list(pool.map(_search_with_vector, misses, vecs))
+
+    # The batch ran as one unit, so each result is credited with the whole batch time
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for i, body, result in zip(todo, misses, fresh):
+        results[i] = result
+        if version is not None:
+            _result_cache.put(_cache_key(body), version, result, elapsed_ms)
+    return results  # type: ignore[return-value]
@@ -0,0 +1,189 @@
+# services/rag/doc_summaries.py
+"""
+Document-level summaries for two-tier retrieval (sql/005_document_summaries.sql).
+
+- Every knowledge document gets a short summary (gpt-4o-mini) and an embedding of
+  "title + summary", stored on knowledge_documents (summary, summary_embedding)
+- Incremental: `summary_checksum` records the document checksum the summary was built from;
+  only documents whose checksum moved are summarized again
+- Sync pipelines call `refresh_document_summaries(changed_ids)`, uploads do it in the
+  background, and the daily sync retries anything still stale:
+      python -m services.rag.doc_summaries     # backfill every stale document
+- If the LLM call fails we store a lead-paragraph fallback (so the document is still
+  findable at the document tier) but leave summary_checksum empty so it is retried
+- Never raises: a failed summary only costs two-tier recall for that document, and
+  documents without a summary embedding are always searched by the two-tier RPC
+"""
+
+from __future__ import annotations
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from supabase_client import supabase
+from services.rag.embeddings import EMBED_MODEL, EmbeddingError, embed_texts
+from services.rag.knowledge_version import bump_knowledge_version
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+DOC_SUMMARIES_ENABLED = os.getenv("RAG_DOC_SUMMARIES", "true").lower() in ("1", "true", "yes")
+SUMMARY_MODEL = os.getenv("RAG_DOC_SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_INPUT_CHARS = int(os.getenv("RAG_DOC_SUMMARY_INPUT_CHARS", "12000"))  # ~3k tokens read
+SUMMARY_MAX_TOKENS = int(os.getenv("RAG_DOC_SUMMARY_MAX_TOKENS", "220"))
+SUMMARY_CONCURRENCY = int(os.getenv("RAG_DOC_SUMMARY_CONCURRENCY", "4"))
+FALLBACK_CHARS = 600
+# -----------------------------
+
+_BATCH = 32
+_PAGE_SIZE = 500
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def _lead(text: str) -> str:
+    """Fallback summary: whole sentences from the start of the document."""
+    text = re.sub(r"\s+", " ", text or "").strip()
+    if len(text) <= FALLBACK_CHARS:
+        return text
+    out = ""
+    for sentence in _SENTENCE_END_RE.split(text):
+        if out and len(out) + len(sentence) + 1 > FALLBACK_CHARS:
+            break
+        out = f"{out} {sentence}".strip()
+    return out[:FALLBACK_CHARS]
+
+
+def _summarize(title: str, text: str) -> Tuple[str, bool]:
+    """(summary, from_llm). Falls back to the lead paragraph when the LLM call fails."""
+    try:
+        response = _client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "You summarize internal agency documents (SOPs, meeting notes, client "
+                        "profiles, web pages) for search. Write 3-5 plain sentences: what the "
+                        "document is, who/which client it concerns, and the main topics, "
+                        "decisions and commitments. No preamble."
+                    ),
+                },
+                {"role": "user", "content": f"Title: {title}\n\n{text[:SUMMARY_INPUT_CHARS]}"},
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+        summary = (response.choices[0].message.content or "").strip()
+        if summary:
+            return summary, True
+    except Exception as e:
+        print(f"⚠️ Summary failed for '{title}': {e}")
+    return _lead(text), False
+
+
+def _stale_rows(document_ids: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """Documents whose summary was not built from their current checksum."""
+    rows: List[Dict[str, Any]] = []
+    query = "id, checksum, summary_checksum"
+    if document_ids is not None:
+        for i in range(0, len(document_ids), 200):
+            res = (
+                supabase.table("knowledge_documents")
+                .select(query)
+                .in_("id", document_ids[i:i + 200])
+                .execute()
+            )
+            rows.extend(res.data or [])
+    else:
+        start = 0
+        while True:
+            page = (
+                supabase.table("knowledge_documents")
+                .select(query)
+                .order("id")
+                .range(start, start + _PAGE_SIZE - 1)
+                .execute()
+                .data or []
+            )
+            rows.extend(page)
+            if len(page) < _PAGE_SIZE:
+                break
+            start += _PAGE_SIZE
+    return [r for r in rows if r.get("checksum") and r.get("summary_checksum") != r["checksum"]]
+
+
+def _summarize_batch(ids: List[str], stats: Dict[str, int]) -> None:
+    docs = (
+        supabase.table("knowledge_documents")
+        .select("id, title, raw_text, checksum")
+        .in_("id", ids)
+        .execute()
+        .data or []
+    )
+    docs = [d for d in docs if (d.get("raw_text") or "").strip()]
+    if not docs:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, SUMMARY_CONCURRENCY)) as pool:
+        summaries = list(pool.map(lambda d: _summarize(d.get("title") or "", d["raw_text"]), docs))
+    try:
+        vectors = embed_texts(
+            [f"{d.get('title') or ''}\n\n{s}".strip() for d, (s, _) in zip(docs, summaries)],
+            model=EMBED_MODEL,
+        )
+    except EmbeddingError as e:
+        print(f"⚠️ Summary embeddings failed for {len(docs)} documents: {e}")
+        stats["failed"] += len(docs)
+        return
+
+    for d, (summary, from_llm), vec in zip(docs, summaries, vectors):
+        supabase.table("knowledge_documents").update({
+            "summary": summary,
+            "summary_embedding": vec,
+            # fallback summaries stay "stale" so the next run retries the LLM
+            "summary_checksum": d["checksum"] if from_llm else None,
+        }).eq("id", d["id"]).execute()
+        stats["summarized" if from_llm else "fallback"] += 1
+
+
+def refresh_document_summaries(document_ids: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Summarize + embed the given documents (None = all) whose checksum changed since their
+    last summary. Returns {"checked", "summarized", "fallback", "failed"}.
+    """
+    stats = {"checked": 0, "summarized": 0, "fallback": 0, "failed": 0}
+    if not DOC_SUMMARIES_ENABLED or document_ids == []:
+        return stats
+    try:
+        stale = _stale_rows(list(document_ids) if document_ids is not None else None)
+        stats["checked"] = len(stale)
+        for i in range(0, len(stale), _BATCH):
+            _summarize_batch([r["id"] for r in stale[i:i + _BATCH]], stats)
+    except Exception as e:
+        print(f"⚠️ Document summary refresh failed: {e}")
+    if stats["summarized"] or stats["fallback"]:
+        # two-tier results depend on summary embeddings
+        bump_knowledge_version("document summaries")
+        print(
+            f"📝 Document summaries: summarized={stats['summarized']}, "
+            f"fallback={stats['fallback']}, failed={stats['failed']}"
+        )
+    return stats
+
+
+def refresh_document_summaries_async(document_ids: List[str]) -> None:
+    """Request paths (uploads): summarize in a daemon thread instead of holding the response."""
+    if DOC_SUMMARIES_ENABLED and document_ids:
+        threading.Thread(
+            target=refresh_document_summaries, args=(list(document_ids),), daemon=True,
+        ).start()
+
+
+if __name__ == "__main__":
+    refresh_document_summaries()
@@ -0,0 +1,169 @@
+# services/rag/embedding_cache.py
+"""
+Content-addressed embedding cache.
+
+- Keyed on (model, sha256(input text)) so identical inputs never hit OpenAI twice
+- Persisted in a single local SQLite file (WAL mode, safe to share between the API and sync scripts)
+- Size-bounded: least-recently-used rows are evicted once `max_entries` is exceeded
+- Keeps in-process hit/miss/write/eviction counters for observability
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+# Evict down to this fraction of max_entries so we don't evict on every single write
+_EVICT_TO_RATIO = 0.9
+
+
+def cache_key(model: str, text: str) -> str:
+    """Stable cache key for one embedding input."""
+    digest = hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+def _encode(vec: Sequence[float]) -> bytes:
+    # pgvector stores float4 anyway, so float32 loses nothing we'd keep downstream
+    return array("f", vec).tobytes()
+
+
+def _decode(blob: bytes) -> List[float]:
+    arr = array("f")
+    arr.frombytes(blob)
+    return arr.tolist()
+
+
+class EmbeddingCache:
+    """SQLite-backed LRU cache of embedding vectors."""
+
+    def __init__(self, path: str, max_entries: int) -> None:
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key       TEXT PRIMARY KEY,
+                model     TEXT NOT NULL,
+                dims      INTEGER NOT NULL,
+                vector    BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    # -----------------------------
+    # Reads / writes
+    # -----------------------------
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Return one vector (or None on miss) per input text, in input order."""
+        if not texts:
+            return []
+        keys = [cache_key(model, t) for t in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" for _ in batch)
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = _decode(blob)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+
+            out: List[Optional[List[float]]] = []
+            for key in keys:
+                vec = found.get(key)
+                if vec is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                out.append(vec)
+        return out
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Store vectors for the given texts, then evict LRU rows if we're over budget."""
+        if not texts:
+            return
+        now = time.time()
+        rows = [
+            (cache_key(model, t), model, len(v), _encode(v), now)
+            for t, v in zip(texts, vectors)
+            if v
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, model, dims, vector, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            inserted = self._conn.total_changes - before
+            self._count += inserted
+            self.writes += inserted
+            if self._count > self.max_entries:
+                self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self) -> None:
+        # Another process may have written too, so re-count before deciding how much to drop
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        target = int(self.max_entries * _EVICT_TO_RATIO)
+        excess = self._count - target
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (excess,),
+        )
+        self._count -= excess
+        self.evictions += excess
+
+    # -----------------------------
+    # Observability
+    # -----------------------------
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,203 @@
+# services/rag/embeddings.py
+"""
+Single entry point for every embedding call in QUORRA.
+
+- `rag_search` (query embeddings), the Notion sync, the website sync and uploads all go through here
+- Looks vectors up in the shared EmbeddingCache first; only cache misses go over the network
+- Misses are packed into as few requests as possible under a tiktoken-measured token limit,
+  and a bounded number of those requests run concurrently (output order is always stable)
+- If a batch request fails, its items are retried one by one; anything that still fails
+  raises EmbeddingError instead of silently coming back empty
+"""
+
+from __future__ import annotations
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from openai import OpenAI
+
+from services.rag.embedding_cache import EmbeddingCache
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+EMBED_MODEL = "text-embedding-3-small"  # 1536 dims; matches vector(1536)
+
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", ".cache/embeddings.sqlite3")
+# ~6 KB per 1536-dim vector → 50k entries ≈ 300 MB on disk
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "50000"))
+
+# Request packing (OpenAI allows up to 2048 inputs and ~300k tokens per embeddings request)
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "50000"))
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "512"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_ITEM_RETRIES = int(os.getenv("EMBED_ITEM_RETRIES", "2"))
+
+# Matryoshka prefix vectors: text-embedding-3 front-loads information, so the first N dims
+# (re-normalized) are a usable short embedding. 0 = off; must match knowledge_chunks.embedding_short
+MATRYOSHKA_DIMS = int(os.getenv("RAG_MATRYOSHKA_DIMS", "0"))
+# -----------------------------
+
+# sql/002 declares embedding_short as vector(256); any other length fails every chunk write
+if MATRYOSHKA_DIMS not in (0, 256):
+    raise RuntimeError(f"RAG_MATRYOSHKA_DIMS must be 0 or 256 (sql/002 embedding_short), got {MATRYOSHKA_DIMS}")
+
+_oai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_cache: Optional[EmbeddingCache] = None
+_encoding = None
+
+
+class EmbeddingError(RuntimeError):
+    """Raised when some inputs could not be embedded even after per-item retries."""
+
+    def __init__(self, failed: Dict[int, str]) -> None:
+        self.failed = failed  # input index → last error message
+        first = next(iter(failed.values()), "")
+        super().__init__(f"Failed to embed {len(failed)} input(s): {first}")
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Lazily open the shared cache (None when disabled)."""
+    global _cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = EmbeddingCache(EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES)
+    return _cache
+
+
+def count_embedding_tokens(text: str) -> int:
+    """Token count as the embedding model sees it (falls back to ~4 chars/token)."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(EMBED_MODEL)
+        except Exception as e:
+            print(f"⚠️ tiktoken unavailable ({e}); estimating tokens as chars/4")
+            _encoding = False  # don't retry the (possibly network) load on every call
+    if not _encoding:
+        return max(1, len(text or "") // 4)
+    return len(_encoding.encode(text or ""))
+
+
+def matryoshka_prefix(vec: Sequence[float], dims: int = MATRYOSHKA_DIMS) -> List[float]:
+    """First `dims` components of an embedding, re-normalized to unit length."""
+    head = [float(x) for x in vec[:dims]]
+    norm = sum(x * x for x in head) ** 0.5 or 1.0
+    return [x / norm for x in head]
+
+
+def _plan_batches(token_counts: Sequence[int], max_tokens: int, max_items: int) -> List[List[int]]:
+    """Greedily pack consecutive inputs into batches under the token/item limits."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for idx, n in enumerate(token_counts):
+        if current and (current_tokens + n > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_uncached(texts: List[str], model: str) -> List[List[float]]:
+    resp = _oai.embeddings.create(model=model, input=texts)
+    return [item.embedding for item in resp.data]
+
+
+def _embed_one_with_retries(text: str, model: str) -> List[float]:
+    last_err: Optional[Exception] = None
+    attempts = max(1, EMBED_ITEM_RETRIES)
+    for attempt in range(attempts):
+        try:
+            return _embed_uncached([text], model)[0]
+        except Exception as e:
+            last_err = e
+            if attempt + 1 < attempts:  # no backoff after the last attempt
+                time.sleep(0.5 * (2 ** attempt))
+    raise last_err  # type: ignore[misc]
+
+
+def _run_batch(texts: List[str], model: str) -> List[Optional[object]]:
+    """Embed one batch; on failure retry each item alone. Failed items come back as exceptions."""
+    try:
+        return list(_embed_uncached(texts, model))
+    except Exception as e:
+        print(f"⚠️ Embedding batch of {len(texts)} failed ({e}); retrying items individually")
+
+    out: List[Optional[object]] = []
+    for t in texts:
+        try:
+            out.append(_embed_one_with_retries(t, model))
+        except Exception as e:
+            out.append(e)
+    return out
+
+
+def embed_texts(
+    texts: List[str],
+    *,
+    model: str = EMBED_MODEL,
+    max_tokens_per_request: int = EMBED_BATCH_MAX_TOKENS,
+    max_concurrency: int = EMBED_MAX_CONCURRENCY,
+) -> List[List[float]]:
+    """
+    Embed a list of texts (cache first), returning vectors in input order.
+    Raises EmbeddingError if any input still fails after individual retries;
+    everything that did succeed is cached before raising.
+    """
+    if not texts:
+        return []
+
+    cache = get_embedding_cache()
+    vectors: List[Optional[List[float]]] = (
+        cache.get_many(model, texts) if cache else [None] * len(texts)
+    )
+
+    # Embed each distinct missing text once
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if not missing:
+        return vectors  # type: ignore[return-value]
+
+    batches = _plan_batches(
+        [count_embedding_tokens(t) for t in missing],
+        max_tokens_per_request,
+        EMBED_BATCH_MAX_ITEMS,
+    )
+    batch_texts = [[missing[i] for i in b] for b in batches]
+
+    if len(batches) == 1 or max_concurrency <= 1:
+        batch_results = [_run_batch(bt, model) for bt in batch_texts]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as pool:
+            # map() preserves submission order, so output order stays stable
+            batch_results = list(pool.map(lambda bt: _run_batch(bt, model), batch_texts))
+
+    fresh: Dict[str, List[float]] = {}
+    errors: Dict[str, str] = {}
+    for bt, results in zip(batch_texts, batch_results):
+        for t, r in zip(bt, results):
+            if isinstance(r, Exception):
+                errors[t] = str(r)
+            else:
+                fresh[t] = r  # type: ignore[assignment]
+
+    if cache and fresh:
+        cache.put_many(model, list(fresh), list(fresh.values()))
+
+    if errors:
+        raise EmbeddingError({i: errors[t] for i, t in enumerate(texts) if t in errors})
+
+    return [v if v is not None else fresh[t] for t, v in zip(texts, vectors)]
+
+
+def embed_text(text: str, *, model: str = EMBED_MODEL) -> List[float]:
+    """Embed a single text (cache first)."""
+    return embed_texts([text], model=model)[0]
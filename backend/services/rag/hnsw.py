@@ -0,0 +1,226 @@
+# services/rag/hnsw.py
+"""
+Small HNSW (hierarchical navigable small world) graph for the local vector index.
+
+- Vectors are expected L2-normalized, so similarity = dot product (cosine)
+- Built once per compacted segment, then stored as plain .npy arrays that are
+  memory-mapped at load time (workers share the pages, startup is instant)
+- Search accepts an `allowed` boolean mask so category/client/conversation
+  pre-filters are applied during the graph walk, not after it
+"""
+
+from __future__ import annotations
+import heapq
+import json
+import math
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+HNSW_META = "hnsw.json"
+
+
+class HnswGraph:
+    def __init__(
+        self,
+        *,
+        m: int,
+        entry: int,
+        max_level: int,
+        layer0: np.ndarray,
+        upper: Dict[int, Tuple[np.ndarray, np.ndarray]],
+    ) -> None:
+        self.m = m
+        self.entry = entry
+        self.max_level = max_level
+        self.layer0 = layer0          # int32 [n, 2m], -1 padded
+        self.upper = upper            # level → (node ids int32 [k], neighbours int32 [k, m])
+        self._upper_pos = {
+            lvl: {int(node): i for i, node in enumerate(nodes)}
+            for lvl, (nodes, _) in upper.items()
+        }
+
+    # -----------------------------
+    # Build
+    # -----------------------------
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        *,
+        m: int = 16,
+        ef_construction: int = 100,
+        seed: int = 42,
+    ) -> "HnswGraph":
+        n = int(vectors.shape[0])
+        rng = random.Random(seed)
+        ml = 1.0 / math.log(max(m, 2))
+        levels = [min(int(-math.log(1.0 - rng.random()) * ml), 16) for _ in range(n)]
+        links: List[Dict[int, List[int]]] = [dict() for _ in range((max(levels) if n else 0) + 1)]
+
+        entry, max_level = 0, -1
+        for i in range(n):
+            q = vectors[i]
+            lvl = levels[i]
+            for lc in range(lvl + 1):
+                links[lc][i] = []
+            if max_level < 0:
+                entry, max_level = i, lvl
+                continue
+
+            ep = [entry]
+            for lc in range(max_level, lvl, -1):
+                ep = [_search_layer(vectors, links[lc].get, q, ep, 1)[0][1]]
+
+            for lc in range(min(lvl, max_level), -1, -1):
+                found = _search_layer(vectors, links[lc].get, q, ep, ef_construction)
+                cap = 2 * m if lc == 0 else m
+                neighbours = [node for _, node in found[:m]]
+                links[lc][i] = neighbours
+                for nb in neighbours:
+                    nb_links = links[lc][nb]
+                    nb_links.append(i)
+                    if len(nb_links) > cap:
+                        sims = vectors[nb_links] @ vectors[nb]
+                        keep = np.argsort(-sims)[:cap]
+                        links[lc][nb] = [nb_links[j] for j in keep]
+                ep = [node for _, node in found]
+
+            if lvl > max_level:
+                entry, max_level = i, lvl
+
+        layer0 = np.full((n, 2 * m), -1, dtype=np.int32)
+        for node, nbs in links[0].items() if links else []:
+            layer0[node, : len(nbs)] = nbs
+        upper: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for lc in range(1, len(links)):
+            nodes = np.array(sorted(links[lc]), dtype=np.int32)
+            neigh = np.full((len(nodes), m), -1, dtype=np.int32)
+            for row, node in enumerate(nodes):
+                nbs = links[lc][int(node)][:m]
+                neigh[row, : len(nbs)] = nbs
+            upper[lc] = (nodes, neigh)
+
+        return cls(m=m, entry=entry, max_level=max(max_level, 0), layer0=layer0, upper=upper)
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def save(self, path: str) -> None:
+        np.save(os.path.join(path, "hnsw_layer0.npy"), self.layer0)
+        for lvl, (nodes, neigh) in self.upper.items():
+            np.save(os.path.join(path, f"hnsw_l{lvl}_nodes.npy"), nodes)
+            np.save(os.path.join(path, f"hnsw_l{lvl}_neigh.npy"), neigh)
+        with open(os.path.join(path, HNSW_META), "w", encoding="utf-8") as f:
+            json.dump(
+                {"m": self.m, "entry": self.entry, "max_level": self.max_level,
+                 "levels": sorted(self.upper)},
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["HnswGraph"]:
+        meta_path = os.path.join(path, HNSW_META)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        layer0 = np.load(os.path.join(path, "hnsw_layer0.npy"), mmap_mode="r")
+        upper = {
+            lvl: (
+                np.load(os.path.join(path, f"hnsw_l{lvl}_nodes.npy")),
+                np.load(os.path.join(path, f"hnsw_l{lvl}_neigh.npy")),
+            )
+            for lvl in meta["levels"]
+        }
+        return cls(m=meta["m"], entry=meta["entry"], max_level=meta["max_level"],
+                   layer0=layer0, upper=upper)
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+    def _neighbours(self, level: int):
+        if level == 0:
+            layer0 = self.layer0
+
+            def get(node: int) -> List[int]:
+                row = layer0[node]
+                return row[row >= 0].tolist()
+            return get
+
+        nodes_pos = self._upper_pos[level]
+        neigh = self.upper[level][1]
+
+        def get_upper(node: int) -> List[int]:
+            row = neigh[nodes_pos[node]]
+            return row[row >= 0].tolist()
+        return get_upper
+
+    def search(
+        self,
+        vectors: np.ndarray,
+        q: np.ndarray,
+        k: int,
+        *,
+        ef: int = 64,
+        allowed: Optional[np.ndarray] = None,
+    ) -> List[Tuple[float, int]]:
+        """Return up to k (similarity, node) pairs, best first, restricted to `allowed` nodes."""
+        if self.layer0.shape[0] == 0:
+            return []
+        ep = [self.entry]
+        for lvl in range(self.max_level, 0, -1):
+            ep = [_search_layer(vectors, self._neighbours(lvl), q, ep, 1)[0][1]]
+        found = _search_layer(
+            vectors, self._neighbours(0), q, ep, max(ef, k), allowed=allowed,
+        )
+        return found[:k]
+
+
+def _search_layer(
+    vectors: np.ndarray,
+    neighbours,
+    q: np.ndarray,
+    entry_points: List[int],
+    ef: int,
+    *,
+    allowed: Optional[np.ndarray] = None,
+    max_visits: Optional[int] = None,
+) -> List[Tuple[float, int]]:
+    """
+    Best-first beam search on one layer. With `allowed`, the walk still goes through
+    every node but only allowed nodes enter the result set, so the beam keeps
+    expanding until it has `ef` admissible results (capped by max_visits).
+    """
+    max_visits = max_visits or ef * 40
+    visited = set(entry_points)
+    sims = vectors[entry_points] @ q
+    candidates = [(-float(s), node) for s, node in zip(sims, entry_points)]
+    heapq.heapify(candidates)
+    results: List[Tuple[float, int]] = []  # min-heap of (sim, node)
+    for s, node in zip(sims, entry_points):
+        if allowed is None or allowed[node]:
+            heapq.heappush(results, (float(s), node))
+
+    while candidates and len(visited) < max_visits:
+        neg_sim, node = heapq.heappop(candidates)
+        if len(results) >= ef and -neg_sim < results[0][0]:
+            break
+        fresh = [nb for nb in (neighbours(node) or []) if nb not in visited]
+        if not fresh:
+            continue
+        visited.update(fresh)
+        nb_sims = vectors[fresh] @ q
+        worst = results[0][0] if len(results) >= ef else -np.inf
+        for s, nb in zip(nb_sims.tolist(), fresh):
+            if s > worst or len(results) < ef:
+                heapq.heappush(candidates, (-s, nb))
+                if allowed is None or allowed[nb]:
+                    heapq.heappush(results, (s, nb))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+                    worst = results[0][0] if len(results) >= ef else -np.inf
+
+    return sorted(results, reverse=True)
@@ -0,0 +1,167 @@
+# services/rag/index_sync.py
+"""
+Keeps the local indexes in step with Supabase:
+  * vector index  (services/rag/local_index.py)   → RAG_LOCAL_INDEX_ENABLED
+    (defaults to on when RAG_SEARCH_BACKEND=local)
+  * lexical index (services/rag/lexical_index.py) → RAG_LEXICAL_INDEX_ENABLED
+    (defaults to on when RAG_HYBRID_SEARCH is on)
+
+- Sync pipelines and uploads call `documents_changed` / `documents_deleted` after they
+  write knowledge_chunks; we read those documents' chunks back once and swap them into
+  every enabled index
+- `rebuild_indexes()` reloads everything (first run, or to repair drift):
+      python -m services.rag.index_sync
+- The same hooks bump the knowledge version (services/rag/knowledge_version.py), which
+  invalidates cached rag_search results in every API worker
+- Hooks never raise: a failed index update only costs freshness, never a sync
+"""
+
+from __future__ import annotations
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from supabase_client import supabase
+from services.rag.knowledge_version import bump_knowledge_version
+from services.rag.lexical_index import get_lexical_index
+from services.rag.local_index import get_local_index
+
+_DEFAULT_ENABLED = "true" if os.getenv("RAG_SEARCH_BACKEND", "rpc").strip().lower() == "local" else "false"
+LOCAL_INDEX_ENABLED = os.getenv("RAG_LOCAL_INDEX_ENABLED", _DEFAULT_ENABLED).lower() in ("1", "true", "yes")
+_DEFAULT_LEXICAL = os.getenv("RAG_HYBRID_SEARCH", "false")
+LEXICAL_INDEX_ENABLED = os.getenv("RAG_LEXICAL_INDEX_ENABLED", _DEFAULT_LEXICAL).lower() in ("1", "true", "yes")
+_PAGE_SIZE = 500
+
+_CHUNK_SELECT = (
+    "id, document_id, chunk_index, content, tokens, category, client_id, embedding, "
+    "knowledge_documents(title, source_url, conversation_id)"
+)
+
+
+def _to_index_row(r: Dict[str, Any]) -> Dict[str, Any]:
+    doc = r.get("knowledge_documents") or {}
+    emb = r.get("embedding")
+    if isinstance(emb, str):  # pgvector comes back as "[0.1,0.2,...]"
+        emb = json.loads(emb)
+    return {
+        "chunk_id": r["id"],
+        "document_id": r["document_id"],
+        "chunk_index": r["chunk_index"],
+        "doc_title": doc.get("title") or "",
+        "source_url": doc.get("source_url"),
+        "category": r.get("category"),
+        "client_id": r.get("client_id"),
+        "conversation_id": doc.get("conversation_id"),
+        "content": r.get("content") or "",
+        "tokens": r.get("tokens"),
+        "embedding": emb,
+    }
+
+
+def _fetch_chunks(document_ids: List[str]) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for i in range(0, len(document_ids), 100):
+        batch = document_ids[i:i + 100]
+        res = (
+            supabase.table("knowledge_chunks")
+            .select(_CHUNK_SELECT)
+            .in_("document_id", batch)
+            .execute()
+        )
+        rows.extend(_to_index_row(r) for r in (res.data or []))
+    return rows
+
+
+def documents_changed(document_ids: Iterable[str], *, allow_compaction: bool = True) -> None:
+    """Re-read these documents' chunks and replace them in the enabled local indexes."""
+    doc_ids = [d for d in dict.fromkeys(document_ids) if d]
+    if not doc_ids:
+        return
+    bump_knowledge_version(f"{len(doc_ids)} document(s) changed")
+    if not (LOCAL_INDEX_ENABLED or LEXICAL_INDEX_ENABLED):
+        return
+    try:
+        rows = _fetch_chunks(doc_ids)
+    except Exception as e:
+        print(f"⚠️ Local index update failed (fetching chunks): {e}")
+        return
+
+    if LOCAL_INDEX_ENABLED:
+        try:
+            get_local_index().apply(
+                upserts=rows, delete_document_ids=doc_ids, allow_compaction=allow_compaction,
+            )
+            print(f"🗂️ Local index: refreshed {len(doc_ids)} document(s), {len(rows)} chunk(s)")
+        except Exception as e:
+            print(f"⚠️ Local index update failed: {e}")
+    if LEXICAL_INDEX_ENABLED:
+        try:
+            get_lexical_index().apply(upserts=rows, delete_document_ids=doc_ids)
+            print(f"🔤 Lexical index: refreshed {len(doc_ids)} document(s), {len(rows)} chunk(s)")
+        except Exception as e:
+            print(f"⚠️ Lexical index update failed: {e}")
+
+
+def documents_deleted(document_ids: Iterable[str]) -> None:
+    """Drop these documents from the enabled local indexes."""
+    doc_ids = [d for d in dict.fromkeys(document_ids) if d]
+    if not doc_ids:
+        return
+    bump_knowledge_version(f"{len(doc_ids)} document(s) deleted")
+    if LOCAL_INDEX_ENABLED:
+        try:
+            get_local_index().apply(upserts=[], delete_document_ids=doc_ids)
+            print(f"🗂️ Local index: removed {len(doc_ids)} document(s)")
+        except Exception as e:
+            print(f"⚠️ Local index delete failed: {e}")
+    if LEXICAL_INDEX_ENABLED:
+        try:
+            get_lexical_index().apply(upserts=[], delete_document_ids=doc_ids)
+            print(f"🔤 Lexical index: removed {len(doc_ids)} document(s)")
+        except Exception as e:
+            print(f"⚠️ Lexical index delete failed: {e}")
+
+
+def _fetch_all_chunks() -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    start = 0
+    while True:
+        res = (
+            supabase.table("knowledge_chunks")
+            .select(_CHUNK_SELECT)
+            .order("id")
+            .range(start, start + _PAGE_SIZE - 1)
+            .execute()
+        )
+        page = res.data or []
+        rows.extend(_to_index_row(r) for r in page)
+        if len(page) < _PAGE_SIZE:
+            break
+        start += _PAGE_SIZE
+    return rows
+
+
+def rebuild_local_index(rows: Optional[List[Dict[str, Any]]] = None) -> int:
+    """Full reload of knowledge_chunks into the local vector index. Returns rows indexed."""
+    n = get_local_index().rebuild(_fetch_all_chunks() if rows is None else rows)
+    print(f"🗂️ Local index rebuilt with {n} chunks")
+    return n
+
+
+def rebuild_lexical_index(rows: Optional[List[Dict[str, Any]]] = None) -> int:
+    """Full reload of knowledge_chunks into the lexical index. Returns rows indexed."""
+    n = get_lexical_index().rebuild(_fetch_all_chunks() if rows is None else rows)
+    print(f"🔤 Lexical index rebuilt with {n} chunks")
+    return n
+
+
+def rebuild_indexes() -> None:
+    """Rebuild the vector index, plus the lexical index when it is enabled (one fetch)."""
+    rows = _fetch_all_chunks()
+    rebuild_local_index(rows)
+    if LEXICAL_INDEX_ENABLED:
+        rebuild_lexical_index(rows)
+
+
+if __name__ == "__main__":
+    rebuild_indexes()
@@ -0,0 +1,225 @@
+# services/rag/intent_router.py
+"""
+Local intent router for the first step of a turn (opt-in: INTENT_ROUTER=true).
+
+- Nearest-centroid classifier over query embeddings: one centroid per label
+  (sops | meeting_notes | clients | website | upload | none), seeded from SEED_EXAMPLES
+  (embedded once, lazily, through the shared embedding cache)
+- `route(text)` → {"label", "retrieve", "confidence", "scores", "vec"}; confidence is a softmax over
+  the cosine scores (INTENT_ROUTER_TEMPERATURE), "none" means no retrieval is needed
+- Labels the conversation cannot use are left out (upload without uploaded files,
+  website without a primary client)
+- When the router was not confident, the model's own first decision (the category of its
+  first rag_search_tool call, or no tool call) is folded into the centroids (INTENT_ROUTER_LEARN),
+  so the router adapts to this deployment's traffic; per worker, in memory
+- The tool loop (services/llm/gpt_tool_service.py) pre-runs retrieval for confident routes
+"""
+
+from __future__ import annotations
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from services.rag.embeddings import EMBED_MODEL, embed_texts
+from services.rag.vectors import unit
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER", "false").lower() in ("1", "true", "yes")
+# Pre-run retrieval only at or above this confidence (softmax probability of the best label)
+INTENT_ROUTER_MIN_CONFIDENCE = float(os.getenv("INTENT_ROUTER_MIN_CONFIDENCE", "0.7"))
+# Softmax temperature over cosine scores; lower = sharper (centroid cosines sit close together)
+INTENT_ROUTER_TEMPERATURE = float(os.getenv("INTENT_ROUTER_TEMPERATURE", "0.02"))
+INTENT_ROUTER_LEARN = os.getenv("INTENT_ROUTER_LEARN", "true").lower() in ("1", "true", "yes")
+
+NO_RETRIEVAL = "none"
+
+# A handful of typical questions per label; extend these rather than lowering the threshold
+SEED_EXAMPLES: Dict[str, List[str]] = {
+    "sops": [
+        "What is our process for onboarding a new client?",
+        "How do we set up a Google Ads campaign step by step?",
+        "What's the checklist before launching a landing page?",
+        "Which steps do we follow for the monthly reporting?",
+        "How should I QA an email sequence before it goes out?",
+        "What is the standard procedure for handing off an account?",
+    ],
+    "meeting_notes": [
+        "What did we agree on in the last meeting with the client?",
+        "What did we promise them on the kickoff call?",
+        "Summarize the action items from last week's call.",
+        "When did they say the launch date was in our call?",
+        "Who owns the follow ups from the strategy meeting?",
+        "Did the client approve the budget in the last meeting?",
+    ],
+    "clients": [
+        "Which products is this client paying for?",
+        "Who is the main contact for this client?",
+        "What services are in their current package?",
+        "What's the client's industry and target audience?",
+        "When did this client start working with us?",
+        "What is their monthly retainer?",
+    ],
+    "website": [
+        "What does the client's website say about their pricing?",
+        "Which pages are on their website?",
+        "What services do they list on their site?",
+        "What is the headline on their homepage?",
+        "Does their website have a contact form or booking page?",
+        "How do they describe their company on the about page?",
+    ],
+    "upload": [
+        "What does the file I uploaded say?",
+        "Summarize the attached PDF.",
+        "What are the key numbers in the spreadsheet I sent?",
+        "Based on the document I attached, what should we change?",
+        "Read the brief I uploaded and list the deliverables.",
+        "What's in the attachment?",
+    ],
+    NO_RETRIEVAL: [
+        "Hi!",
+        "Thanks, that's helpful.",
+        "Rewrite that paragraph to sound more friendly.",
+        "Make it shorter.",
+        "Translate your last answer into Spanish.",
+        "Can you turn that into bullet points?",
+    ],
+}
+# -----------------------------
+
+Embed = Callable[[List[str]], List[List[float]]]
+
+
+def _default_embed(texts: List[str]) -> List[List[float]]:
+    return embed_texts(texts, model=EMBED_MODEL)
+
+
+class IntentRouter:
+    """Nearest-centroid label for a user message (centroids = mean of unit example vectors)."""
+
+    def __init__(
+        self,
+        examples: Dict[str, List[str]] = SEED_EXAMPLES,
+        *,
+        temperature: float = INTENT_ROUTER_TEMPERATURE,
+        embed: Embed = _default_embed,
+    ) -> None:
+        self.examples = examples
+        self.temperature = temperature
+        self.embed = embed
+        self.labels = list(examples)
+        self._lock = threading.Lock()
+        self._sums: Optional[np.ndarray] = None  # (labels, dims) sums of unit vectors
+        self._counts: Optional[np.ndarray] = None
+        self.routed = 0
+        self.confident = 0
+        self.learned = 0
+
+    def _ensure_centroids(self) -> None:
+        # The seed embedding is a network call, so it runs outside the lock (route / learn /
+        # stats on other threads never wait on it); concurrent first calls may each embed, and
+        # the first to finish publishes its sums.
+        with self._lock:
+            if self._sums is not None:
+                return
+        texts = [t for label in self.labels for t in self.examples[label]]
+        vecs = unit(self.embed(texts))
+        sums = np.zeros((len(self.labels), vecs.shape[1]), dtype=np.float32)
+        counts = np.zeros(len(self.labels), dtype=np.float32)
+        row = 0
+        for i, label in enumerate(self.labels):
+            n = len(self.examples[label])
+            sums[i] = vecs[row:row + n].sum(axis=0)
+            counts[i] = n
+            row += n
+        with self._lock:
+            if self._sums is None:  # keep the first published sums (learn() may have added to them)
+                self._sums, self._counts = sums, counts
+
+    def route(
+        self,
+        text: str,
+        *,
+        vec: Optional[Sequence[float]] = None,
+        allowed: Optional[Sequence[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Best label for `text` (embedded here unless `vec` is given), among `allowed` labels.
+        Returns {"label", "retrieve", "confidence", "scores" (cosine per label), "vec"}.
+        """
+        self._ensure_centroids()
+        q = unit(vec if vec is not None else self.embed([text])[0])
+        with self._lock:
+            centroids = unit(self._sums / self._counts[:, None])
+        cos = centroids @ q
+        keep = [i for i, label in enumerate(self.labels) if allowed is None or label in allowed]
+        logits = cos[keep] / self.temperature
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        best = int(np.argmax(probs))
+        label = self.labels[keep[best]]
+        confidence = float(probs[best])
+        with self._lock:
+            self.routed += 1
+            self.confident += int(confidence >= INTENT_ROUTER_MIN_CONFIDENCE)
+        return {
+            "label": label,
+            "retrieve": label != NO_RETRIEVAL,
+            "confidence": confidence,
+            "scores": {self.labels[i]: round(float(cos[i]), 4) for i in keep},
+            "vec": q,
+        }
+
+    def allowed(self, tool_context: Dict[str, Any]) -> List[str]:
+        """Labels that make sense for this conversation."""
+        labels = list(self.labels)
+        if not tool_context.get("has_uploaded_docs") and "upload" in labels:
+            labels.remove("upload")
+        if not tool_context.get("primary_client_id") and "website" in labels:
+            labels.remove("website")
+        return labels
+
+    def learn(self, vec: Sequence[float], label: str) -> None:
+        """Fold one labelled query vector into its label's centroid."""
+        if label not in self.labels:
+            return
+        self._ensure_centroids()
+        i = self.labels.index(label)
+        with self._lock:
+            self._sums[i] += unit(vec)
+            self._counts[i] += 1
+            self.learned += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = self._counts
+            return {
+                "enabled": INTENT_ROUTER_ENABLED,
+                "routed": self.routed,
+                "confident": self.confident,
+                "learned": self.learned,
+                "examples": (
+                    {label: int(counts[i]) for i, label in enumerate(self.labels)}
+                    if counts is not None else None
+                ),
+            }
+
+
+_router: Optional[IntentRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_intent_router() -> IntentRouter:
+    """The worker's shared router (centroids are built on first use)."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = IntentRouter()
+        return _router
+
+
+def get_intent_router_stats() -> Dict[str, Any]:
+    return get_intent_router().stats()
@@ -0,0 +1,71 @@
+# services/rag/knowledge_version.py
+"""
+Knowledge version counter (sql/003_knowledge_version.sql).
+
+- Writers (Notion sync, website sync, uploads) call `bump_knowledge_version()` after they
+  change knowledge_chunks; the bump is atomic in Postgres, so every process sees it
+- Readers call `current_knowledge_version()`, which re-reads the row at most once every
+  RAG_KNOWLEDGE_VERSION_TTL_SECONDS (a cached search result can be that stale, no more)
+- A bump in this process is visible here immediately, without waiting for the TTL
+- Failures never raise: if the row can't be read we return None and callers skip caching
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Optional
+
+from supabase_client import supabase
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+VERSION_TTL_SECONDS = float(os.getenv("RAG_KNOWLEDGE_VERSION_TTL_SECONDS", "5"))
+# -----------------------------
+
+_lock = threading.Lock()
+_version: Optional[int] = None
+_checked_at = 0.0
+
+
+def current_knowledge_version() -> Optional[int]:
+    """Latest known version (None when the counter is unavailable)."""
+    global _version, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < VERSION_TTL_SECONDS:
+        return _version  # None after a failed read: don't retry before the TTL either
+    try:
+        res = (
+            supabase.table("rag_knowledge_version")
+            .select("version")
+            .eq("id", 1)
+            .limit(1)
+            .execute()
+        )
+        rows = res.data or []
+        version = int(rows[0]["version"]) if rows else 0
+    except Exception as e:
+        print(f"⚠️ Could not read knowledge version: {e}")
+        with _lock:
+            _version, _checked_at = None, now
+        return None
+    with _lock:
+        _version, _checked_at = version, now
+    return version
+
+
+def bump_knowledge_version(reason: str = "") -> Optional[int]:
+    """Invalidate cached retrieval results everywhere. Returns the new version (None on failure)."""
+    global _version, _checked_at
+    try:
+        res = supabase.rpc("bump_knowledge_version", {}).execute()
+        data = res.data
+        version = int(data[0] if isinstance(data, list) else data)
+    except Exception as e:
+        print(f"⚠️ Could not bump knowledge version ({reason or 'unspecified'}): {e}")
+        return None
+    with _lock:
+        _version, _checked_at = version, time.monotonic()
+    print(f"🔁 Knowledge version → {version}" + (f" ({reason})" if reason else ""))
+    return version
@@ -0,0 +1,271 @@
+# services/rag/lexical_index.py
+"""
+Lexical (BM25) index over knowledge_chunks.content, for hybrid retrieval in rag_search.
+
+- Exact names (clients, SKUs, SOP numbers) often rank poorly by cosine similarity alone;
+  a keyword match finds them, and rag_search fuses both rankings with reciprocal rank fusion
+- SQLite FTS5 in one local file (RAG_LEXICAL_INDEX_PATH), WAL mode so API workers read while
+  sync jobs write. The `chunks` table holds row metadata, `chunks_fts` indexes content + title
+- Fed by the same index_sync hooks as the local vector index (per document, incremental)
+- Each row also keeps its float32 embedding, so lexical-only hits get a real cosine similarity
+  (the RAG tool's similarity floor keeps working) without another Supabase round trip
+- Pre-filters follow the RPC semantics:
+    * category   → exact match when given
+    * client_id  → exact match when given
+    * conversation-scoped rows (uploads) are only visible when conversation_id matches
+"""
+
+from __future__ import annotations
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+RAG_LEXICAL_INDEX_PATH = os.getenv("RAG_LEXICAL_INDEX_PATH", ".cache/rag_lexical.sqlite3")
+# Title matches count more than body matches (bm25 column weights: content, doc_title)
+BM25_CONTENT_WEIGHT = float(os.getenv("RAG_BM25_CONTENT_WEIGHT", "1.0"))
+BM25_TITLE_WEIGHT = float(os.getenv("RAG_BM25_TITLE_WEIGHT", "2.0"))
+# Longest query we turn into an FTS expression (terms beyond this are ignored)
+MAX_QUERY_TERMS = int(os.getenv("RAG_LEXICAL_MAX_TERMS", "16"))
+# Single words found in more than this fraction of chunks add almost nothing to BM25 (low idf)
+# but make FTS score most of the corpus; they are dropped unless every term is that common
+MAX_TERM_DOC_RATIO = float(os.getenv("RAG_LEXICAL_MAX_DOC_RATIO", "0.1"))
+# -----------------------------
+
+ROW_FIELDS = (
+    "chunk_id", "document_id", "chunk_index", "doc_title", "source_url",
+    "category", "client_id", "conversation_id", "content", "tokens",
+)
+
+# Too common to help ranking; dropping them keeps the OR-expression (and its posting lists) small
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "i", "in", "is", "it", "me", "my", "of", "on", "or", "our", "the", "this", "to", "was",
+    "we", "what", "when", "where", "which", "who", "why", "with", "you", "your",
+}
+# Identifiers like "SKU-1042" or "SOP 3.2.1" pieces stay together and are searched as a phrase
+_TERM_RE = re.compile(r"\w+(?:[-./:#]\w+)*", re.UNICODE)
+_PART_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def query_terms(text: str) -> List[str]:
+    """Searchable terms of free text (identifiers come back as space-joined phrases)."""
+    terms: List[str] = []
+    for term in _TERM_RE.findall((text or "").lower()):
+        phrase = " ".join(_PART_RE.findall(term))
+        if term in _STOPWORDS or phrase in terms:
+            continue
+        terms.append(phrase)
+        if len(terms) >= MAX_QUERY_TERMS:
+            break
+    return terms
+
+
+def fts_query(terms: Iterable[str]) -> str:
+    """FTS5 OR-expression of quoted terms ('' when nothing is searchable)."""
+    return " OR ".join(f'"{t}"' for t in terms)
+
+
+def _encode(vec: Any) -> Optional[bytes]:
+    if vec is None or len(vec) == 0:
+        return None
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+class LexicalIndex:
+    """SQLite FTS5 index of chunk text with RPC-style filters."""
+
+    def __init__(self, path: str = RAG_LEXICAL_INDEX_PATH) -> None:
+        self.path = path
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                rowid           INTEGER PRIMARY KEY,
+                chunk_id        TEXT UNIQUE NOT NULL,
+                document_id     TEXT NOT NULL,
+                chunk_index     INTEGER,
+                doc_title       TEXT,
+                source_url      TEXT,
+                category        TEXT,
+                client_id       TEXT,
+                conversation_id TEXT,
+                content         TEXT,
+                tokens          INTEGER,
+                embedding       BLOB
+            );
+            CREATE INDEX IF NOT EXISTS chunks_document_id ON chunks (document_id);
+
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                content, doc_title,
+                content='chunks', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+
+            -- Keep the FTS index in step with `chunks` (external-content table)
+            CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, content, doc_title)
+                VALUES (new.rowid, new.content, new.doc_title);
+            END;
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_vocab USING fts5vocab(chunks_fts, 'row');
+
+            CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content, doc_title)
+                VALUES ('delete', old.rowid, old.content, old.doc_title);
+            END;
+            """
+        )
+        self._conn.commit()
+        self._count = 0
+        self._data_version: Optional[int] = None
+        self._refresh_count_locked(force=True)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh_count_locked()
+            return self._count
+
+    def _refresh_count_locked(self, force: bool = False) -> None:
+        """
+        Re-count rows when the file changed since the last count. PRAGMA data_version moves
+        when another connection (a sync job, another worker) commits; our own writes recount.
+        """
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if force or version != self._data_version:
+            self._count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            self._data_version = version
+
+    def _selective_terms_locked(self, terms: List[str]) -> List[str]:
+        """Drop very common single words (phrases are always kept)."""
+        self._refresh_count_locked()
+        words = [t for t in terms if " " not in t]
+        if not words or self._count == 0:
+            return terms
+        placeholders = ",".join("?" for _ in words)
+        doc_freq = dict(self._conn.execute(
+            f"SELECT term, doc FROM chunks_vocab WHERE term IN ({placeholders})", words,
+        ).fetchall())
+        limit = max(1, int(self._count * MAX_TERM_DOC_RATIO))
+        kept = [t for t in terms if " " in t or doc_freq.get(t, 0) <= limit]
+        if kept:
+            return kept
+        # Everything is common: keep the rarest word so the query still ranks something
+        return [min(words, key=lambda t: doc_freq.get(t, 0))]
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+    def search(
+        self,
+        query: str,
+        *,
+        top_k: int,
+        category: Optional[str] = None,
+        client_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Top-k rows (RPC row shape + `bm25`, higher is better), best first."""
+        terms = query_terms(query)
+        if not terms or top_k <= 0:
+            return []
+        sql = (
+            f"SELECT {', '.join('c.' + f for f in ROW_FIELDS)}, "
+            "-bm25(chunks_fts, ?, ?) AS score "
+            "FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ? "
+            "AND (? IS NULL OR c.category = ?) "
+            "AND (? IS NULL OR c.client_id = ?) "
+            "AND (c.conversation_id IS NULL OR c.conversation_id = ?) "
+            "ORDER BY score DESC LIMIT ?"
+        )
+        expr = ""
+        try:
+            with self._lock:
+                expr = fts_query(self._selective_terms_locked(terms))
+                params = (
+                    BM25_CONTENT_WEIGHT, BM25_TITLE_WEIGHT, expr,
+                    category, category, client_id, client_id, conversation_id, top_k,
+                )
+                rows = self._conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Lexical search failed for {expr!r}: {e}")
+            return []
+        out: List[Dict[str, Any]] = []
+        for r in rows:
+            row = dict(zip(ROW_FIELDS, r[:-1]))
+            row["bm25"] = float(r[-1])
+            out.append(row)
+        return out
+
+    def vectors(self, chunk_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Stored float32 embeddings for these chunks (missing ids are skipped)."""
+        ids = list(dict.fromkeys(chunk_ids))
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                placeholders = ",".join("?" for _ in batch)
+                for chunk_id, blob in self._conn.execute(
+                    f"SELECT chunk_id, embedding FROM chunks "
+                    f"WHERE chunk_id IN ({placeholders}) AND embedding IS NOT NULL",
+                    batch,
+                ):
+                    found[chunk_id] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    # -----------------------------
+    # Writes (sync jobs, uploads)
+    # -----------------------------
+    def apply(self, *, upserts: List[Dict[str, Any]], delete_document_ids: Iterable[str] = ()) -> None:
+        """Replace all rows of `delete_document_ids` (and of every document in `upserts`)."""
+        doomed_docs = list(set(delete_document_ids) | {r["document_id"] for r in upserts})
+        if not doomed_docs:
+            return
+        with self._lock:
+            for i in range(0, len(doomed_docs), 500):
+                batch = doomed_docs[i:i + 500]
+                placeholders = ",".join("?" for _ in batch)
+                self._conn.execute(f"DELETE FROM chunks WHERE document_id IN ({placeholders})", batch)
+            self._insert_locked(upserts)
+            self._conn.commit()
+            self._refresh_count_locked(force=True)
+
+    def rebuild(self, rows: List[Dict[str, Any]]) -> int:
+        """Replace the whole index with `rows`. Returns rows indexed."""
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._insert_locked(rows)
+            self._conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('optimize')")
+            self._conn.commit()
+            self._refresh_count_locked(force=True)
+        return len(rows)
+
+    def _insert_locked(self, rows: List[Dict[str, Any]]) -> None:
+        self._conn.executemany(
+            f"INSERT OR IGNORE INTO chunks ({', '.join(ROW_FIELDS)}, embedding) "
+            f"VALUES ({', '.join('?' for _ in ROW_FIELDS)}, ?)",
+            [tuple(r.get(f) for f in ROW_FIELDS) + (_encode(r.get("embedding")),) for r in rows],
+        )
+
+
+_index: Optional[LexicalIndex] = None
+
+
+def get_lexical_index() -> LexicalIndex:
+    """Process-wide index handle (opened lazily)."""
+    global _index
+    if _index is None:
+        _index = LexicalIndex(RAG_LEXICAL_INDEX_PATH)
+    return _index
@@ -0,0 +1,494 @@
+# services/rag/local_index.py
+"""
+In-process vector index over knowledge_chunks (alternative to the match_knowledge_chunks RPC).
+
+Layout on disk (RAG_INDEX_DIR):
+  manifest.json              → live segments + tombstoned documents (replaced atomically)
+  seg-000001/vectors.npy     → float32 [n, 1536], L2-normalized, memory-mapped on load
+  seg-000001/rows.json       → per-row metadata (chunk/document ids, title, filters, content)
+  seg-000001/coarse_*.npy    → int8/float16 copy of the vectors for the first-pass scan
+  seg-000001/short_*.npy     → Matryoshka prefix vectors (RAG_MATRYOSHKA_DIMS), same encoding
+  seg-000001/hnsw_*.npy      → optional HNSW graph (only for large compacted segments)
+
+- Segments are immutable and numbered. Syncs/uploads append a small segment and tombstone
+  the documents they rewrote: a row is dead when its document was tombstoned at a later
+  sequence number than its segment. `compact()` merges everything into one segment and
+  builds the HNSW graph once the corpus is large enough.
+- Readers re-check manifest.json before every search and pick up new segments lazily,
+  so API workers see sync results without a restart.
+- Searches scan the compact int8/float16 copy (RAG_INDEX_QUANTIZATION) and re-score only the
+  top `k * RAG_INDEX_RERANK_FACTOR` candidates against the float32 vectors. The float32 file
+  stays memory-mapped, so only the re-scored rows are ever paged in.
+- With RAG_MATRYOSHKA_DIMS set (e.g. 256), the first pass scans the re-normalized prefix
+  vectors instead (~6x fewer bytes) and re-scores `k * RAG_MATRYOSHKA_RERANK_FACTOR`
+  candidates with the full vectors. Segments written without prefix vectors keep using
+  the full-width coarse copy, so the knob can be flipped without a rebuild.
+- Rows inside a segment are stored sorted by partition = (conversation_id, client_id, category),
+  so every partition is one contiguous row range. Pre-filters follow the RPC semantics:
+    * category   → exact match when given
+    * client_id  → exact match when given
+    * conversation-scoped rows (uploads) are only visible when conversation_id matches
+  A scoped query (website → one client, upload → one conversation) only scans its own
+  partitions; a global query fans out over all visible partitions and merges their top-k.
+  The HNSW graph is only used when the visible partitions cover most of a large segment.
+"""
+
+from __future__ import annotations
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from services.rag.hnsw import HnswGraph
+from services.rag.quantization import QuantizedVectors, quantize
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", ".cache/rag_index")
+# Segments with at least this many rows get an HNSW graph at compaction; below it, brute force
+HNSW_MIN_ROWS = int(os.getenv("RAG_INDEX_HNSW_MIN_ROWS", "20000"))
+HNSW_M = int(os.getenv("RAG_INDEX_HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_INDEX_HNSW_EF_CONSTRUCTION", "100"))
+HNSW_EF_SEARCH = int(os.getenv("RAG_INDEX_HNSW_EF_SEARCH", "96"))
+# When a filter keeps fewer than this fraction of a segment, scan the survivors directly
+HNSW_FILTER_BRUTE_FORCE_RATIO = float(os.getenv("RAG_INDEX_FILTER_BRUTE_RATIO", "0.05"))
+# First-pass encoding (none | float16 | int8) and how many candidates get exact re-scoring
+RAG_INDEX_QUANTIZATION = os.getenv("RAG_INDEX_QUANTIZATION", "int8").strip().lower()
+RERANK_FACTOR = int(os.getenv("RAG_INDEX_RERANK_FACTOR", "4"))
+# Matryoshka prefix length for the first pass (0 = off; same knob as the sync pipelines).
+# Prefix vectors lose more ranking detail than quantization alone → wider shortlist
+MATRYOSHKA_DIMS = int(os.getenv("RAG_MATRYOSHKA_DIMS", "0"))
+MATRYOSHKA_RERANK_FACTOR = int(os.getenv("RAG_MATRYOSHKA_RERANK_FACTOR", "8"))
+# Compact once there are this many segments or this many rewritten/deleted documents
+MAX_SEGMENTS = int(os.getenv("RAG_INDEX_MAX_SEGMENTS", "8"))
+MAX_DELETED_DOCS = int(os.getenv("RAG_INDEX_MAX_DELETED_DOCS", "500"))
+# -----------------------------
+
+MANIFEST = "manifest.json"
+LOCK_FILE = ".writer.lock"
+ROW_FIELDS = (
+    "chunk_id", "document_id", "chunk_index", "doc_title", "source_url",
+    "category", "client_id", "conversation_id", "content", "tokens",
+)
+_CODED_FIELDS = ("document_id",)
+
+PartitionKey = Tuple[str, str, str]  # (conversation_id, client_id, category); "" = none
+
+
+def _partition_key(row: Dict[str, Any]) -> PartitionKey:
+    return (row.get("conversation_id") or "", row.get("client_id") or "", row.get("category") or "")
+
+
+def _normalize(mat: np.ndarray) -> np.ndarray:
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def _has_embedding(row: Dict[str, Any]) -> bool:
+    emb = row.get("embedding")
+    return emb is not None and len(emb) > 0
+
+
+class _Segment:
+    """One immutable, memory-mapped slice of the index."""
+
+    def __init__(self, path: str, seq: int) -> None:
+        self.path = path
+        self.name = os.path.basename(path)
+        self.seq = seq
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(path, "rows.json"), encoding="utf-8") as f:
+            self.rows: List[Dict[str, Any]] = json.load(f)
+        self.coarse = QuantizedVectors.load(path)
+        self.short = QuantizedVectors.load(path, prefix="short")
+        self.graph = HnswGraph.load(path)
+
+        # Partition directory: conversation → (client, category) → contiguous row ranges.
+        # Built from runs of equal keys, so segments written before rows were sorted still work.
+        self.partitions: Dict[str, Dict[Tuple[str, str], List[Tuple[int, int]]]] = {}
+        run_start = 0
+        for i in range(1, len(self.rows) + 1):
+            if i < len(self.rows) and _partition_key(self.rows[i]) == _partition_key(self.rows[run_start]):
+                continue
+            conv, client, category = _partition_key(self.rows[run_start])
+            self.partitions.setdefault(conv, {}).setdefault((client, category), []).append((run_start, i))
+            run_start = i
+
+        # Integer-coded document ids → vectorized tombstone masks
+        self.codes: Dict[str, Tuple[np.ndarray, Dict[str, int]]] = {}
+        for field in _CODED_FIELDS:
+            mapping: Dict[str, int] = {"": 0}
+            col = np.fromiter(
+                (mapping.setdefault(r.get(field) or "", len(mapping)) for r in self.rows),
+                dtype=np.int32,
+                count=len(self.rows),
+            )
+            self.codes[field] = (col, mapping)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def ranges(
+        self,
+        category: Optional[str],
+        client_id: Optional[str],
+        conversation_id: Optional[str],
+    ) -> List[Tuple[int, int]]:
+        """Row ranges of the partitions visible to a query with these RPC-equivalent filters."""
+        out: List[Tuple[int, int]] = []
+        for conv in dict.fromkeys(("", conversation_id or "")):
+            by_scope = self.partitions.get(conv)
+            if not by_scope:
+                continue
+            if category and client_id:
+                out.extend(by_scope.get((client_id, category), ()))
+                continue
+            for (client, cat), rngs in by_scope.items():
+                if (not client_id or client == client_id) and (not category or cat == category):
+                    out.extend(rngs)
+        # Neighbouring partitions are scanned as one span (a global query is then a few big scans)
+        merged: List[Tuple[int, int]] = []
+        for start, stop in sorted(out):
+            if merged and merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], stop)
+            else:
+                merged.append((start, stop))
+        return merged
+
+
+class LocalVectorIndex:
+    """Segmented, memory-mapped vector index with brute-force and HNSW search."""
+
+    def __init__(
+        self,
+        root: str = RAG_INDEX_DIR,
+        *,
+        quantization: str = RAG_INDEX_QUANTIZATION,
+        matryoshka_dims: int = MATRYOSHKA_DIMS,
+    ) -> None:
+        self.root = root
+        self.quantization = quantization
+        self.matryoshka_dims = matryoshka_dims
+        self._lock = threading.Lock()
+        self._manifest_mtime: Optional[int] = None
+        self._segments: Dict[str, _Segment] = {}
+        self._live: List[_Segment] = []
+        self._alive: Dict[str, Optional[np.ndarray]] = {}
+        self._live_rows = 0
+
+    # -----------------------------
+    # Loading
+    # -----------------------------
+    def _manifest_path(self) -> str:
+        return os.path.join(self.root, MANIFEST)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": [], "deleted_docs": {}, "next_seq": 1}
+
+    def _load_segment(self, entry: Dict[str, Any]) -> _Segment:
+        seg = self._segments.get(entry["name"])
+        if seg is None:
+            seg = _Segment(os.path.join(self.root, entry["name"]), entry["seq"])
+        return seg
+
+    def refresh(self) -> None:
+        """Reload the manifest if a writer replaced it since we last looked."""
+        try:
+            mtime = os.stat(self._manifest_path()).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._manifest_mtime:
+            return
+        with self._lock:
+            manifest = self._read_manifest()
+            deleted_docs: Dict[str, int] = manifest.get("deleted_docs", {})
+            live = [self._load_segment(e) for e in manifest.get("segments", [])]
+            alive_masks: Dict[str, Optional[np.ndarray]] = {}
+            live_rows = 0
+            for seg in live:
+                doc_col, doc_map = seg.codes["document_id"]
+                dead_codes = [
+                    code for doc_id, code in doc_map.items()
+                    if deleted_docs.get(doc_id, 0) > seg.seq
+                ]
+                if dead_codes:
+                    alive = ~np.isin(doc_col, dead_codes)
+                    alive_masks[seg.name] = alive
+                    live_rows += int(alive.sum())
+                else:
+                    alive_masks[seg.name] = None
+                    live_rows += len(seg)
+            self._segments = {s.name: s for s in live}
+            self._live = live
+            self._alive = alive_masks
+            self._live_rows = live_rows
+            self._manifest_mtime = mtime
+
+    def __len__(self) -> int:
+        self.refresh()
+        return self._live_rows
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+    def search(
+        self,
+        query_vec: List[float],
+        *,
+        top_k: int,
+        category: Optional[str] = None,
+        client_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        with_vectors: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Top-k rows (RPC row shape + similarity, + "embedding" if with_vectors), best first."""
+        self.refresh()
+        q = _normalize(np.asarray(query_vec, dtype=np.float32))
+        q_short = _normalize(q[: self.matryoshka_dims]) if self.matryoshka_dims else None
+        hits: List[Tuple[float, _Segment, int]] = []
+        for seg in self._live:
+            ranges = seg.ranges(category, client_id, conversation_id)
+            alive = self._alive.get(seg.name)
+            for sim, pos in self._search_segment(seg, q, top_k, ranges, alive, q_short):
+                hits.append((sim, seg, pos))
+
+        hits.sort(key=lambda h: h[0], reverse=True)
+        out: List[Dict[str, Any]] = []
+        for sim, seg, pos in hits[:top_k]:
+            row = dict(seg.rows[pos])
+            row["similarity"] = sim
+            if with_vectors:
+                row["embedding"] = np.asarray(seg.vectors[pos], dtype=np.float32)
+            out.append(row)
+        return out
+
+    def _search_segment(
+        self,
+        seg: _Segment,
+        q: np.ndarray,
+        k: int,
+        ranges: List[Tuple[int, int]],
+        alive: Optional[np.ndarray],
+        q_short: Optional[np.ndarray] = None,
+    ) -> List[Tuple[float, int]]:
+        n = len(seg)
+        visible = sum(stop - start for start, stop in ranges)
+        if n == 0 or visible == 0:
+            return []
+
+        # With a compact copy we over-fetch candidates, then re-score them exactly
+        coarse, q_coarse, factor = seg.coarse, q, RERANK_FACTOR
+        if q_short is not None and seg.short is not None and seg.short.dims == q_short.shape[0]:
+            coarse, q_coarse, factor = seg.short, q_short, MATRYOSHKA_RERANK_FACTOR
+        kk = k * factor if coarse is not None else k
+
+        use_graph = seg.graph is not None and visible >= n * HNSW_FILTER_BRUTE_FORCE_RATIO
+        if use_graph:
+            mask: Optional[np.ndarray] = None
+            if visible < n:
+                mask = np.zeros(n, dtype=bool)
+                for start, stop in ranges:
+                    mask[start:stop] = True
+            if alive is not None:
+                mask = alive if mask is None else (mask & alive)
+            found = seg.graph.search(
+                coarse if coarse is not None else seg.vectors, q_coarse, kk,
+                ef=max(HNSW_EF_SEARCH, kk), allowed=mask,
+            )
+            if coarse is None:
+                return found
+            positions = np.array([pos for _, pos in found], dtype=np.int64)
+        else:
+            # Fan out: brute force each visible partition (contiguous reads), keep its top-kk
+            cand_pos: List[np.ndarray] = []
+            cand_sim: List[np.ndarray] = []
+            for start, stop in ranges:
+                if coarse is not None:
+                    sims = coarse.dot_range(q_coarse, start, stop)
+                else:
+                    sims = np.asarray(seg.vectors[start:stop] @ q)
+                if alive is not None:
+                    sims = np.where(alive[start:stop], sims, -np.inf)
+                top = np.argpartition(-sims, kk - 1)[:kk] if sims.shape[0] > kk else np.arange(sims.shape[0])
+                cand_pos.append(top + start)
+                cand_sim.append(sims[top])
+            pos_all = np.concatenate(cand_pos)
+            sim_all = np.concatenate(cand_sim)
+            live = np.isfinite(sim_all)
+            pos_all, sim_all = pos_all[live], sim_all[live]
+            if pos_all.size == 0:
+                return []
+            # Merge the partitions' candidates into one top-kk
+            top = np.argsort(-sim_all)[:kk]
+            if coarse is None:
+                return [(float(sim_all[t]), int(pos_all[t])) for t in top]
+            positions = pos_all[top]
+
+        if positions.size == 0:
+            return []
+        # Exact float32 re-scoring of the shortlist (sorted reads are mmap friendly)
+        positions = np.sort(positions)
+        exact = np.asarray(seg.vectors[positions] @ q)
+        order = np.argsort(-exact)[:k]
+        return [(float(exact[o]), int(positions[o])) for o in order]
+
+    # -----------------------------
+    # Writes (sync jobs, uploads)
+    # -----------------------------
+    @contextmanager
+    def _writer(self) -> Iterator[Dict[str, Any]]:
+        """Cross-process writer lock; yields the current manifest to mutate."""
+        os.makedirs(self.root, exist_ok=True)
+        lock_path = os.path.join(self.root, LOCK_FILE)
+        deadline = time.time() + 120
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                # Break locks left behind by crashed writers
+                try:
+                    if time.time() - os.stat(lock_path).st_mtime > 600:
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError(f"Timed out waiting for index writer lock {lock_path}")
+                time.sleep(0.1)
+        try:
+            yield self._read_manifest()
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp = os.path.join(self.root, f".{MANIFEST}.{uuid.uuid4().hex}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self._manifest_path())
+
+    def _write_segment(self, seq: int, rows: List[Dict[str, Any]], vectors: np.ndarray) -> Dict[str, Any]:
+        name = f"seg-{seq:06d}"
+        path = os.path.join(self.root, name)
+        shutil.rmtree(path, ignore_errors=True)  # leftovers of a crashed writer
+        os.makedirs(path)
+        # Sort by partition so each (conversation, client, category) is one contiguous range
+        order = sorted(range(len(rows)), key=lambda i: _partition_key(rows[i]))
+        rows = [rows[i] for i in order]
+        vectors = np.ascontiguousarray(vectors[order])
+        np.save(os.path.join(path, "vectors.npy"), vectors)
+        with open(os.path.join(path, "rows.json"), "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False)
+        if self.quantization != "none":
+            quantize(vectors, self.quantization).save(path)
+        if 0 < self.matryoshka_dims < vectors.shape[1]:
+            quantize(_normalize(vectors[:, : self.matryoshka_dims]), self.quantization).save(path, prefix="short")
+        if len(rows) >= HNSW_MIN_ROWS:
+            HnswGraph.build(vectors, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION).save(path)
+        return {"name": name, "seq": seq, "count": len(rows)}
+
+    @staticmethod
+    def _split_rows(rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        meta = [{f: r.get(f) for f in ROW_FIELDS} for r in rows]
+        vectors = _normalize(np.array([r["embedding"] for r in rows], dtype=np.float32))
+        return meta, vectors
+
+    def apply(
+        self,
+        *,
+        upserts: List[Dict[str, Any]],
+        delete_document_ids: Iterable[str] = (),
+        allow_compaction: bool = True,
+    ) -> None:
+        """
+        Replace all rows of `delete_document_ids` (and of every document in `upserts`)
+        with `upserts`. Each upsert row needs ROW_FIELDS plus "embedding".
+        Request paths pass allow_compaction=False so they never pay for an HNSW build.
+        """
+        upserts = [r for r in upserts if _has_embedding(r)]
+        doomed_docs = set(delete_document_ids) | {r["document_id"] for r in upserts}
+        if not doomed_docs:
+            return
+        with self._writer() as manifest:
+            seq = manifest.get("next_seq", 1)
+            deleted_docs = dict(manifest.get("deleted_docs", {}))
+            for doc_id in doomed_docs:
+                deleted_docs[doc_id] = seq
+            segments = list(manifest.get("segments", []))
+            if upserts:
+                meta, vectors = self._split_rows(upserts)
+                segments.append(self._write_segment(seq, meta, vectors))
+            manifest = {"segments": segments, "deleted_docs": deleted_docs, "next_seq": seq + 1}
+            over = len(segments) > MAX_SEGMENTS or len(deleted_docs) > MAX_DELETED_DOCS
+            if allow_compaction and over:
+                self._compact_locked(manifest)
+            else:
+                self._write_manifest(manifest)
+
+    def _compact_locked(self, manifest: Dict[str, Any]) -> None:
+        """Merge all live rows into one segment (building the HNSW graph if large enough)."""
+        deleted_docs: Dict[str, int] = manifest.get("deleted_docs", {})
+        rows: List[Dict[str, Any]] = []
+        parts: List[np.ndarray] = []
+        for entry in manifest.get("segments", []):
+            seg = self._load_segment(entry)
+            keep = [
+                i for i, r in enumerate(seg.rows)
+                if deleted_docs.get(r["document_id"], 0) <= seg.seq
+            ]
+            rows.extend(seg.rows[i] for i in keep)
+            if keep:
+                parts.append(np.asarray(seg.vectors[keep]))
+
+        seq = manifest.get("next_seq", 1)
+        segments = [self._write_segment(seq, rows, np.concatenate(parts))] if rows else []
+        self._write_manifest({"segments": segments, "deleted_docs": {}, "next_seq": seq + 1})
+        self._drop_segments(manifest.get("segments", []))
+
+    def _drop_segments(self, entries: List[Dict[str, Any]]) -> None:
+        # Readers may still have these mapped; removal failures (e.g. on Windows) are harmless
+        for entry in entries:
+            self._segments.pop(entry["name"], None)
+            shutil.rmtree(os.path.join(self.root, entry["name"]), ignore_errors=True)
+
+    def compact(self) -> None:
+        with self._writer() as manifest:
+            self._compact_locked(manifest)
+
+    def rebuild(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """Replace the whole index with `rows` (full reload from Supabase)."""
+        rows = [r for r in rows if _has_embedding(r)]
+        with self._writer() as manifest:
+            seq = manifest.get("next_seq", 1)
+            segments = []
+            if rows:
+                meta, vectors = self._split_rows(rows)
+                segments.append(self._write_segment(seq, meta, vectors))
+            self._write_manifest({"segments": segments, "deleted_docs": {}, "next_seq": seq + 1})
+            self._drop_segments(manifest.get("segments", []))
+        return len(rows)
+
+
+_index: Optional[LocalVectorIndex] = None
+
+
+def get_local_index() -> LocalVectorIndex:
+    """Process-wide index handle (lazy)."""
+    global _index
+    if _index is None:
+        _index = LocalVectorIndex(RAG_INDEX_DIR)
+    return _index
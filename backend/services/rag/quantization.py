@@ -0,0 +1,112 @@
+# services/rag/quantization.py
+"""
+Compact vector encodings for the local index's first-pass scan.
+
+- "float16": half precision, 2 bytes/dim
+- "int8":    symmetric per-row scaling, 1 byte/dim + one float32 scale per row
+- "none":    plain float32 (no coarse copy is written)
+
+The index scans the compact copy and then re-scores only the best candidates
+against the full-precision float32 vectors, so recall stays close to exact.
+"""
+
+from __future__ import annotations
+import os
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+_SCAN_BLOCK_ROWS = 2048  # bounds the temporary float32 copy made while scanning
+
+
+def quantize(vectors: np.ndarray, mode: str) -> "QuantizedVectors":
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == "float16":
+        return QuantizedVectors(vectors.astype(np.float16))
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return QuantizedVectors(codes, scales.astype(np.float32))
+    if mode == "none":
+        return QuantizedVectors(vectors)
+    raise ValueError(f"Unknown quantization mode '{mode}' (expected one of {QUANTIZATION_MODES})")
+
+
+class QuantizedVectors:
+    """A matrix of encoded rows that can score against a float32 query."""
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray] = None) -> None:
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def mode(self) -> str:
+        if self.codes.dtype == np.int8:
+            return "int8"
+        if self.codes.dtype == np.float16:
+            return "float16"
+        return "none"
+
+    @property
+    def dims(self) -> int:
+        return int(self.codes.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def __len__(self) -> int:
+        return int(self.codes.shape[0])
+
+    def __getitem__(self, idx: Union[Sequence[int], np.ndarray]) -> np.ndarray:
+        """Dequantized float32 rows (lets HNSW walk the compact copy directly)."""
+        rows = np.asarray(self.codes[idx], dtype=np.float32)
+        if self.scales is not None:
+            rows *= np.asarray(self.scales[idx], dtype=np.float32)[..., None]
+        return rows
+
+    def dot(self, q: np.ndarray, idx: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate similarities for all rows (or `idx`), scanned in blocks."""
+        if idx is None:
+            return self.dot_range(q, 0, len(self))
+        q = np.asarray(q, dtype=np.float32)
+        n = len(idx)
+        out = np.empty(n, dtype=np.float32)
+        for start in range(0, n, _SCAN_BLOCK_ROWS):
+            sel = idx[start:start + _SCAN_BLOCK_ROWS]
+            block = np.asarray(self.codes[sel], dtype=np.float32) @ q
+            if self.scales is not None:
+                block *= self.scales[sel]  # per-row scale applies after the dot product
+            out[start:start + _SCAN_BLOCK_ROWS] = block
+        return out
+
+    def dot_range(self, q: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """Approximate similarities for the contiguous rows [start, stop) (one partition)."""
+        q = np.asarray(q, dtype=np.float32)
+        out = np.empty(max(0, stop - start), dtype=np.float32)
+        for lo in range(start, stop, _SCAN_BLOCK_ROWS):
+            hi = min(lo + _SCAN_BLOCK_ROWS, stop)
+            block = np.asarray(self.codes[lo:hi], dtype=np.float32) @ q
+            if self.scales is not None:
+                block *= self.scales[lo:hi]  # per-row scale applies after the dot product
+            out[lo - start:hi - start] = block
+        return out
+
+    # -----------------------------
+    # Persistence (next to vectors.npy in a segment directory)
+    # -----------------------------
+    def save(self, path: str, prefix: str = "coarse") -> None:
+        np.save(os.path.join(path, f"{prefix}_codes.npy"), self.codes)
+        if self.scales is not None:
+            np.save(os.path.join(path, f"{prefix}_scales.npy"), self.scales)
+
+    @classmethod
+    def load(cls, path: str, prefix: str = "coarse") -> Optional["QuantizedVectors"]:
+        codes_path = os.path.join(path, f"{prefix}_codes.npy")
+        if not os.path.exists(codes_path):
+            return None
+        scales_path = os.path.join(path, f"{prefix}_scales.npy")
+        scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+        return cls(np.load(codes_path, mmap_mode="r"), scales)
@@ -0,0 +1,90 @@
+# services/rag/result_cache.py
+"""
+In-process cache of rag_search results.
+
+- Keyed on (normalized query, category, client_id, conversation_id, top_k) plus the few
+  RagQuery fields that also change the result (min_similarity, backend, hybrid, two_tier)
+- Every entry is tagged with the knowledge version it was computed under; a lookup only hits
+  when the tag matches the current version, so a sync/upload bump invalidates everything
+- Size-bounded LRU (RAG_RESULT_CACHE_MAX_ENTRIES) with a TTL backstop
+- Counts hits/misses and the latency each hit saved (the original search time minus lookup)
+"""
+
+from __future__ import annotations
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Case/whitespace-insensitive form of a query ("What  did we promise X?" == "what did we promise x?")."""
+    return _WS_RE.sub(" ", (text or "").strip().lower())
+
+
+class ResultCache:
+    """Thread-safe LRU of search results tagged with a knowledge version."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0          # found, but computed under an older knowledge version / expired
+        self.evictions = 0
+        self.saved_ms = 0.0
+        self._lock = threading.Lock()
+        # key → (version, stored_at, search_ms, value)
+        self._entries: "OrderedDict[Hashable, Tuple[int, float, float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        start = time.perf_counter()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, stored_at, search_ms, value = entry
+                if entry_version == version and time.monotonic() - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    lookup_ms = (time.perf_counter() - start) * 1000
+                    self.saved_ms += max(0.0, search_ms - lookup_ms)
+                    return value
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+        return None
+
+    def put(self, key: Hashable, version: int, value: Any, search_ms: float) -> None:
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), search_ms, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    # -----------------------------
+    # Observability
+    # -----------------------------
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "saved_ms_total": round(self.saved_ms, 1),
+            "saved_ms_per_hit": round(self.saved_ms / self.hits, 1) if self.hits else 0.0,
+        }
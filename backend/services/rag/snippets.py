@@ -1,37 +1,321 @@
 # services/rag_snippets.py
-from typing import List, Dict, Any, Tuple
+import os
+import re
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from services.rag.chunking import OVERLAP
+from services.rag.embeddings import count_embedding_tokens
 
 MAX_SNIPPET_CHARS = 1400  # still useful as a single place to cap snippet length
 
-def _trim(s: str) -> str:
+# Optional diversification (maximal marginal relevance) before the final cap
+SNIPPET_MMR_ENABLED = os.getenv("RAG_SNIPPET_MMR", "false").lower() in ("1", "true", "yes")
+# 1.0 = pure relevance (plain top-N), lower = penalize text similar to what's already picked
+SNIPPET_MMR_LAMBDA = float(os.getenv("RAG_SNIPPET_MMR_LAMBDA", "0.7"))
+# Max snippets from one document (0 = no cap); applies with or without MMR
+SNIPPET_MAX_PER_DOCUMENT = int(os.getenv("RAG_SNIPPET_MAX_PER_DOCUMENT", "0"))
+
+# Token-budget packing (0 = off → char cap + first final_count rows)
+SNIPPET_TOKEN_BUDGET = int(os.getenv("RAG_SNIPPET_TOKEN_BUDGET", "0"))
+# Per-snippet ceiling in budget mode (~MAX_SNIPPET_CHARS worth of tokens)
+SNIPPET_MAX_TOKENS = int(os.getenv("RAG_SNIPPET_MAX_TOKENS", "350"))
+# Don't bother trimming a snippet down into less room than this
+SNIPPET_MIN_TOKENS = int(os.getenv("RAG_SNIPPET_MIN_TOKENS", "40"))
+
+# Merge consecutive chunks of one document into a single passage (overlap removed)
+SNIPPET_MERGE_ADJACENT = os.getenv("RAG_SNIPPET_MERGE_ADJACENT", "true").lower() in ("1", "true", "yes")
+
+_HASH_DIMS = 4096  # hashed bag-of-words width for rows that come without an embedding
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+_MIN_OVERLAP_CHARS = 16  # shorter suffix/prefix matches are coincidence, not chunk overlap
+
+def _trim(s: str, limit: int = MAX_SNIPPET_CHARS) -> str:
+    s = (s or "").strip()
+    return s if len(s) <= limit else s[:limit] + "…"
+
+def _trim_to_tokens(s: str, max_tokens: int) -> Tuple[str, int]:
+    """
+    Longest prefix of whole sentences that fits `max_tokens` (+ its token count).
+    Sentences are tokenized once each and their counts accumulated (not every prefix again);
+    the chosen prefix is counted once more, and backed off a sentence if the estimate was short.
+    A first sentence that alone is too long is cut at a word boundary instead.
+    """
     s = (s or "").strip()
-    return s if len(s) <= MAX_SNIPPET_CHARS else s[:MAX_SNIPPET_CHARS] + "…"
+    total = count_embedding_tokens(s)
+    if total <= max_tokens:
+        return s, total
+    ellipsis = count_embedding_tokens("…")
+    ends: List[int] = []  # sentence ends whose prefix fits by the running count
+    start = running = 0
+    for m in list(_SENTENCE_END_RE.finditer(s)) + [None]:
+        end = m.start() if m else len(s)
+        running += count_embedding_tokens(s[start:end])
+        if running + ellipsis > max_tokens:
+            # the sum of parts can overshoot the whole: count this prefix exactly before giving up
+            exact = count_embedding_tokens(s[:end].rstrip() + "…")
+            if exact > max_tokens:
+                break
+            running = exact - ellipsis
+        ends.append(end)
+        start = end
+    out, used = "", 0
+    while ends:
+        candidate = s[:ends.pop()].rstrip()
+        n = count_embedding_tokens(candidate + "…")
+        if n <= max_tokens:
+            out, used = candidate, n
+            break
+    if not out:
+        words = s.split()
+        lo, hi = 0, len(words)
+        while lo < hi:  # binary search the longest word prefix that fits
+            mid = (lo + hi + 1) // 2
+            if count_embedding_tokens(" ".join(words[:mid]) + "…") <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        out = " ".join(words[:lo])
+        used = count_embedding_tokens(out + "…") if out else 0
+    return (out + "…" if out else ""), used
+
+def _join_overlapping(a: str, b: str) -> Tuple[str, int]:
+    """
+    a + b with the chunker's overlap removed: the longest suffix of `a` that is a prefix of `b`
+    (chunks are stripped, so it is not exactly OVERLAP chars). Returns (text, chars removed).
+    """
+    for n in range(min(len(a), len(b), OVERLAP + 2), _MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:n]):
+            return a + b[n:], n
+    return a + "\n" + b, 0  # no overlap (e.g. cdc chunks): keep a paragraph break
+
+def _merge_adjacent(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Collapse runs of consecutive chunk_index of the same document into one passage.
+    A passage keeps its best-scoring chunk's fields and similarity plus every chunk id
+    (`chunk_ids`, in text order) and the overlap chars dropped, and sits at that best
+    chunk's rank.
+    """
+    by_doc: Dict[Any, List[Tuple[int, Dict[str, Any]]]] = {}
+    for rank, r in enumerate(rows):
+        by_doc.setdefault(r.get("document_id"), []).append((rank, r))
+
+    passages: List[Tuple[int, Dict[str, Any]]] = []
+    for members in by_doc.values():
+        members.sort(key=lambda m: int(m[1].get("chunk_index") or 0))
+        runs = [[members[0]]]
+        for m in members[1:]:
+            if int(m[1].get("chunk_index") or 0) == int(runs[-1][-1][1].get("chunk_index") or 0) + 1:
+                runs[-1].append(m)
+            else:
+                runs.append([m])
+        for run in runs:
+            best_rank, best = min(run, key=lambda m: m[0])
+            if len(run) == 1:
+                passages.append((best_rank, best))
+                continue
+            content = (run[0][1].get("content") or "").strip()
+            removed = 0
+            for _, r in run[1:]:
+                content, n = _join_overlapping(content, (r.get("content") or "").strip())
+                removed += n
+            passage = dict(best)
+            passage.update({
+                "chunk_ids": [r.get("chunk_id") for _, r in run],
+                "content": content,
+                "tokens": None,  # stored counts are per chunk
+                "overlap_removed": removed,
+                # char mode: the chunks' separate allowance, minus the overlap they'd have shared
+                "max_chars": sum(
+                    min(len((r.get("content") or "").strip()), MAX_SNIPPET_CHARS) for _, r in run
+                ) - removed,
+            })
+            passages.append((best_rank, passage))
+
+    passages.sort(key=lambda p: p[0])
+    return [p for _, p in passages]
+
+def _line(p: Dict[str, Any]) -> str:
+    ids = p.get("chunk_ids")
+    return (
+        "{chunk_id:\"%s\", %scategory:\"%s\", client_id:%s, title:\"%s\", "
+        "similarity:%.4f, url:%s, content:\"%s\"}" % (
+            p.get("chunk_id", ""),
+            ("chunk_ids:[%s], " % ", ".join(f"\"{i}\"" for i in ids)) if ids else "",
+            p.get("category", "") or "",
+            ("null" if not p.get("client_id") else f"\"{p['client_id']}\""),
+            (p.get("title") or "").replace('"', "'"),
+            float(p.get("similarity", 0.0)),
+            ("null" if not p.get("url") else f"\"{p['url']}\""),
+            (p.get("content") or "").replace('"', "'"),
+        )
+    )
 
 def _pack(packed: List[Dict[str, Any]]) -> str:
     lines = ["[RAG_SNIPPETS_BEGIN]"]
-    for p in packed:
-        lines.append(
-            "{chunk_id:\"%s\", category:\"%s\", client_id:%s, title:\"%s\", "
-            "similarity:%.4f, url:%s, content:\"%s\"}" % (
-                p.get("chunk_id", ""),
-                p.get("category", "") or "",
-                ("null" if not p.get("client_id") else f"\"{p['client_id']}\""),
-                (p.get("title") or "").replace('"', "'"),
-                float(p.get("similarity", 0.0)),
-                ("null" if not p.get("url") else f"\"{p['url']}\""),
-                (p.get("content") or "").replace('"', "'"),
-            )
-        )
+    lines.extend(_line(p) for p in packed)
     lines.append("[RAG_SNIPPETS_END]")
     return "\n".join(lines)
 
+def _snippet(r: Dict[str, Any], content: str) -> Dict[str, Any]:
+    return {
+        "chunk_id": r.get("chunk_id") or "",
+        "chunk_ids": r.get("chunk_ids"),
+        "category": r.get("category") or "",
+        "client_id": r.get("client_id"),
+        "title": r.get("document_title") or r.get("doc_title") or "",
+        "similarity": float(r.get("similarity", 0.0)),
+        "url": r.get("source_url"),
+        "content": content,
+    }
+
+def _candidate_vectors(rows: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Unit vectors for redundancy scoring: the chunk embedding when the row carries one
+    (RagQuery.include_embeddings), else a hashed bag-of-words of its content — overlapping
+    neighbour chunks share most of their words, so this still catches near-duplicates.
+    """
+    embs = [r.get("embedding") for r in rows]
+    if all(e is not None and len(e) > 0 for e in embs):
+        mat = np.asarray(embs, dtype=np.float32)
+    else:
+        mat = np.zeros((len(rows), _HASH_DIMS), dtype=np.float32)
+        for i, r in enumerate(rows):
+            for w in _WORD_RE.findall((r.get("content") or "").lower()):
+                mat[i, zlib.crc32(w.encode("utf-8")) % _HASH_DIMS] += 1.0
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+def _select(
+    rows: List[Dict[str, Any]],
+    count: int,
+    *,
+    mmr_lambda: Optional[float],
+    max_per_document: int,
+) -> List[Dict[str, Any]]:
+    """Pick up to `count` rows: greedy MMR when mmr_lambda is set, else in rank order; per-doc cap."""
+    if count <= 0 or not rows:
+        return []
+    per_doc: Dict[Any, int] = {}
+
+    def _fits(r: Dict[str, Any]) -> bool:
+        return not max_per_document or per_doc.get(r.get("document_id"), 0) < max_per_document
+
+    if mmr_lambda is None:
+        picked = []
+        for r in rows:
+            if len(picked) >= count:
+                break
+            if _fits(r):
+                picked.append(r)
+                per_doc[r.get("document_id")] = per_doc.get(r.get("document_id"), 0) + 1
+        return picked
+
+    relevance = np.array([float(r.get("similarity", 0.0)) for r in rows], dtype=np.float32)
+    vecs = _candidate_vectors(rows)
+    redundancy = np.zeros(len(rows), dtype=np.float32)  # max similarity to anything picked so far
+    available = np.ones(len(rows), dtype=bool)
+    picked_idx: List[int] = []
+    while len(picked_idx) < count and available.any():
+        scores = mmr_lambda * relevance - (1.0 - mmr_lambda) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        available[best] = False
+        if not _fits(rows[best]):
+            continue
+        picked_idx.append(best)
+        doc = rows[best].get("document_id")
+        per_doc[doc] = per_doc.get(doc, 0) + 1
+        redundancy = np.maximum(redundancy, vecs @ vecs[best])
+    return [rows[i] for i in picked_idx]
+
+def _content_tokens(r: Dict[str, Any], content: str) -> int:
+    """Tokens of a row's snippet text: the stored per-chunk count when the text is the chunk's own."""
+    stored = r.get("tokens")
+    if stored is not None and content == (r.get("content") or "").strip():
+        return int(stored)
+    return count_embedding_tokens(content)
+
+def _tokens(rows: List[Dict[str, Any]]) -> int:
+    return sum(_content_tokens(r, _trim(r.get("content", ""))) for r in rows)
+
+def _fill_budget(
+    rows: List[Dict[str, Any]],
+    budget: int,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]:
+    """
+    Greedy knapsack over `rows` (similarity = value, tokens = weight): the best match goes in
+    first, then the rest by similarity-per-token while they fit. Each snippet is held to
+    SNIPPET_MAX_TOKENS per chunk it spans, and the last one in may be cut at a sentence
+    boundary to use the room left. Weights include the snippet's line overhead (ids, title, url), since we pay for those too.
+    Returns (chosen rows, packed snippets in rank order with their content `tokens`, tokens used).
+    """
+    if not rows or budget <= 0:
+        return [], [], 0
+    items = []
+    for rank, r in enumerate(rows):
+        content = (r.get("content") or "").strip()
+        stored = r.get("tokens")
+        if stored is not None and int(stored) <= SNIPPET_MAX_TOKENS:
+            n = int(stored)             # per-chunk count from sync, no re-tokenizing
+        else:
+            content, n = _trim_to_tokens(content, SNIPPET_MAX_TOKENS * len(r.get("chunk_ids") or [r]))
+        overhead = count_embedding_tokens(_line(_snippet(r, ""))) + 1  # + newline
+        items.append({"rank": rank, "row": r, "content": content, "tokens": n, "overhead": overhead})
+
+    order = sorted(
+        items[1:],
+        key=lambda it: float(it["row"].get("similarity", 0.0)) / max(1, it["tokens"] + it["overhead"]),
+        reverse=True,
+    )
+    taken = []
+    used = 0
+    for it in [items[0]] + order:
+        room = budget - used - it["overhead"]
+        if room < SNIPPET_MIN_TOKENS:
+            continue
+        if it["tokens"] > room:
+            it["content"], it["tokens"] = _trim_to_tokens(it["content"], room)
+            if not it["content"]:
+                continue
+        used += it["tokens"] + it["overhead"]
+        taken.append(it)
+
+    taken.sort(key=lambda it: it["rank"])  # keep the model-facing block in relevance order
+    return (
+        [it["row"] for it in taken],
+        [{**_snippet(it["row"], it["content"]), "tokens": it["tokens"]} for it in taken],
+        used,
+    )
+
 def pack_snippets_with_meta(
     results: List[Dict[str, Any]],
     *,
     min_similarity: float,
-    final_count: int
-) -> Tuple[str, Dict[str, int]]:
-    """Filter by floor, dedup by (document_id, chunk_index), trim, cap, then pack."""
+    final_count: int,
+    mmr: Optional[bool] = None,
+    mmr_lambda: float = SNIPPET_MMR_LAMBDA,
+    max_per_document: int = SNIPPET_MAX_PER_DOCUMENT,
+    token_budget: Optional[int] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Filter by floor, dedup by (document_id, chunk_index), optionally diversify (MMR and/or
+    per-document cap), trim, cap, then pack. `mmr=None` → RAG_SNIPPET_MMR.
+    With a token budget (`token_budget=None` → RAG_SNIPPET_TOKEN_BUDGET, 0 = off) the budget
+    replaces the final_count cap: the block is filled by similarity-per-token from all kept
+    candidates, or from the diversified picks when diversifying.
+    Consecutive chunks of one document are merged into a single passage without the chunker's
+    overlap (RAG_SNIPPET_MERGE_ADJACENT): after the final_count cut in char mode, before the
+    budget fill in budget mode.
+    Meta reports included tokens and best similarity next to the plain top-N baseline,
+    so the effect of diversification shows up in the audit trail.
+    """
+    budget = SNIPPET_TOKEN_BUDGET if token_budget is None else token_budget
+    use_mmr = SNIPPET_MMR_ENABLED if mmr is None else mmr
     input_count = len(results)
     seen = set()
     after_floor = [r for r in results if float(r.get("similarity", 0.0)) >= min_similarity]
@@ -46,24 +330,57 @@ def pack_snippets_with_meta(
         dedup_list.append(r)
     dedup_kept = len(dedup_list)
 
-    included = []
-    for r in dedup_list[:final_count]:
-        included.append({
-            "chunk_id": r.get("chunk_id") or "",
-            "category": r.get("category") or "",
-            "client_id": r.get("client_id"),
-            "title": r.get("document_title") or r.get("doc_title") or "",
-            "similarity": float(r.get("similarity", 0.0)),
-            "url": r.get("source_url"),
-            "content": _trim(r.get("content", "")),
-        })
+    baseline = dedup_list[:final_count]
+    diversify = use_mmr or max_per_document > 0
+    chosen = (
+        _select(
+            dedup_list,
+            final_count,
+            mmr_lambda=mmr_lambda if use_mmr else None,
+            max_per_document=max_per_document,
+        )
+        if diversify else baseline
+    )
+
+    if budget > 0:
+        pool = chosen if diversify else dedup_list
+        if SNIPPET_MERGE_ADJACENT:
+            pool = _merge_adjacent(pool)
+        chosen, included, budget_used = _fill_budget(pool, budget)
+    else:
+        if SNIPPET_MERGE_ADJACENT:
+            chosen = _merge_adjacent(chosen)
+        included = []
+        for r in chosen:
+            content = _trim(r.get("content", ""), r.get("max_chars") or MAX_SNIPPET_CHARS)
+            included.append({**_snippet(r, content), "tokens": _content_tokens(r, content)})
+    included_tokens = sum(p["tokens"] for p in included)
 
     block = _pack(included)
+    # Budget mode already counted every line (content + overhead, each on its own, so a few tokens
+    # high at most); only the markers are new
+    block_tokens = (
+        budget_used + count_embedding_tokens("[RAG_SNIPPETS_BEGIN]\n[RAG_SNIPPETS_END]")
+        if budget > 0 else count_embedding_tokens(block)
+    )
     meta = {
         "input_count": input_count,
         "kept_after_floor": kept_after_floor,
         "dedup_kept": dedup_kept,
         "included_count": len(included),
+        "included_chunks": sum(len(p.get("chunk_ids") or [p]) for p in included),
+        "included_chunk_ids": [c for p in included for c in (p.get("chunk_ids") or [p["chunk_id"]])],
+        "merged_passages": sum(1 for p in included if p.get("chunk_ids")),
+        "overlap_chars_removed": sum(r.get("overlap_removed", 0) for r in chosen),
         "floor_used": int(round(min_similarity * 100)),
+        "diversified": "mmr" if use_mmr else ("doc_cap" if diversify else "none"),
+        "included_tokens": included_tokens,
+        "baseline_tokens": _tokens(baseline),
+        "included_documents": len({r.get("document_id") for r in chosen}),
+        "best_similarity_included": max((p["similarity"] for p in included), default=0.0),
+        "best_similarity_baseline": max((float(r.get("similarity", 0.0)) for r in baseline), default=0.0),
+        "token_budget": budget if budget > 0 else None,
+        "budget_used": budget_used if budget > 0 else None,   # snippet lines incl. ids/titles
+        "block_tokens": block_tokens,
     }
     return block, meta
@@ -0,0 +1,163 @@
+# services/rag/speculative.py
+"""
+Speculative retrieval for the first model call of a turn (opt-in: RAG_SPECULATIVE=true).
+
+- While the first chat completion is in flight, the tool loop starts the search the RAG tool
+  would run for the latest user message (default category/mode/top_k) on the tool pool
+- When the model then asks rag_search_tool for a search with the same filters (category,
+  client scope, mode, top_k) and a query within RAG_SPECULATIVE_THRESHOLD cosine of the user's
+  message, the prefetched result is used instead of a new search
+- Per call, the tool audit gets speculative_hit / speculative_similarity / speculative_saved_ms
+  (search time that no longer sits between the model's tool call and its result)
+- Turn and call counters for /metrics via `get_speculative_stats()`
+- A hit may wait for a speculation that is still running; one still queued is cancelled
+  instead (it would wait on the same pool as the tool call)
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Executor, Future, TimeoutError as FuturesTimeout
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence
+
+from services.rag.vectors import unit
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+SPECULATIVE_ENABLED = os.getenv("RAG_SPECULATIVE", "false").lower() in ("1", "true", "yes")
+# Paraphrases of the user's message by the model usually land around 0.85-0.95
+SPECULATIVE_THRESHOLD = float(os.getenv("RAG_SPECULATIVE_THRESHOLD", "0.85"))
+# How long a matching call waits for a speculation that is still running
+SPECULATIVE_WAIT_SECONDS = float(os.getenv("RAG_SPECULATIVE_WAIT_SECONDS", "5"))
+# -----------------------------
+
+
+class _SpeculativeStats:
+    """How often speculation paid off (this worker)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.turns = 0          # speculations started
+        self.used = 0           # turns where at least one call was served from it
+        self.unused = 0         # turns that ended without a matching call
+        self.calls_hit = 0      # RAG calls answered from a speculation
+        self.calls_missed = 0   # RAG calls that had a speculation but did not match
+        self.saved_ms = 0.0
+
+    def add(self, **counts: float) -> None:
+        with self._lock:
+            for name, n in counts.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.calls_hit + self.calls_missed
+            return {
+                "enabled": SPECULATIVE_ENABLED,
+                "turns": self.turns,
+                "used": self.used,
+                "unused": self.unused,
+                "calls_hit": self.calls_hit,
+                "calls_missed": self.calls_missed,
+                "hit_rate": round(self.calls_hit / calls, 3) if calls else None,
+                "saved_ms_total": round(self.saved_ms, 1),
+                "saved_ms_per_hit": round(self.saved_ms / self.calls_hit, 1) if self.calls_hit else None,
+            }
+
+
+_stats = _SpeculativeStats()
+
+
+def get_speculative_stats() -> Dict[str, Any]:
+    return _stats.stats()
+
+
+class SpeculativeSearch:
+    """
+    One prefetched search for one turn. `work` returns {"vec", "rpc", "plan", "search_ms"}
+    (built by rag_search_tool.speculate); the tool loop starts it, RAG calls `match` it.
+    """
+
+    def __init__(
+        self,
+        query: str,
+        key: Hashable,
+        top_k: int,
+        work: Callable[[], Dict[str, Any]],
+        threshold: float = SPECULATIVE_THRESHOLD,
+    ) -> None:
+        self.query = query
+        self.key = key
+        self.top_k = top_k
+        self.threshold = threshold
+        self._work = work
+        self._future: Optional[Future] = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    def start(self, executor: Executor) -> "SpeculativeSearch":
+        self._future = executor.submit(self._work)
+        _stats.add(turns=1)
+        return self
+
+    def match(self, vec: Optional[Sequence[float]], key: Hashable, top_k: int) -> Optional[Dict[str, Any]]:
+        """
+        The prefetched result for a call with these filters and query vector, or None.
+        Returns {"hit": True, "rpc", "plan", "similarity", "wait_ms", "saved_ms"} on a hit and
+        {"hit": False, "similarity"} on a miss (similarity None when it never got compared).
+        """
+        if self._future is None:
+            return None
+        if key != self.key or top_k != self.top_k or vec is None:
+            return self._miss(None)
+
+        if self._future.cancel():  # only succeeds while it is still queued
+            print("🔮 Speculative search was still queued; cancelled")
+            return self._miss(None)
+        wait_start = time.perf_counter()
+        try:
+            done = self._future.result(timeout=SPECULATIVE_WAIT_SECONDS)
+        except (FuturesTimeout, CancelledError) as e:
+            print(f"🔮 Speculative search not ready ({type(e).__name__}); searching normally")
+            return self._miss(None)
+        except Exception as e:
+            print(f"⚠️ Speculative search failed ({e}); searching normally")
+            return self._miss(None)
+        wait_ms = (time.perf_counter() - wait_start) * 1000
+
+        sim = float(unit(vec) @ unit(done["vec"]))
+        if sim < self.threshold:
+            return self._miss(sim)
+
+        saved_ms = max(0.0, done["search_ms"] - wait_ms)
+        self.hits += 1
+        self.saved_ms += saved_ms
+        _stats.add(calls_hit=1, saved_ms=saved_ms)
+        return {
+            "hit": True,
+            "rpc": done["rpc"],
+            "plan": done["plan"],
+            "similarity": sim,
+            "wait_ms": wait_ms,
+            "saved_ms": saved_ms,
+        }
+
+    def finish(self) -> Dict[str, Any]:
+        """End of the turn: drop an unused speculation (cancel it if it never started) and log."""
+        if self._future is not None and not self.hits:
+            self._future.cancel()
+        _stats.add(used=1 if self.hits else 0, unused=0 if self.hits else 1)
+        summary = {"hits": self.hits, "misses": self.misses, "saved_ms": round(self.saved_ms, 1)}
+        print(
+            f"🔮 Speculative retrieval: {'used' if self.hits else 'unused'} | "
+            f"hits={self.hits} | misses={self.misses} | saved={summary['saved_ms']}ms | q={self.query!r}"
+        )
+        return summary
+
+    def _miss(self, similarity: Optional[float]) -> Dict[str, Any]:
+        self.misses += 1
+        _stats.add(calls_missed=1)
+        return {"hit": False, "similarity": similarity}
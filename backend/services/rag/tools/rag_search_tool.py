@@ -5,8 +5,19 @@ RAG search tool callable by the LLM.
 - Validates category (sops | meeting_notes | clients | website | GLOBAL fallback)
 - Injects primary client name for meeting_notes if not present
 - Scopes website queries to the current conversation's client
-- Supports "normal" vs "website_full" modes (for broader website pulls)
+- Supports "normal" vs "website_full" modes (for broader website pulls); website_full is
+  served from the client's precomputed website digest when one exists (vector search otherwise)
 - Calls your internal rag_search (no HTTP) and packs results with rag.snippets
+- `run_many` serves several calls from one model turn with a single rag_search_many
+  (one embedding request, concurrent searches)
+- With a turn memo in tool_context (services/rag/turn_memo.py), a near-duplicate of an earlier
+  query in the same turn gets an "already retrieved" reference, and chunks already sent this
+  turn are not sent again
+- `speculate` prepares the search for the user's own message so the tool loop can run it while
+  the first model call is in flight (services/rag/speculative.py); a later call with the same
+  filters and a close enough query is answered from it
+- Optional adaptive top_k: start small, widen only while too few candidates clear the floor,
+  stop at a sharp similarity drop-off
 - Returns a compact JSON payload + prints an audit line
 - If the user asks what happened/what we promised: prefer meeting_notes (when available). If none support the claim, say so briefly and base guidance on SOPs/playbooks.
 """
@@ -15,11 +26,20 @@ from __future__ import annotations
 import json
 import os
 import re
+import time
 from typing import Any, Dict, List, Optional, Tuple
 
 # Late imports to avoid circular FastAPI imports on module load
-from services.rag.core import RagQuery, rag_search
-from services.rag.snippets import pack_snippets_with_meta
+from services.rag.core import RAG_HYBRID_SEARCH, RagQuery, RagResult, rag_search, rag_search_many
+from services.rag.embeddings import EMBED_MODEL, embed_texts
+from services.rag.snippets import (
+    SNIPPET_MERGE_ADJACENT,
+    SNIPPET_MMR_ENABLED,
+    SNIPPET_TOKEN_BUDGET,
+    pack_snippets_with_meta,
+)
+from services.rag.speculative import SpeculativeSearch
+from services.rag.website_digest import WEBSITE_DIGEST_ENABLED, get_website_digest
 
 # -----------------------------
 # Config knobs (easy to tweak)
@@ -30,11 +50,25 @@ TOOL_NAME = "rag_search_tool"
 DEFAULT_TOP_K = int(os.getenv("RAG_TOOL_TOPK", "12"))
 DEFAULT_MIN_SIM = float(os.getenv("RAG_TOOL_MIN_SIM", "0.35"))  # 0..1
 DEFAULT_FINAL_SNIPPETS = int(os.getenv("RAG_TOOL_FINAL_SNIPPETS", "6"))  # 5–7 works well
+# With hybrid (BM25 + vector) retrieval on, exact-name hits no longer need a wide vector net
+HYBRID_TOP_K = int(os.getenv("RAG_TOOL_HYBRID_TOPK", "8"))
 
 # "Full website" mode: used when the model explicitly wants a broad view of the site
 WEBSITE_FULL_TOP_K = int(os.getenv("RAG_WEBSITE_FULL_TOPK", "48"))
 WEBSITE_FULL_FINAL_SNIPPETS = int(os.getenv("RAG_WEBSITE_FULL_FINAL_SNIPPETS", "18"))
 
+# Adaptive top_k: start at max(START_K, final snippets), double while too few candidates clear
+# the floor (up to the mode's top_k above); a similarity gap > DROP ends the search and cuts there
+ADAPTIVE_TOP_K = os.getenv("RAG_TOOL_ADAPTIVE_TOPK", "false").lower() in ("1", "true", "yes")
+ADAPTIVE_START_K = int(os.getenv("RAG_TOOL_ADAPTIVE_START_K", "4"))
+ADAPTIVE_DROP = float(os.getenv("RAG_TOOL_ADAPTIVE_DROP", "0.12"))
+
+# Token budgets for the snippets block (0 = off → char-capped top-N); see RAG_SNIPPET_TOKEN_BUDGET
+DEFAULT_TOKEN_BUDGET = SNIPPET_TOKEN_BUDGET
+WEBSITE_FULL_TOKEN_BUDGET = int(
+    os.getenv("RAG_WEBSITE_FULL_TOKEN_BUDGET", str(3 * SNIPPET_TOKEN_BUDGET))
+)
+
 # Allowed explicit categories; GLOBAL is handled via None
 ALLOWED_CATEGORIES = {"sops", "meeting_notes", "clients", "website", "upload"}
 
@@ -95,8 +129,8 @@ def get_tool_definition() -> Dict[str, Any]:
                         "description": (
                             "How broadly to search. "
                             "'normal' (default) = standard context window. "
-                            "'website_full' = for category 'website', retrieve many more chunks to "
-                            "understand most of the client's website content."
+                            "'website_full' = for category 'website', get an overview of the client's "
+                            "whole website (site outline + key facts per page)."
                         ),
                     },
                 },
@@ -124,13 +158,8 @@ def _inject_client_name_if_needed(
     return f"{primary_client_name} {query}".strip(), True
 
 
-def run(raw_args: str, *, tool_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    """
-    Execute the RAG tool. Returns a dict containing:
-      - "json": a JSON string that will be sent back to the LLM as the tool result
-      - "meta": a dict with counts/best_similarity/titles for server-side auditing
-      - "effective_args": the final args we executed (after defaults and client injection)
-    """
+def _prepare(raw_args: str, tool_context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Parse args, apply defaults/scoping/injection and build the RagQuery (no search yet)."""
     tool_context = tool_context or {}
     try:
         args = json.loads(raw_args) if isinstance(raw_args, str) else dict(raw_args or {})
@@ -140,7 +169,7 @@ def run(raw_args: str, *, tool_context: Optional[Dict[str, Any]] = None) -> Dict
     query = (args.get("query") or "").strip()
     category = (args.get("category") or "").strip().lower()
     mode = (args.get("mode") or "normal").strip().lower()
-    top_k = DEFAULT_TOP_K
+    top_k = HYBRID_TOP_K if RAG_HYBRID_SEARCH else DEFAULT_TOP_K
     min_sim = DEFAULT_MIN_SIM
 
     primary_client_name = tool_context.get("primary_client_name")
@@ -163,10 +192,12 @@ def run(raw_args: str, *, tool_context: Optional[Dict[str, Any]] = None) -> Dict
         # Broad website overview: more candidates, more final snippets
         top_k_effective = WEBSITE_FULL_TOP_K
         final_snippets = WEBSITE_FULL_FINAL_SNIPPETS
+        token_budget = WEBSITE_FULL_TOKEN_BUDGET
         mode_used = "website_full"
     else:
         top_k_effective = top_k
         final_snippets = DEFAULT_FINAL_SNIPPETS
+        token_budget = DEFAULT_TOKEN_BUDGET
         mode_used = "normal"
 
     # Client-name injection for meeting_notes
@@ -183,27 +214,344 @@ def run(raw_args: str, *, tool_context: Optional[Dict[str, Any]] = None) -> Dict
         f"augmented_with_client={injected}"
     )
 
-    # Call your internal rag_search() (no HTTP)
-    rpc = rag_search(
-        RagQuery(
+    return {
+        "rag_query": RagQuery(
             query=query_effective,
-            top_k=top_k_effective,
+            # adaptive: first round only; _search widens it if needed
+            top_k=(
+                min(top_k_effective, max(ADAPTIVE_START_K, final_snippets))
+                if ADAPTIVE_TOP_K else top_k_effective
+            ),
             category=effective_category,
             client_id=client_filter,  # <- only non-None for website category
             min_similarity=0.0,       # we apply the floor in our packer
             conversation_id=conversation_id,
+            include_embeddings=SNIPPET_MMR_ENABLED,  # MMR scores redundancy on chunk vectors
+        ),
+        "planned_category": planned_category,
+        "effective_category": effective_category,
+        "client_filter": client_filter,
+        "mode_used": mode_used,
+        "final_snippets": final_snippets,
+        # website_full: the precomputed site digest replaces the wide vector search; it is
+        # read lazily (_resolve_digest), once the turn memo could not answer the call
+        "digest_candidate": bool(mode_used == "website_full" and client_filter and WEBSITE_DIGEST_ENABLED),
+        "digest": None,
+        "memo": tool_context.get("turn_memo"),
+        "memo_hit": None,
+        "memo_call": None,
+        "speculative": tool_context.get("speculative"),
+        "spec": None,
+        "vec": None,
+        "max_top_k": top_k_effective,
+        "k_rounds": 0,
+        "k_stop": None,
+        "k_cut": 0,
+        "token_budget": token_budget,
+        "min_sim": min_sim,
+        "conversation_id": conversation_id,
+    }
+
+
+def _passage_count(rows: List[Any], floor: float) -> int:
+    """Snippets the packer can make from rows above the floor (dedup; adjacent chunks merge)."""
+    keys = {(r.document_id, r.chunk_index) for r in rows if float(r.similarity) >= floor}
+    if not SNIPPET_MERGE_ADJACENT:
+        return len(keys)
+    return sum(1 for doc, idx in keys if (doc, idx - 1) not in keys)
+
+
+def _adaptive_step(plan: Dict[str, Any], rpc: RagResult) -> Tuple[RagResult, Optional[int], str]:
+    """
+    Judge one adaptive round → (results to keep, next k or None when done, stop reason).
+    Stops on a sharp drop-off among the candidates above the floor (and cuts the tail there)
+    once the rows above the drop alone make enough snippets, so a lone top outlier does not
+    shrink the result; once the ones above the floor make enough snippets (neighbouring chunks
+    of a document merge into one); or when a wider k cannot help (index exhausted, the tail is
+    already under the floor, max k reached). Rows above the floor cut by a drop-off are counted
+    in plan["k_cut"].
+    """
+    k = plan["rag_query"].top_k
+    floor = plan["min_sim"]
+    sims = sorted((float(r.similarity) for r in rpc.results), reverse=True)
+    above = [x for x in sims if x >= floor]
+
+    for hi, lo in zip(above, above[1:]):
+        if hi - lo > ADAPTIVE_DROP:
+            kept = [r for r in rpc.results if float(r.similarity) >= hi]
+            if _passage_count(kept, floor) < plan["final_snippets"]:
+                continue  # too few above this drop to stand alone: look further down
+            plan["k_cut"] = sum(1 for r in rpc.results if floor <= float(r.similarity) < hi)
+            return RagResult(query=rpc.query, results=kept), None, "drop_off"
+    if _passage_count(rpc.results, floor) >= plan["final_snippets"]:
+        return rpc, None, "enough"
+    if len(sims) < k:
+        return rpc, None, "exhausted"
+    if sims and sims[-1] < floor:
+        return rpc, None, "below_floor"
+    if k >= plan["max_top_k"]:
+        return rpc, None, "max_k"
+    return rpc, min(plan["max_top_k"], 2 * k), ""
+
+
+def _search(plans: List[Dict[str, Any]]) -> List[RagResult]:
+    """Run the plans' searches (batched), widening top_k per plan in adaptive mode."""
+    have_vecs = all(plan["vec"] is not None for plan in plans)  # embedded already by the turn memo
+    if not ADAPTIVE_TOP_K:
+        if len(plans) == 1 and not have_vecs:
+            return [rag_search(plans[0]["rag_query"])]
+        return rag_search_many(
+            [plan["rag_query"] for plan in plans],
+            [plan["vec"] for plan in plans] if have_vecs else None,
         )
+
+    results: List[Optional[RagResult]] = [None] * len(plans)
+    pending = list(range(len(plans)))
+    while pending:
+        rpcs = rag_search_many(
+            [plans[i]["rag_query"] for i in pending],
+            [plans[i]["vec"] for i in pending] if have_vecs else None,
+        )
+        still = []
+        for i, rpc in zip(pending, rpcs):
+            plan = plans[i]
+            plan["k_rounds"] += 1
+            kept, next_k, reason = _adaptive_step(plan, rpc)
+            if next_k is None:
+                results[i] = kept
+                plan["k_stop"] = reason
+            else:
+                plan["rag_query"] = plan["rag_query"].model_copy(update={"top_k": next_k})
+                still.append(i)
+        pending = still
+    return results  # type: ignore[return-value]
+
+
+def _memo_key(plan: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Filters that must match for two queries of a turn to count as the same search."""
+    return (plan["effective_category"], plan["client_filter"], plan["mode_used"], plan["conversation_id"])
+
+
+def _embed_plans(plans: List[Dict[str, Any]]) -> None:
+    """Embed the queries of plans that have no vector yet (one request; digest calls need none)."""
+    to_embed = [plan for plan in plans if plan["vec"] is None and not plan["digest"]]
+    vecs = embed_texts([plan["rag_query"].query for plan in to_embed], model=EMBED_MODEL) if to_embed else []
+    for plan, vec in zip(to_embed, vecs):
+        plan["vec"] = vec
+
+
+def _resolve_digest(plan: Dict[str, Any]) -> None:
+    """Read the website digest of a website_full candidate (once; None → vector search)."""
+    if plan["digest_candidate"]:
+        plan["digest_candidate"] = False
+        plan["digest"] = get_website_digest(plan["client_filter"])
+
+
+def _apply_memo(plans: List[Dict[str, Any]]) -> None:
+    """
+    Embed the plans' queries (one request) and check them against the turn memo, in call order:
+    near-duplicates of a query served earlier, or of an earlier call of this batch, get
+    `memo_hit`. Digest calls carry no embedding; for them the same filters alone make a repeat,
+    so website_full candidates are checked first against earlier digest answers, and only the
+    ones left read their digest (those without one are embedded and matched like any search).
+    Nothing is remembered here: `_finish` / `_finish_digest` do that once a result exists, so a
+    batch that fails leaves no entries behind for its retries to match.
+    """
+    memo = plans[0]["memo"]
+    pending: List[Dict[str, Any]] = []  # this batch's new queries, with their plans
+    for plan in plans:
+        if not plan["digest_candidate"]:
+            continue
+        key = _memo_key(plan)
+        digests = [e for e in memo.entries + pending if e["vec"] is None]
+        plan["memo_hit"] = memo.match(None, key, entries=digests)
+        if plan["memo_hit"] is None:
+            _resolve_digest(plan)
+            if plan["digest"]:
+                pending.append(memo.entry(None, key, plan["rag_query"].query, plan=plan))
+    _embed_plans([plan for plan in plans if not plan["memo_hit"]])
+    for plan in plans:
+        if plan["memo_hit"] or plan["digest"]:
+            continue
+        key = _memo_key(plan)
+        plan["memo_hit"] = memo.match(plan["vec"], key) or memo.match(plan["vec"], key, entries=pending)
+        if plan["memo_hit"] is None:
+            pending.append(memo.entry(plan["vec"], key, plan["rag_query"].query, plan=plan))
+
+
+def _remember(plan: Dict[str, Any]) -> None:
+    """Record a served plan in the turn memo (its call number goes to later duplicates)."""
+    if plan["memo"] is not None:
+        plan["memo_call"] = plan["memo"].remember(plan["vec"], _memo_key(plan), plan["rag_query"].query)
+
+
+def _apply_speculative(plans: List[Dict[str, Any]]) -> None:
+    """
+    Check the plans that still need a search against the turn's speculative search; a hit
+    takes over its result (and the top_k / adaptive rounds that produced it).
+    """
+    spec: SpeculativeSearch = plans[0]["speculative"]
+    _embed_plans(plans)  # misses pass these on to the search
+    for plan in plans:
+        plan["spec"] = spec.match(plan["vec"], _memo_key(plan), plan["rag_query"].top_k)
+        if plan["spec"] and plan["spec"]["hit"]:
+            done = plan["spec"]["plan"]
+            plan["rag_query"] = plan["rag_query"].model_copy(update={"top_k": done["rag_query"].top_k})
+            plan["k_rounds"], plan["k_stop"], plan["k_cut"] = done["k_rounds"], done["k_stop"], done["k_cut"]
+
+
+def _speculative_meta(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Audit fields for a call made while a speculative search existed (none otherwise)."""
+    spec = plan["spec"]
+    if spec is None:
+        return {}
+    sim = spec["similarity"]
+    return {
+        "speculative_hit": spec["hit"],
+        "speculative_similarity": round(sim, 4) if sim is not None else None,
+        "speculative_wait_ms": round(spec["wait_ms"], 1) if spec["hit"] else None,
+        "speculative_saved_ms": round(spec["saved_ms"], 1) if spec["hit"] else 0.0,
+    }
+
+
+def _finish_memo(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Short payload for a near-duplicate of a search already answered in this turn."""
+    hit = plan["memo_hit"]
+    if hit.get("plan") is not None:  # duplicate of an earlier call of the same batch, served by now
+        hit = {**hit, "call": hit["plan"]["memo_call"]}
+    query_effective = plan["rag_query"].query
+    effective_category = plan["effective_category"]
+
+    print(
+        "🔎 RAG(tool): "
+        f"planned={plan['planned_category']} | effective={effective_category or 'GLOBAL'} | "
+        f"mode={plan['mode_used']} | q={query_effective!r} | memo_hit=search #{hit['call']} "
+        f"{hit['query']!r} (cos={hit.get('similarity', 1.0):.3f})"
+    )
+
+    result_to_model = {
+        "ok": True,
+        "category": effective_category or "GLOBAL",
+        "query": query_effective,
+        "mode": plan["mode_used"],
+        "already_retrieved": True,
+        "same_as_query": hit["query"],
+        "note": (
+            "This is nearly the same search as an earlier one in this turn; its results are "
+            "already above. Use those, or search for something different."
+        ),
+    }
+    return {
+        "json": json.dumps(result_to_model, ensure_ascii=False),
+        "meta": {
+            "planned_category": plan["planned_category"],
+            "effective_category": effective_category or "GLOBAL",
+            "mode": plan["mode_used"],
+            "client_scoped": bool(plan["client_filter"]),
+            "query": query_effective,
+            "source": "turn_memo",
+            "memo_hit": True,
+            "same_as_search": hit["call"],
+            "same_as_query": hit["query"],
+            "memo_similarity": hit.get("similarity"),
+            "top_k": 0,
+            "total": 0,
+            "included": 0,
+        },
+        "effective_args": {
+            "query": query_effective,
+            "category": effective_category or "GLOBAL",
+            "mode": plan["mode_used"],
+            "top_k": 0,
+            "min_similarity": plan["min_sim"],
+            "conversation_id": plan["conversation_id"],
+        },
+    }
+
+
+def _finish_digest(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Tool payload for a website_full call answered from the client's website digest."""
+    _remember(plan)
+    digest = plan["digest"]
+    query_effective = plan["rag_query"].query
+    block = f"[WEBSITE_DIGEST_BEGIN]\n{digest['digest']}\n[WEBSITE_DIGEST_END]"
+    titles = [p.get("title") or "" for p in (digest.get("pages") or [])[:5]]
+
+    print(
+        "🔎 RAG(tool): "
+        f"planned={plan['planned_category']} | effective=website | mode=website_full | "
+        f"client_filter={plan['client_filter']} | q={query_effective!r} | source=digest | "
+        f"pages={digest.get('page_count')} | tokens={digest.get('tokens')} | "
+        f"generated_at={digest.get('generated_at')}"
     )
 
+    result_to_model = {
+        "ok": True,
+        "category": "website",
+        "query": query_effective,
+        "mode": "website_full",
+        "client_scoped": True,
+        "source": "website_digest",
+        "snippets_block": block,
+        "pages": digest.get("page_count"),
+        "titles": titles,
+    }
+    return {
+        "json": json.dumps(result_to_model, ensure_ascii=False),
+        "meta": {
+            "planned_category": plan["planned_category"],
+            "effective_category": "website",
+            "mode": "website_full",
+            "client_scoped": True,
+            "query": query_effective,
+            "source": "website_digest",
+            "top_k": 0,
+            "total": 0,
+            "included": digest.get("page_count"),
+            "digest_tokens": digest.get("tokens"),
+            "block_tokens": digest.get("tokens"),
+            "titles": titles,
+        },
+        "effective_args": {
+            "query": query_effective,
+            "category": "website",
+            "mode": "website_full",
+            "top_k": 0,
+            "min_similarity": plan["min_sim"],
+            "conversation_id": plan["conversation_id"],
+        },
+    }
+
+
+def _finish(plan: Dict[str, Any], rpc: RagResult) -> Dict[str, Any]:
+    """Pack search results into the tool payload (+ audit line)."""
+    _remember(plan)
+    query_effective = plan["rag_query"].query
+    top_k_effective = plan["rag_query"].top_k
+    planned_category = plan["planned_category"]
+    effective_category = plan["effective_category"]
+    client_filter = plan["client_filter"]
+    mode_used = plan["mode_used"]
+    final_snippets = plan["final_snippets"]
+    token_budget = plan["token_budget"]
+    min_sim = plan["min_sim"]
+    conversation_id = plan["conversation_id"]
+
     # Normalize rows → dict
     rows = [r.dict() if hasattr(r, "dict") else r for r in rpc.results]
+    # Chunks the model already got earlier in this turn are not sent again
+    memo = plan["memo"]
+    unsent = memo.unsent(rows) if memo is not None else rows
 
-    # Apply floor, dedup, cap to final N, and pack block for the model
+    # Apply floor, dedup, cap to final N (or fill the token budget), and pack block for the model
     block, meta = pack_snippets_with_meta(
-        rows,
+        unsent,
         min_similarity=min_sim,
         final_count=final_snippets,
+        token_budget=token_budget,
     )
+    if memo is not None:
+        memo.mark_sent(meta["included_chunk_ids"])
 
     # Derive extra audit fields
     titles: List[str] = []
@@ -230,9 +578,40 @@ def run(raw_args: str, *, tool_context: Optional[Dict[str, Any]] = None) -> Dict
         f"planned={planned_category} | effective={effective_category or 'GLOBAL'} | "
         f"mode={mode_used} | client_filter={client_filter or 'ALL'} | "
         f"q={query_effective!r} | top_k={top_k_effective} | floor={int(min_sim * 100)}% | "
-        f"total={len(rows)} | kept={meta.get('kept_after_floor')} | "
+        f"total={len(rows)} | already_sent={len(rows) - len(unsent)} | kept={meta.get('kept_after_floor')} | "
+        f"included={meta.get('included_count')} ({meta.get('included_chunks')} chunks) | "
         f"best_sim={best_sim:.4f} | titles={', '.join(titles[:3]) or '-'}"
     )
+    if meta.get("diversified") != "none":
+        print(
+            f"🔎 RAG(tool): diversified={meta['diversified']} | "
+            f"tokens={meta['included_tokens']} (top-N {meta['baseline_tokens']}) | "
+            f"docs={meta['included_documents']} | "
+            f"best_sim_included={meta['best_similarity_included']:.4f} "
+            f"(top-N {meta['best_similarity_baseline']:.4f})"
+        )
+    if plan["k_stop"]:
+        print(
+            f"🔎 RAG(tool): adaptive k={top_k_effective}/{plan['max_top_k']} | "
+            f"rounds={plan['k_rounds']} | stop={plan['k_stop']}"
+            + (f" | cut_above_floor={plan['k_cut']}" if plan["k_cut"] else "")
+        )
+    if plan["spec"] is not None:
+        spec = _speculative_meta(plan)
+        print(
+            f"🔮 RAG(tool): speculative={'hit' if spec['speculative_hit'] else 'miss'} | "
+            f"cos={spec['speculative_similarity']}"
+            + (
+                f" | waited={spec['speculative_wait_ms']}ms | saved={spec['speculative_saved_ms']}ms"
+                if spec["speculative_hit"] else ""
+            )
+        )
+    if meta.get("token_budget"):
+        print(
+            f"🔎 RAG(tool): budget={meta['token_budget']} | used={meta['budget_used']} | "
+            f"block_tokens={meta['block_tokens']} | included={meta['included_count']} | "
+            f"content_tokens={meta['included_tokens']} (char-capped top-N {meta['baseline_tokens']})"
+        )
 
     # What the model gets back as the tool result
     result_to_model = {
@@ -256,13 +635,30 @@ def run(raw_args: str, *, tool_context: Optional[Dict[str, Any]] = None) -> Dict
             "mode": mode_used,
             "client_scoped": bool(client_filter),
             "query": query_effective,
-            "top_k": top_k_effective,
+            "top_k": top_k_effective,          # effective k (last round in adaptive mode)
+            "top_k_max": plan["max_top_k"],
+            "k_rounds": plan["k_rounds"],
+            "k_stop": plan["k_stop"],
+            "k_cut_above_floor": plan["k_cut"],   # rows above the floor dropped by a drop-off cut
             "floor": min_sim,
             "total": len(rows),
+            "already_sent": len(rows) - len(unsent),
             "kept": meta.get("kept_after_floor"),
             "included": meta.get("included_count"),
             "best_similarity": best_sim,
             "titles": titles[:5],
+            "diversified": meta.get("diversified"),
+            "included_tokens": meta.get("included_tokens"),
+            "baseline_tokens": meta.get("baseline_tokens"),
+            "included_documents": meta.get("included_documents"),
+            "best_similarity_included": meta.get("best_similarity_included"),
+            "token_budget": meta.get("token_budget"),
+            "budget_used": meta.get("budget_used"),
+            "block_tokens": meta.get("block_tokens"),
+            "included_chunks": meta.get("included_chunks"),
+            "merged_passages": meta.get("merged_passages"),
+            "overlap_chars_removed": meta.get("overlap_chars_removed"),
+            **_speculative_meta(plan),
         },
         "effective_args": {
             "query": query_effective,
@@ -273,3 +669,65 @@ def run(raw_args: str, *, tool_context: Optional[Dict[str, Any]] = None) -> Dict
             "conversation_id": conversation_id,
         },
     }
+
+
+def run(raw_args: str, *, tool_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Execute the RAG tool. Returns a dict containing:
+      - "json": a JSON string that will be sent back to the LLM as the tool result
+      - "meta": a dict with counts/best_similarity/titles for server-side auditing
+      - "effective_args": the final args we executed (after defaults and client injection)
+    """
+    # Call your internal rag_search() (no HTTP)
+    return _run_plans([_prepare(raw_args, tool_context)])[0]
+
+
+def run_many(
+    raw_args_list: List[str],
+    *,
+    tool_context: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Execute several RAG tool calls together (same payloads as `run`, in input order)."""
+    return _run_plans([_prepare(raw_args, tool_context) for raw_args in raw_args_list])
+
+
+def speculate(query: str, *, tool_context: Optional[Dict[str, Any]] = None) -> SpeculativeSearch:
+    """
+    The search this tool would run for `query` with default arguments, packaged for the tool
+    loop to start early (nothing runs until it is started). Never touches the turn memo, so it
+    can run on another thread than the turn's tool calls.
+    """
+    plan = _prepare(json.dumps({"query": query}), {**(tool_context or {}), "turn_memo": None, "speculative": None})
+
+    def work() -> Dict[str, Any]:
+        _embed_plans([plan])
+        start = time.perf_counter()
+        rpc = _search([plan])[0]
+        return {"vec": plan["vec"], "rpc": rpc, "plan": plan, "search_ms": (time.perf_counter() - start) * 1000}
+
+    return SpeculativeSearch(plan["rag_query"].query, _memo_key(plan), plan["rag_query"].top_k, work)
+
+
+def _run_plans(plans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Memo check, speculative result, then digest / search per plan; payloads in input order."""
+    if plans and plans[0]["memo"] is not None:
+        _apply_memo(plans)
+    for plan in plans:
+        if not plan["memo_hit"]:
+            _resolve_digest(plan)  # no-op for the plans _apply_memo resolved
+    searched = [plan for plan in plans if not plan["memo_hit"] and not plan["digest"]]
+    if searched and searched[0]["speculative"] is not None:
+        _apply_speculative(searched)
+        searched = [plan for plan in searched if not (plan["spec"] and plan["spec"]["hit"])]
+    results = iter(_search(searched) if searched else [])
+    out = []
+    for plan in plans:
+        if plan["memo_hit"]:
+            out.append(_finish_memo(plan))
+        elif plan["digest"]:
+            out.append(_finish_digest(plan))
+        elif plan["spec"] and plan["spec"]["hit"]:
+            out.append(_finish(plan, plan["spec"]["rpc"]))
+        else:
+            out.append(_finish(plan, next(results)))
+    return out
@@ -0,0 +1,104 @@
+# services/rag/turn_memo.py
+"""
+Per-turn memo of RAG tool queries (one instance per generate_gpt_reply_with_tools loop).
+
+- A query whose embedding is within RAG_TURN_MEMO_THRESHOLD cosine of an earlier query of the
+  same turn, with the same filters (category, client scope, mode), is answered with a short
+  "already retrieved" reference instead of a new search + snippet block
+- Chunk ids already sent to the model this turn are remembered, so a later (different)
+  query does not ship the same chunks again
+- Not shared across turns or threads: each tool job works on its own `fork`, which the tool
+  loop `merge`s back only when the job's result reaches the model in time
+"""
+
+from __future__ import annotations
+import os
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Set
+
+from services.rag.vectors import unit
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+TURN_MEMO_ENABLED = os.getenv("RAG_TURN_MEMO", "true").lower() in ("1", "true", "yes")
+TURN_MEMO_THRESHOLD = float(os.getenv("RAG_TURN_MEMO_THRESHOLD", "0.92"))
+# -----------------------------
+
+
+class TurnMemo:
+    """Queries answered and chunks sent so far in one model turn."""
+
+    def __init__(self, threshold: float = TURN_MEMO_THRESHOLD) -> None:
+        self.threshold = threshold
+        self.entries: List[Dict[str, Any]] = []   # {call, query, key, vec}
+        self.sent_chunk_ids: Set[str] = set()
+        self.hits = 0
+        self.chunks_skipped = 0
+        self._forked_at = 0   # entries copied from the parent memo (fork)
+
+    def match(
+        self,
+        vec: Optional[Sequence[float]],
+        key: Hashable,
+        entries: Optional[List[Dict[str, Any]]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Earlier entry with the same filters and a near-identical query (None if none).
+        `entries` (made by `entry`) replaces the served queries, e.g. for the pending calls of a batch.
+        """
+        pool = self.entries if entries is None else entries
+        candidates = [e for e in pool if e["key"] == key]
+        if not candidates:
+            return None
+        if vec is None:  # no embedding (e.g. digest calls): same filters is the whole identity
+            return candidates[0]
+        q = unit(vec)
+        best, best_sim = None, -1.0
+        for e in candidates:
+            if e["vec"] is None:
+                continue
+            sim = float(q @ e["vec"])
+            if sim > best_sim:
+                best, best_sim = e, sim
+        if best is None or best_sim < self.threshold:
+            return None
+        self.hits += 1
+        return {**best, "similarity": best_sim}
+
+    def entry(self, vec: Optional[Sequence[float]], key: Hashable, query: str, **extra: Any) -> Dict[str, Any]:
+        """A matchable entry that is not remembered (yet)."""
+        return {"call": None, "query": query, "key": key, "vec": unit(vec) if vec is not None else None, **extra}
+
+    def remember(self, vec: Optional[Sequence[float]], key: Hashable, query: str) -> int:
+        """
+        Record a query whose results reached the model; returns its call number within the turn.
+        Only called once the search succeeded, so a failed or timed-out search can be retried.
+        """
+        call = len(self.entries) + 1
+        self.entries.append({**self.entry(vec, key, query), "call": call})
+        return call
+
+    def unsent(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Rows whose chunk was not sent to the model yet this turn."""
+        fresh = [r for r in rows if r.get("chunk_id") not in self.sent_chunk_ids]
+        self.chunks_skipped += len(rows) - len(fresh)
+        return fresh
+
+    def mark_sent(self, chunk_ids: Sequence[str]) -> None:
+        self.sent_chunk_ids.update(c for c in chunk_ids if c)
+
+    def fork(self) -> "TurnMemo":
+        """A copy for one tool job to read and write; the turn's memo is untouched until `merge`."""
+        view = TurnMemo(self.threshold)
+        view.entries = list(self.entries)
+        view.sent_chunk_ids = set(self.sent_chunk_ids)
+        view._forked_at = len(self.entries)
+        return view
+
+    def merge(self, view: "TurnMemo") -> None:
+        """Take over what a forked view added: its served queries, sent chunks and counters."""
+        for e in view.entries[view._forked_at:]:
+            self.entries.append({**e, "call": len(self.entries) + 1})
+        self.sent_chunk_ids |= view.sent_chunk_ids
+        self.hits += view.hits
+        self.chunks_skipped += view.chunks_skipped
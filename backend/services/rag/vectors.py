@@ -0,0 +1,17 @@
+# services/rag/vectors.py
+"""
+Small vector helpers shared by the per-turn RAG pieces (turn memo, speculative retrieval,
+intent router), which compare query embeddings by cosine.
+"""
+
+from __future__ import annotations
+from typing import Any
+
+import numpy as np
+
+
+def unit(vec: Any) -> np.ndarray:
+    """float32 copy scaled to unit length (per row for a matrix); zero vectors stay zero."""
+    v = np.asarray(vec, dtype=np.float32)
+    norms = np.linalg.norm(v, axis=-1, keepdims=True)
+    return v / np.where(norms == 0, 1.0, norms)
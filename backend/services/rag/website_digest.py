@@ -0,0 +1,255 @@
+# services/rag/website_digest.py
+"""
+Per-client website digest (sql/004_client_website_digest.sql).
+
+- Built by the website sync from the client's website documents: a site outline
+  (page title + path) and a few key facts per page, each page with its token count
+- Key facts are extractive: informative sentences (numbers, prices, contact details,
+  named offers) beat generic copy; nav/footer lines repeated across pages are dropped
+- `pages_checksum` covers every page checksum of the client; the digest is only rebuilt
+  when it changes (a page edited, added or removed)
+- rag_search_tool serves `website_full` calls from `get_website_digest()` instead of a
+  48-chunk vector search; reads are cached per knowledge version, and a rebuild bumps it
+- Failures never raise: the sync keeps going and the tool falls back to vector search
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from supabase_client import supabase
+from services.rag.embeddings import count_embedding_tokens
+from services.rag.knowledge_version import bump_knowledge_version, current_knowledge_version
+
+# -----------------------------
+# Config knobs (easy to tweak)
+# -----------------------------
+WEBSITE_DIGEST_ENABLED = os.getenv("RAG_WEBSITE_DIGEST", "true").lower() in ("1", "true", "yes")
+FACTS_PER_PAGE = int(os.getenv("RAG_WEBSITE_DIGEST_FACTS_PER_PAGE", "5"))
+PAGE_MAX_TOKENS = int(os.getenv("RAG_WEBSITE_DIGEST_PAGE_TOKENS", "120"))
+DIGEST_MAX_TOKENS = int(os.getenv("RAG_WEBSITE_DIGEST_MAX_TOKENS", "2500"))
+# A line on at least this share of pages (and 3+ pages) is nav/footer boilerplate
+BOILERPLATE_PAGE_RATIO = 0.5
+# -----------------------------
+
+TABLE = "client_website_digests"
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_SIGNAL_RES = (
+    re.compile(r"\d"),                                   # numbers, years, prices, hours
+    re.compile(r"[$€£%]"),
+    re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+|\+?\d[\d ()-]{7,}\d"),  # email / phone
+    re.compile(r"\b(we|our)\b", re.IGNORECASE),          # what the company says about itself
+)
+
+_cache_lock = threading.Lock()
+_cache: Dict[str, Tuple[Optional[int], Optional[Dict[str, Any]]]] = {}
+
+
+def pages_checksum(docs: Iterable[Dict[str, Any]]) -> str:
+    """One checksum over (url, page checksum) of every page; order-independent."""
+    parts = sorted(f"{d.get('source_url') or ''}\t{d.get('checksum') or ''}" for d in docs)
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _is_heading(line: str) -> bool:
+    return len(line) <= 80 and not line.rstrip().endswith((".", "!", "?", ":"))
+
+
+def _score(sentence: str) -> float:
+    n = len(sentence)
+    if n < 30 or n > 320:
+        return 0.0
+    score = 1.0 + sum(1.0 for rx in _SIGNAL_RES if rx.search(sentence))
+    score += sum(1 for w in sentence.split()[1:] if w[:1].isupper()) * 0.15  # names, products
+    return score
+
+
+def _page_facts(text: str, boilerplate: set) -> Tuple[List[str], List[str]]:
+    """(section headings, key facts in page order) for one page."""
+    headings: List[str] = []
+    candidates: List[Tuple[int, float, str]] = []
+    seen = set()
+    for line in (ln.strip() for ln in (text or "").split("\n")):
+        if not line or line in boilerplate:
+            continue
+        if _is_heading(line):
+            if line not in headings:
+                headings.append(line)
+            continue
+        for sentence in _SENTENCE_RE.split(line):
+            key = sentence.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            score = _score(sentence)
+            if score > 0:
+                candidates.append((len(candidates), score, sentence))
+
+    best = sorted(candidates, key=lambda c: (-c[1], c[0]))[:FACTS_PER_PAGE]
+    facts: List[str] = []
+    used = 0
+    for _, _, sentence in sorted(best):
+        n = count_embedding_tokens(sentence)
+        if facts and used + n > PAGE_MAX_TOKENS:
+            break
+        facts.append(sentence)
+        used += n
+    return headings[:6], facts
+
+
+def _render(client_name: str, website: str, pages: List[Dict[str, Any]]) -> str:
+    lines = [f"Website digest for {client_name} ({website or 'no website'}) — {len(pages)} pages", "", "Outline:"]
+    for p in pages:
+        sections = f" [{'; '.join(p['sections'])}]" if p["sections"] else ""
+        lines.append(f"- {p['title']} — {p['path']}{sections}")
+    lines += ["", "Key facts:"]
+    for p in pages:
+        if not p["facts"]:
+            continue
+        lines.append(f"## {p['title']} ({p['url']})")
+        lines.extend(f"- {f}" for f in p["facts"])
+    return "\n".join(lines)
+
+
+def build_website_digest(
+    docs: List[Dict[str, Any]],
+    *,
+    client_name: str,
+    website: str,
+) -> Dict[str, Any]:
+    """Digest from website documents ({source_url, title, raw_text, checksum}), shallow pages first."""
+    docs = sorted(docs, key=lambda d: (urlparse(d.get("source_url") or "").path.count("/"), d.get("source_url") or ""))
+
+    # Lines repeated on many pages are nav/footer text, not facts about a page
+    line_pages: Dict[str, int] = {}
+    for d in docs:
+        for line in {ln.strip() for ln in (d.get("raw_text") or "").split("\n") if ln.strip()}:
+            line_pages[line] = line_pages.get(line, 0) + 1
+    threshold = max(3, int(len(docs) * BOILERPLATE_PAGE_RATIO))
+    boilerplate = {line for line, n in line_pages.items() if n >= threshold}
+
+    pages: List[Dict[str, Any]] = []
+    for d in docs:
+        url = d.get("source_url") or ""
+        sections, facts = _page_facts(d.get("raw_text") or "", boilerplate)
+        page = {
+            "url": url,
+            "title": (d.get("title") or url).strip(),
+            "path": urlparse(url).path or "/",
+            "sections": sections,
+            "facts": facts,
+        }
+        page["tokens"] = count_embedding_tokens("\n".join([page["title"], *sections, *facts]))
+        pages.append(page)
+
+    digest = _render(client_name, website, pages)
+    tokens = count_embedding_tokens(digest)
+    # Over the cap: drop facts from the deepest pages first (outline always stays)
+    for p in reversed(pages):
+        if tokens <= DIGEST_MAX_TOKENS:
+            break
+        while p["facts"] and tokens > DIGEST_MAX_TOKENS:
+            p["facts"].pop()
+            digest = _render(client_name, website, pages)
+            tokens = count_embedding_tokens(digest)
+        p["tokens"] = count_embedding_tokens("\n".join([p["title"], *p["sections"], *p["facts"]]))
+
+    return {
+        "digest": digest,
+        "pages": pages,
+        "page_count": len(pages),
+        "tokens": tokens,
+        "pages_checksum": pages_checksum(docs),
+    }
+
+
+def refresh_website_digest(client_id: str, *, client_name: str, website: str) -> str:
+    """
+    Rebuild the client's digest if any page checksum changed since the last build.
+    Returns "unchanged" | "updated" | "empty" | "error".
+    """
+    try:
+        docs = (
+            supabase.table("knowledge_documents")
+            .select("source_url, checksum")
+            .eq("client_id", client_id)
+            .eq("category", "website")
+            .execute()
+            .data or []
+        )
+        if not docs:
+            return "empty"
+        checksum = pages_checksum(docs)
+        existing = (
+            supabase.table(TABLE)
+            .select("pages_checksum")
+            .eq("client_id", client_id)
+            .limit(1)
+            .execute()
+            .data or []
+        )
+        if existing and existing[0].get("pages_checksum") == checksum:
+            return "unchanged"
+
+        full_docs = (
+            supabase.table("knowledge_documents")
+            .select("source_url, title, raw_text, checksum")
+            .eq("client_id", client_id)
+            .eq("category", "website")
+            .execute()
+            .data or []
+        )
+        built = build_website_digest(full_docs, client_name=client_name, website=website)
+        supabase.table(TABLE).upsert({
+            "client_id": client_id,
+            "website": website,
+            **built,
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+        }, on_conflict="client_id").execute()
+    except Exception as e:
+        print(f"⚠️ Website digest refresh failed for client {client_id}: {e}")
+        return "error"
+
+    bump_knowledge_version("website digest")
+    print(f"🧭 Website digest rebuilt: {built['page_count']} pages, {built['tokens']} tokens")
+    return "updated"
+
+
+def delete_website_digests(client_ids: List[str]) -> None:
+    if not client_ids:
+        return
+    try:
+        supabase.table(TABLE).delete().in_("client_id", client_ids).execute()
+    except Exception as e:
+        print(f"⚠️ Could not delete website digests: {e}")
+
+
+def get_website_digest(client_id: str) -> Optional[Dict[str, Any]]:
+    """The client's digest row (None when missing or unreadable); cached per knowledge version."""
+    version = current_knowledge_version()
+    with _cache_lock:
+        cached = _cache.get(client_id)
+    if cached is not None and version is not None and cached[0] == version:
+        return cached[1]
+    try:
+        rows = (
+            supabase.table(TABLE)
+            .select("digest, page_count, tokens, pages, generated_at")
+            .eq("client_id", client_id)
+            .limit(1)
+            .execute()
+            .data or []
+        )
+    except Exception as e:
+        print(f"⚠️ Could not read website digest: {e}")
+        return None
+    digest = rows[0] if rows else None
+    with _cache_lock:
+        _cache[client_id] = (version, digest)
+    return digest
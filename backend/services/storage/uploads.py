@@ -9,6 +9,9 @@ from datetime import datetime, timezone
 from typing import Tuple
 
 from supabase_client import supabase
+from services.rag.embeddings import EmbeddingError
+from services.rag.doc_summaries import refresh_document_summaries_async
+from services.rag.index_sync import documents_changed
 
 # Reuse the SAME chunking + embedding logic as Notion sync
 from services.sync.sync_notion_to_rag import (
@@ -111,7 +114,9 @@ def upload_conversation_file(
     """
     Uploads a file to Supabase Storage AND creates a knowledge_documents row
     AND immediately chunks/embeds it using the SAME logic as Notion sync
-    (chunk_text + _insert_chunks).
+    (chunk_text + _insert_chunks, i.e. batched embedding requests).
+    Raises EmbeddingError if the chunks can't be embedded; the document row and the stored
+    file are removed first (uploads are never re-synced, so a chunkless row would stay unfindable).
 
     Returns: (document_id, storage_path)
     """
@@ -166,13 +171,25 @@ def upload_conversation_file(
     if raw_text:
         chunks = chunk_text(raw_text)
         if chunks:
-            _insert_chunks(
-                document_id=document_id,
-                chunks=chunks,
-                title=title,
-                client_id=client_id,
-                category="upload",
-                tags=tags,
-            )
+            try:
+                _insert_chunks(
+                    document_id=document_id,
+                    chunks=chunks,
+                    title=title,
+                    client_id=client_id,
+                    category="upload",
+                    tags=tags,
+                )
+            except EmbeddingError:
+                # Nothing was inserted for this document: drop it so the user can upload again
+                supabase.table("knowledge_documents").delete().eq("id", document_id).execute()
+                try:
+                    supabase.storage.from_(UPLOADS_BUCKET).remove([storage_path])
+                except Exception as e:
+                    print(f"⚠️ Could not remove {storage_path} from storage: {e}")
+                raise
+            # Request path: never trigger an index compaction here
+            documents_changed([document_id], allow_compaction=False)
+            refresh_document_summaries_async([document_id])
 
     return document_id, storage_path
@@ -0,0 +1,174 @@
+# services/sync/chunk_diff.py
+"""
+Chunk-level diffing for knowledge_chunks writes (shared by Notion sync, website sync and uploads).
+
+- Every chunk row carries `checksum` = sha256 of the exact text we embedded for it
+- On re-sync we compare the old and new checksum sets for the document:
+    * unchanged chunks keep their row (and embedding); only `chunk_index` is moved if needed,
+      and client_id / category / tags are rewritten when the document's changed
+    * new/changed chunks are embedded (batched) and inserted
+    * old chunks that no longer exist are deleted (last)
+- Embedding happens before any row is touched, so an EmbeddingError leaves the old chunks intact;
+  a write that fails later leaves extra chunks, never missing ones, and the sync pipelines clear
+  the document checksum on any error so the next run redoes the document
+- With RAG_MATRYOSHKA_DIMS set, rows also get `embedding_short` (re-normalized prefix vector)
+"""
+
+from __future__ import annotations
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from supabase_client import supabase
+from services.rag.embeddings import (
+    EMBED_MODEL,
+    MATRYOSHKA_DIMS,
+    count_embedding_tokens,
+    embed_texts,
+    matryoshka_prefix,
+)
+
+
+def chunk_checksum(embed_input: str) -> str:
+    return hashlib.sha256(embed_input.encode("utf-8")).hexdigest()
+
+
+def _fields_differ(row: Dict[str, Any], row_fields: Dict[str, Any]) -> bool:
+    """True when a stored chunk row disagrees with the document's row fields (None == [] == "")."""
+    return any((row.get(k) or None) != (v or None) for k, v in row_fields.items())
+
+
+def _reindex(moves: List[Dict[str, Any]]) -> None:
+    """
+    Set the new chunk_index of moved rows with the reindex_knowledge_chunks RPC (sql/007).
+    Without the migration: one UPDATE per row. Mid-way two rows may briefly share an index
+    (e.g. a swap); chunk_index is not unique, and every row ends at its new position.
+    """
+    try:
+        supabase.rpc("reindex_knowledge_chunks", {
+            "in_ids": [m["row"]["id"] for m in moves],
+            "in_indexes": [m["chunk_index"] for m in moves],
+        }).execute()
+        return
+    except Exception as e:
+        print(f"⚠️ reindex_knowledge_chunks RPC failed ({e}); updating {len(moves)} rows one by one")
+    for m in moves:
+        (
+            supabase.table("knowledge_chunks")
+            .update({"chunk_index": m["chunk_index"]})
+            .eq("id", m["row"]["id"])
+            .execute()
+        )
+
+
+def _build_rows(
+    document_id: str,
+    items: List[Dict[str, Any]],
+    vectors: List[List[float]],
+    row_fields: Dict[str, Any],
+) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for item, vec in zip(items, vectors):
+        row = {
+            "document_id": document_id,
+            "chunk_index": item["chunk_index"],
+            "content": item["content"],                 # human-readable content (no title)
+            "tokens": count_embedding_tokens(item["content"]),
+            "embedding": vec,                           # vector(1536)
+            "checksum": item["checksum"],
+            **row_fields,                               # client_id, category, tags
+        }
+        if MATRYOSHKA_DIMS:
+            row["embedding_short"] = matryoshka_prefix(vec, MATRYOSHKA_DIMS)  # coarse-pass vector
+        rows.append(row)
+    return rows
+
+
+def insert_chunks(
+    document_id: str,
+    chunks: List[str],
+    embed_inputs: List[str],
+    row_fields: Dict[str, Any],
+    *,
+    model: str = EMBED_MODEL,
+) -> int:
+    """Embed + insert chunks for a document that has none yet. Returns rows inserted."""
+    items = [
+        {"chunk_index": idx, "content": ch, "checksum": chunk_checksum(inp)}
+        for idx, (ch, inp) in enumerate(zip(chunks, embed_inputs))
+    ]
+    vectors = embed_texts(embed_inputs, model=model)
+    rows = _build_rows(document_id, items, vectors, row_fields)
+    if rows:
+        supabase.table("knowledge_chunks").insert(rows).execute()
+    return len(rows)
+
+
+def sync_document_chunks(
+    document_id: str,
+    chunks: List[str],
+    embed_inputs: List[str],
+    row_fields: Dict[str, Any],
+    *,
+    model: str = EMBED_MODEL,
+) -> Dict[str, int]:
+    """
+    Bring the document's knowledge_chunks in line with `chunks`, re-embedding only what changed.
+    Returns {"reused", "embedded", "deleted", "reindexed", "retagged"} counts.
+    """
+    existing = (
+        supabase.table("knowledge_chunks")
+        .select("id, chunk_index, checksum, " + ", ".join(row_fields))
+        .eq("document_id", document_id)
+        .order("chunk_index")
+        .execute()
+        .data or []
+    )
+
+    # checksum → old rows with that checksum (in chunk order)
+    old_by_checksum: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for row in existing:
+        old_by_checksum.setdefault(row.get("checksum"), []).append(row)
+
+    reused: List[Dict[str, Any]] = []     # (old row, new index)
+    to_embed: List[Dict[str, Any]] = []
+    to_embed_inputs: List[str] = []
+    for idx, (ch, inp) in enumerate(zip(chunks, embed_inputs)):
+        checksum = chunk_checksum(inp)
+        candidates = old_by_checksum.get(checksum)
+        if candidates:
+            reused.append({"row": candidates.pop(0), "chunk_index": idx})
+        else:
+            to_embed.append({"chunk_index": idx, "content": ch, "checksum": checksum})
+            to_embed_inputs.append(inp)
+
+    # 1) Embed first: if this raises, nothing has been modified yet
+    vectors = embed_texts(to_embed_inputs, model=model) if to_embed_inputs else []
+
+    # 2) Insert the new/changed chunks before anything is removed: if a later step fails,
+    #    the document has extra chunks rather than missing ones (callers clear its checksum)
+    rows = _build_rows(document_id, to_embed, vectors, row_fields)
+    if rows:
+        supabase.table("knowledge_chunks").insert(rows).execute()
+
+    # 3) Move kept rows to their new positions (one statement, see _reindex)
+    moves = [m for m in reused if m["row"]["chunk_index"] != m["chunk_index"]]
+    if moves:
+        _reindex(moves)
+
+    # 4) Kept rows take the document's current client / category / tags (used by search filters)
+    retag_ids = [m["row"]["id"] for m in reused if _fields_differ(m["row"], row_fields)]
+    if retag_ids:
+        supabase.table("knowledge_chunks").update(row_fields).in_("id", retag_ids).execute()
+
+    # 5) Drop old chunks that have no match in the new set (incl. legacy rows without checksum)
+    stale_ids = [r["id"] for rows in old_by_checksum.values() for r in rows]
+    if stale_ids:
+        supabase.table("knowledge_chunks").delete().in_("id", stale_ids).execute()
+
+    return {
+        "reused": len(reused),
+        "embedded": len(rows),
+        "deleted": len(stale_ids),
+        "reindexed": len(moves),
+        "retagged": len(retag_ids),
+    }
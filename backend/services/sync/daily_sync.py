@@ -1,5 +1,6 @@
 from datetime import datetime, timezone
 
+from services.rag.doc_summaries import refresh_document_summaries
 from services.sync.sync_notion_to_rag import run_full_sync as run_notion_sync
 from services.sync.sync_websites_to_rag import sync_websites_to_rag
 
@@ -9,12 +10,13 @@ def run_all_syncs() -> None:
     Orchestrate all daily sync jobs:
       1) Notion → RAG (clients + sops + meeting_notes + clients DB, etc.)
       2) Websites → RAG (client websites)
+      3) Document summaries still stale after 1–2 (e.g. an earlier LLM failure)
     """
     now = datetime.now(timezone.utc).isoformat(timespec="seconds")
     print(f"=== QUORRA daily sync started at {now} ===", flush=True)
 
     # 1) Notion sync (includes clients refresh)
-    print("\n--- Step 1/2: Notion → RAG sync ---", flush=True)
+    print("\n--- Step 1/3: Notion → RAG sync ---", flush=True)
     try:
         run_notion_sync()
         print("--- Notion sync completed. ---", flush=True)
@@ -22,13 +24,18 @@ def run_all_syncs() -> None:
         print(f"❌ Notion sync failed: {e}", flush=True)
 
     # 2) Website sync
-    print("\n--- Step 2/2: Websites → RAG sync ---", flush=True)
+    print("\n--- Step 2/3: Websites → RAG sync ---", flush=True)
     try:
         sync_websites_to_rag()
         print("--- Website sync completed. ---", flush=True)
     except Exception as e:
         print(f"❌ Website sync failed: {e}", flush=True)
 
+    # 3) Summary backfill (only documents whose checksum moved since their summary)
+    print("\n--- Step 3/3: Document summaries ---", flush=True)
+    stats = refresh_document_summaries()
+    print(f"--- Document summaries: {stats} ---", flush=True)
+
     print("\n=== QUORRA daily sync finished ===", flush=True)
 
 
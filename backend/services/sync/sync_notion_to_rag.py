@@ -6,10 +6,14 @@ from typing import Dict, Any, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from notion_client import Client as NotionClient
-from openai import OpenAI
 from supabase_client import supabase
 from services.notion.meetings import _get_all_blocks 
 from services.notion.client_sync import refresh_clients_from_notion
+from services.rag.chunking import chunk_text
+from services.rag.embeddings import EmbeddingError
+from services.rag.doc_summaries import refresh_document_summaries
+from services.rag.index_sync import documents_changed, documents_deleted
+from services.sync.chunk_diff import insert_chunks, sync_document_chunks
 
 
 load_dotenv()
@@ -37,11 +41,9 @@ if not OPENAI_API_KEY:
     raise RuntimeError("Missing OPENAI_API_KEY in .env")
 
 notion = NotionClient(auth=NOTION_TOKEN)
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
 # ── CHUNKING / EMBEDDINGS ─────────────────────────────────────────────────────
-MAX_CHARS = 2000     # target chunk size
-OVERLAP   = 300      # overlapping stride
+# chunk_text honours CHUNKING_MODE (fixed | cdc); see services/rag/chunking.py
 EMBEDDING_MODEL = "text-embedding-3-small"  # 1536 dims; matches vector(1536)
 
 
@@ -88,24 +90,6 @@ def get_rich_text_prop(props: Dict[str, Any], name: str) -> str:
     return ""
 
 
-def chunk_text(text: str) -> List[str]:
-    """Split long text into overlapping character chunks."""
-    chunks: List[str] = []
-    n = len(text)
-    if n == 0:
-        return chunks
-    start = 0
-    while start < n:
-        end = min(start + MAX_CHARS, n)
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        if end == n:
-            break
-        start = max(0, end - OVERLAP)
-    return chunks
-
-
 def extract_full_page_text(page_id: str) -> str:
     """
     Concatenate visible rich_text from all blocks in a page.
@@ -124,16 +108,6 @@ def extract_full_page_text(page_id: str) -> str:
     return "\n".join(parts).strip()
 
 
-def embed_text(text: str) -> List[float]:
-    """Return an embedding vector; return [] on failure (we'll still insert row)."""
-    try:
-        resp = openai_client.embeddings.create(model=EMBEDDING_MODEL, input=text)
-        return resp.data[0].embedding
-    except Exception as e:
-        print(f"⚠️ Embedding error: {e}")
-        return []
-
-
 # ── CLIENT LINKING (Notion relation → Supabase UUID) ──────────────────────────
 def build_client_cache() -> Dict[str, str]:
     """
@@ -190,8 +164,12 @@ def _doc_by_notion_page_id(page_id: str) -> Optional[Dict[str, Any]]:
     return res.data[0] if res.data else None
 
 
-def _delete_chunks_for_document(document_id: str) -> None:
-    supabase.table("knowledge_chunks").delete().eq("document_id", document_id).execute()
+def _embed_inputs(chunks: List[str], title: str) -> List[str]:
+    """Exact text we embed per chunk (also what the chunk checksum covers)."""
+    return [
+        f"{title}\n\n{ch}".strip() if INCLUDE_TITLE_IN_EMBED else ch
+        for ch in chunks
+    ]
 
 
 def _insert_chunks(
@@ -202,24 +180,35 @@ def _insert_chunks(
     category: str,
     tags: Optional[List[str]],
 ) -> int:
-    rows: List[Dict[str, Any]] = []
-    for idx, ch in enumerate(chunks):
-        content_to_embed = f"{title}\n\n{ch}".strip() if INCLUDE_TITLE_IN_EMBED else ch
-        rows.append(
-            {
-                "document_id": document_id,
-                "chunk_index": idx,
-                "content": ch,                             # human-readable content (no title)
-                "tokens": None,
-                "embedding": embed_text(content_to_embed), # vector(1536)
-                "client_id": client_id,
-                "category": category,
-                "tags": tags or [],
-            }
-        )
-    if rows:
-        supabase.table("knowledge_chunks").insert(rows).execute()
-    return len(rows)
+    """
+    Embed all chunks in as few batched requests as possible, then insert them.
+    Raises EmbeddingError (nothing inserted) if any chunk can't be embedded.
+    """
+    return insert_chunks(
+        document_id,
+        chunks,
+        _embed_inputs(chunks, title),
+        {"client_id": client_id, "category": category, "tags": tags or []},
+        model=EMBEDDING_MODEL,
+    )
+
+
+def _sync_chunks(
+    document_id: str,
+    chunks: List[str],
+    title: str,
+    client_id: Optional[str],
+    category: str,
+    tags: Optional[List[str]],
+) -> Dict[str, int]:
+    """Diff against the stored chunks; only new/changed chunks are embedded and written."""
+    return sync_document_chunks(
+        document_id,
+        chunks,
+        _embed_inputs(chunks, title),
+        {"client_id": client_id, "category": category, "tags": tags or []},
+        model=EMBEDDING_MODEL,
+    )
 
 
 # ── SUPABASE UPSERT ───────────────────────────────────────────────────────────
@@ -233,13 +222,15 @@ def upsert_document_and_chunks(
     client_id: Optional[str] = None,
     source_url: Optional[str] = None,
     tags: Optional[List[str]] = None,
-) -> Tuple[str, str]:
+) -> Tuple[str, str, Dict[str, int]]:
     """
     Upsert a knowledge_documents row keyed by notion_page_id.
     If unchanged (checksum match), skip re-chunk/insert.
-    Else: (re)write document, delete old chunks and insert new chunks with embeddings.
+    Else: (re)write document and diff its chunks: unchanged chunks are kept,
+    new/changed chunks are embedded and inserted, vanished chunks are deleted.
 
-    Returns (document_id, action) where action in {"added","updated","skipped"}.
+    Returns (document_id, action, chunk_stats) where action in {"added","updated","skipped"}
+    and chunk_stats has reused/embedded/deleted/reindexed/retagged counts.
     """
     existing = _doc_by_notion_page_id(notion_page_id)
 
@@ -250,7 +241,7 @@ def upsert_document_and_chunks(
     if existing and existing.get("checksum") == new_checksum:
         # fast path: unchanged
         print(f"✅ Skipping unchanged (checksum): {title}")
-        return existing["id"], "skipped"
+        return existing["id"], "skipped", {}
 
     doc_payload = {
         "source":          "notion",
@@ -258,7 +249,7 @@ def upsert_document_and_chunks(
         "source_url":      source_url,
         "title":           title,
         "raw_text":        raw_text,
-        "summary":         None,
+        # summary: rebuilt by refresh_document_summaries once the checksum moved
         "client_id":       client_id,
         "category":        category,
         "tags":            tags or [],
@@ -277,30 +268,46 @@ def upsert_document_and_chunks(
         raise RuntimeError("Upsert failed: no data returned for knowledge_documents")
     document_id = up.data[0]["id"]
 
-    # Overwrite chunks (content changed or it's new)
-    _delete_chunks_for_document(document_id)
-
+    action = "updated" if existing else "added"
     chunks = chunk_text(raw_text)
     if not chunks:
         print(f"⚠️ No textual content for: {title}")
-        return document_id, ("updated" if existing else "added")
 
-    n = _insert_chunks(document_id, chunks, title, client_id, category, tags)
-    print(f"✅ Synced '{title}' → {n} chunks")
-    return document_id, ("updated" if existing else "added")
+    try:
+        if existing:
+            chunk_stats = _sync_chunks(document_id, chunks, title, client_id, category, tags)
+        else:
+            n = _insert_chunks(document_id, chunks, title, client_id, category, tags)
+            chunk_stats = {"reused": 0, "embedded": n, "deleted": 0, "reindexed": 0, "retagged": 0}
+    except Exception:
+        # Embedding or a chunk write failed: clear the checksum so the next sync retries
+        # this page instead of skipping it
+        supabase.table("knowledge_documents").update({"checksum": None}).eq("id", document_id).execute()
+        raise
+    print(
+        f"✅ Synced '{title}' → {len(chunks)} chunks "
+        f"(reused={chunk_stats['reused']}, embedded={chunk_stats['embedded']}, "
+        f"deleted={chunk_stats['deleted']})"
+    )
+    return document_id, action, chunk_stats
 
 
 # ── NOTION SYNC ───────────────────────────────────────────────────────────────
 def sync_notion_database(db_id: str, category: str, client_cache: Dict[str, str]) -> Tuple[set, Dict[str, int]]:
     """
     Iterate all pages in a Notion DB, pull text, and upsert in Supabase.
-    Returns (seen_ids, stats) where stats has added/updated/skipped counts.
+    Returns (seen_ids, stats) where stats has added/updated/skipped/failed page counts
+    and chunks_reused/chunks_embedded/chunks_deleted chunk counts.
     """
     print(f"\n📚 Syncing category '{category}' (INCLUDE_TITLE_IN_EMBED={INCLUDE_TITLE_IN_EMBED})...")
     start_cursor = None
     total = 0
     seen_ids: set = set()
-    stats = {"added": 0, "updated": 0, "skipped": 0}
+    changed_doc_ids: List[str] = []
+    stats = {
+        "added": 0, "updated": 0, "skipped": 0, "failed": 0,
+        "chunks_reused": 0, "chunks_embedded": 0, "chunks_deleted": 0,
+    }
 
     while True:
         args = {"database_id": db_id, "page_size": 50}
@@ -357,24 +364,36 @@ def sync_notion_database(db_id: str, category: str, client_cache: Dict[str, str]
                 total += 1
                 continue
 
-            _, action = upsert_document_and_chunks(
-                notion_page_id=page_id,
-                title=title,
-                raw_text=text,
-                category=category,
-                last_edited_at=last_edited_time,
-                client_id=client_id,        # set for meeting_notes, None for others
-                source_url=source_url,
-                tags=tags,
-            )
+            try:
+                document_id, action, chunk_stats = upsert_document_and_chunks(
+                    notion_page_id=page_id,
+                    title=title,
+                    raw_text=text,
+                    category=category,
+                    last_edited_at=last_edited_time,
+                    client_id=client_id,        # set for meeting_notes, None for others
+                    source_url=source_url,
+                    tags=tags,
+                )
+            except EmbeddingError as e:
+                print(f"❌ Embedding failed for '{title}': {e}")
+                stats["failed"] += 1
+                continue
             stats[action] += 1
+            if action != "skipped":
+                changed_doc_ids.append(document_id)
+            for key in ("reused", "embedded", "deleted"):
+                stats[f"chunks_{key}"] += chunk_stats.get(key, 0)
             total += 1
 
         if not res.get("has_more"):
             break
         start_cursor = res.get("next_cursor")
 
-    print(f"🏁 Done: {category} → processed {total} pages (added={stats['added']}, updated={stats['updated']}, skipped={stats['skipped']})")
+    documents_changed(changed_doc_ids)
+    refresh_document_summaries(changed_doc_ids)
+    print(f"🏁 Done: {category} → processed {total} pages (added={stats['added']}, updated={stats['updated']}, skipped={stats['skipped']}, failed={stats['failed']}; "
+          f"chunks reused={stats['chunks_reused']}, embedded={stats['chunks_embedded']}, deleted={stats['chunks_deleted']})")
     return seen_ids, stats
 
 
@@ -403,6 +422,7 @@ def prune_orphan_documents(category: str, seen_notion_ids: set) -> int:
     supabase.table("knowledge_chunks").delete().in_("document_id", to_delete_ids).execute()
     # Then delete documents
     supabase.table("knowledge_documents").delete().in_("id", to_delete_ids).execute()
+    documents_deleted(to_delete_ids)
     print(f"🧹 Pruned {len(to_delete_ids)} orphan documents in category '{category}'.")
     return len(to_delete_ids)
 
@@ -449,7 +469,9 @@ def run_full_sync():
             print(
                 f"✅ Sync summary for '{category}': "
                 f"added={stats['added']}, updated={stats['updated']}, "
-                f"skipped={stats['skipped']}, deleted={deleted}"
+                f"skipped={stats['skipped']}, failed={stats['failed']}, deleted={deleted}; "
+                f"chunks reused={stats['chunks_reused']}, embedded={stats['chunks_embedded']}, "
+                f"deleted={stats['chunks_deleted']}"
             )
         except Exception as e:
             print(f"❌ Error syncing '{category}': {e}")
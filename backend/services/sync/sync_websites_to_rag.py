@@ -1,16 +1,23 @@
 import os
 import hashlib
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Set, Tuple
+from typing import List, Dict, Any, Optional, Set, Tuple
 from collections import deque
 from urllib.parse import urlparse, urljoin, urldefrag
 
 import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from openai import OpenAI
 
 from supabase_client import supabase
+from services.rag.doc_summaries import refresh_document_summaries
+from services.rag.index_sync import documents_changed, documents_deleted
+from services.rag.website_digest import (
+    WEBSITE_DIGEST_ENABLED,
+    delete_website_digests,
+    refresh_website_digest,
+)
+from services.sync.chunk_diff import insert_chunks, sync_document_chunks
 
 # -----------------------------------------------------------------------------
 # ENV + CONFIG
@@ -27,7 +34,6 @@ MAX_PAGES = int(os.getenv("WEBSITE_MAX_PAGES", "25"))
 
 # Embeddings
 EMBED_MODEL = "text-embedding-3-small"
-_oai = OpenAI(api_key=OPENAI_API_KEY)
 
 # Chunking
 MAX_CHARS_PER_CHUNK = 2000  # rough ~500 tokens
@@ -193,7 +199,7 @@ def crawl_site(root_url: str, max_depth: int, max_pages: int) -> List[Dict[str,
 
 
 # -----------------------------------------------------------------------------
-# Chunking + embeddings
+# Chunking
 # -----------------------------------------------------------------------------
 def split_into_chunks(text: str, max_chars: int = MAX_CHARS_PER_CHUNK) -> List[str]:
     """
@@ -218,20 +224,6 @@ def split_into_chunks(text: str, max_chars: int = MAX_CHARS_PER_CHUNK) -> List[s
     return chunks
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
-    """
-    Batch-embed a list of texts with OpenAI.
-    """
-    if not texts:
-        return []
-
-    resp = _oai.embeddings.create(
-        model=EMBED_MODEL,
-        input=texts,
-    )
-    return [item.embedding for item in resp.data]
-
-
 # -----------------------------------------------------------------------------
 # Supabase upsert helpers
 # -----------------------------------------------------------------------------
@@ -239,9 +231,12 @@ def upsert_page_for_client(
     client_id: str,
     page: Dict[str, str],
     now: datetime,
-) -> None:
+) -> Tuple[Optional[str], Dict[str, int]]:
     """
     Upsert one website page into knowledge_documents + knowledge_chunks.
+    Changed pages are diffed chunk by chunk, so only new/changed chunks are re-embedded.
+    Returns (document_id, chunk_stats); chunk_stats (reused/embedded/deleted/reindexed)
+    is empty when the page was unchanged.
     """
     url = page["url"]
     title = page["title"]
@@ -300,35 +295,35 @@ def upsert_page_for_client(
         }).execute()
         if not insert_resp.data:
             log("    ❌ Failed to insert knowledge_document")
-            return
+            return None, {}
         doc_id = insert_resp.data[0]["id"]
 
-    # If unchanged, we can skip re-chunking to save tokens (optional).
-    # For v1, we'll re-chunk only on new/updated:
-    if status in ("new", "updated"):
-        # Delete existing chunks for this doc
-        supabase.table("knowledge_chunks").delete().eq("document_id", doc_id).execute()
-
-        chunks = split_into_chunks(text)
-        embeddings = embed_texts(chunks)
-        rows = []
-        for idx, (chunk_text, emb) in enumerate(zip(chunks, embeddings)):
-            rows.append({
-                "document_id": doc_id,
-                "chunk_index": idx,
-                "content": chunk_text,
-                "tokens": len(chunk_text.split()),
-                "embedding": emb,
-                "client_id": client_id,
-                "category": "website",
-                "tags": ["website"],
-            })
+    # Unchanged pages keep their chunks as-is
+    if status == "unchanged":
+        return doc_id, {}
 
-        if rows:
-            supabase.table("knowledge_chunks").insert(rows).execute()
-            log(f"    🧩 Stored {len(rows)} chunks for doc: {url}")
+    chunks = split_into_chunks(text)
+    row_fields = {"client_id": client_id, "category": "website", "tags": ["website"]}
+    try:
+        if status == "new":
+            n = insert_chunks(doc_id, chunks, chunks, row_fields, model=EMBED_MODEL)
+            chunk_stats = {"reused": 0, "embedded": n, "deleted": 0, "reindexed": 0, "retagged": 0}
         else:
-            log(f"    ⚠️ No chunks produced for doc: {url}")
+            chunk_stats = sync_document_chunks(doc_id, chunks, chunks, row_fields, model=EMBED_MODEL)
+    except Exception:
+        # Embedding or a chunk write failed: clear the checksum so the next sync retries this page
+        supabase.table("knowledge_documents").update({"checksum": None}).eq("id", doc_id).execute()
+        raise
+
+    if chunks:
+        log(
+            f"    🧩 {len(chunks)} chunks for doc: {url} "
+            f"(reused={chunk_stats['reused']}, embedded={chunk_stats['embedded']}, "
+            f"deleted={chunk_stats['deleted']})"
+        )
+    else:
+        log(f"    ⚠️ No chunks produced for doc: {url}")
+    return doc_id, chunk_stats
 
 
 # -----------------------------------------------------------------------------
@@ -361,6 +356,7 @@ def cleanup_orphan_website_docs() -> None:
     docs = docs_res.data or []
 
     delete_doc_ids: List[str] = []
+    digest_client_ids: Set[str] = set()
 
     for doc in docs:
         cid = doc.get("client_id")
@@ -375,6 +371,10 @@ def cleanup_orphan_website_docs() -> None:
 
         if not website or status == "inactive":
             delete_doc_ids.append(doc["id"])
+            digest_client_ids.add(cid)
+
+    # Digests of deleted clients go with them (FK cascade); the rest are removed here
+    delete_website_digests(sorted(digest_client_ids))
 
     if not delete_doc_ids:
         log("  ✅ No orphan website docs to delete.")
@@ -387,6 +387,7 @@ def cleanup_orphan_website_docs() -> None:
         supabase.table("knowledge_chunks").delete().eq("document_id", doc_id).execute()
         supabase.table("knowledge_documents").delete().eq("id", doc_id).execute()
 
+    documents_deleted(delete_doc_ids)
     log("  ✅ Cleanup finished.")
 
 
@@ -399,6 +400,7 @@ def sync_websites_to_rag() -> None:
       - Fetch clients with websites
       - Crawl their sites
       - Upsert website pages into knowledge_documents + knowledge_chunks
+      - Rebuild each client's website digest when a page checksum changed
       - Cleanup invalid website docs
     """
     log("=== Website → RAG sync started ===")
@@ -424,6 +426,7 @@ def sync_websites_to_rag() -> None:
     log(f"Found {len(valid_clients)} active clients with websites.")
 
     now = datetime.now(timezone.utc)
+    totals = {"reused": 0, "embedded": 0, "deleted": 0}
 
     for client in valid_clients:
         client_id = client["id"]
@@ -446,16 +449,32 @@ def sync_websites_to_rag() -> None:
 
         log(f"  📚 Upserting {len(pages)} page(s) into RAG…")
 
+        changed_doc_ids: List[str] = []
         for page in pages:
             try:
-                upsert_page_for_client(client_id, page, now)
+                doc_id, chunk_stats = upsert_page_for_client(client_id, page, now)
+                if doc_id and chunk_stats:
+                    changed_doc_ids.append(doc_id)
+                for key in totals:
+                    totals[key] += chunk_stats.get(key, 0)
             except Exception as e:
                 log(f"    ❌ Error upserting page {page['url']}: {e}")
 
+        documents_changed(changed_doc_ids)
+        refresh_document_summaries(changed_doc_ids)
+
+        if WEBSITE_DIGEST_ENABLED:
+            digest_status = refresh_website_digest(client_id, client_name=name, website=website)
+            log(f"  🧭 Website digest: {digest_status}")
+
     # Cleanup orphan docs
     log("\n" + "=" * 70)
     cleanup_orphan_website_docs()
 
+    log(
+        f"\nChunks: reused={totals['reused']}, embedded={totals['embedded']}, "
+        f"deleted={totals['deleted']}"
+    )
     log("\n=== Website → RAG sync completed ===")
 
 
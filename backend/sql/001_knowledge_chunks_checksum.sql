@@ -0,0 +1,10 @@
+-- 001: per-chunk content checksum
+-- sha256 of the exact text that was embedded for the chunk (title + content when
+-- INCLUDE_TITLE_IN_EMBED is on). The sync pipelines compare these on re-sync and only
+-- embed/write chunks whose checksum is new; unchanged rows are kept.
+
+alter table public.knowledge_chunks
+  add column if not exists checksum text;
+
+create index if not exists knowledge_chunks_document_checksum_idx
+  on public.knowledge_chunks (document_id, checksum);
@@ -0,0 +1,96 @@
+-- 002: Matryoshka short vectors + two-stage match RPC
+-- embedding_short = first 256 dims of the text-embedding-3-small vector, re-normalized
+-- (written by the sync pipelines when RAG_MATRYOSHKA_DIMS=256). rag_search then calls
+-- match_knowledge_chunks_two_stage: an HNSW pass over the short vectors picks a shortlist,
+-- and only the shortlist is re-ranked with the full 1536-dim embedding.
+-- Rows written while RAG_MATRYOSHKA_DIMS was 0 have no short vector; they are ranked by their
+-- full embedding instead, so nothing drops out of search (re-run the backfill below to move
+-- them onto the fast path).
+-- hnsw.ef_search caps how many rows one HNSW scan returns, and filters apply after the scan,
+-- so the function raises it to the shortlist size for the call.
+-- The column is vector(256): RAG_MATRYOSHKA_DIMS must be 0 or 256 (checked at startup).
+-- Requires pgvector >= 0.7 (subvector / l2_normalize).
+
+alter table public.knowledge_chunks
+  add column if not exists embedding_short vector(256);
+
+-- Backfill existing rows from their full embeddings
+update public.knowledge_chunks
+  set embedding_short = l2_normalize(subvector(embedding, 1, 256))::vector(256)
+  where embedding_short is null and embedding is not null;
+
+create index if not exists knowledge_chunks_embedding_short_hnsw_idx
+  on public.knowledge_chunks using hnsw (embedding_short vector_cosine_ops);
+
+-- Same filters and result columns as match_knowledge_chunks
+create or replace function public.match_knowledge_chunks_two_stage(
+  query_embedding vector(1536),
+  query_embedding_short vector(256),
+  match_count int,
+  shortlist_count int,
+  in_category text default null,
+  in_client uuid default null,
+  in_conversation uuid default null
+)
+returns table (
+  chunk_id uuid,
+  document_id uuid,
+  chunk_index int,
+  doc_title text,
+  source_url text,
+  category text,
+  client_id uuid,
+  similarity float,
+  content text
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  perform set_config('hnsw.ef_search', least(1000, greatest(shortlist_count, match_count, 40))::text, true);
+
+  return query
+  with shortlist as (
+    (
+      select kc.id
+      from public.knowledge_chunks kc
+      join public.knowledge_documents kd on kd.id = kc.document_id
+      where kc.embedding_short is not null
+        and (in_category is null or kc.category = in_category)
+        and (in_client is null or kc.client_id = in_client)
+        and (kd.conversation_id is null or kd.conversation_id = in_conversation)
+      order by kc.embedding_short <=> query_embedding_short
+      limit greatest(shortlist_count, match_count)
+    )
+    union
+    (
+      -- rows without a short vector yet: ranked by the full embedding
+      select kc.id
+      from public.knowledge_chunks kc
+      join public.knowledge_documents kd on kd.id = kc.document_id
+      where kc.embedding_short is null
+        and kc.embedding is not null
+        and (in_category is null or kc.category = in_category)
+        and (in_client is null or kc.client_id = in_client)
+        and (kd.conversation_id is null or kd.conversation_id = in_conversation)
+      order by kc.embedding <=> query_embedding
+      limit greatest(shortlist_count, match_count)
+    )
+  )
+  select
+    kc.id as chunk_id,
+    kc.document_id,
+    kc.chunk_index,
+    kd.title as doc_title,
+    kd.source_url,
+    kc.category,
+    kc.client_id,
+    (1 - (kc.embedding <=> query_embedding))::float as similarity,
+    kc.content
+  from shortlist s
+  join public.knowledge_chunks kc on kc.id = s.id
+  join public.knowledge_documents kd on kd.id = kc.document_id
+  order by kc.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
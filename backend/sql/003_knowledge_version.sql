@@ -0,0 +1,24 @@
+-- 003: knowledge version counter
+-- One row, bumped by the Notion sync, website sync and upload paths whenever they write
+-- knowledge_chunks. API workers cache rag_search results tagged with the version they saw,
+-- so any bump invalidates every cached result at once (across processes).
+
+create table if not exists public.rag_knowledge_version (
+  id         int primary key default 1 check (id = 1),
+  version    bigint not null default 0,
+  updated_at timestamptz not null default now()
+);
+
+insert into public.rag_knowledge_version (id, version)
+  values (1, 0)
+  on conflict (id) do nothing;
+
+create or replace function public.bump_knowledge_version()
+returns bigint
+language sql
+as $$
+  update public.rag_knowledge_version
+    set version = version + 1, updated_at = now()
+    where id = 1
+  returning version;
+$$;
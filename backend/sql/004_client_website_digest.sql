@@ -0,0 +1,16 @@
+-- 004: per-client website digest
+-- Built by the website sync (services/rag/website_digest.py): a site outline plus a few key
+-- facts per page, with token counts. rag_search_tool serves `website_full` calls from here
+-- instead of a 48-chunk vector search. `pages_checksum` covers every page checksum of the
+-- client, so the digest is only rebuilt when some page changed (or a page came or went).
+
+create table if not exists public.client_website_digests (
+  client_id      uuid primary key references public.clients(id) on delete cascade,
+  website        text,
+  digest         text not null,          -- what the model gets
+  pages          jsonb not null,         -- [{url, title, path, facts: [..], tokens}]
+  page_count     int not null,
+  tokens         int not null,           -- tokens of `digest`
+  pages_checksum text not null,
+  generated_at   timestamptz not null default now()
+);
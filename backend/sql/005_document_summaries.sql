@@ -0,0 +1,85 @@
+-- 005: document-level summary tier
+-- Ingestion (services/rag/doc_summaries.py) writes a short summary per document plus its
+-- embedding. `summary_checksum` is the document checksum the summary was built from, so a
+-- summary is only regenerated when the document changed.
+-- match_knowledge_chunks_two_tier finds the best documents by summary first and then ranks
+-- only their chunks; documents without a summary yet are always searched (nothing is lost
+-- before the backfill finishes).
+-- hnsw.ef_search caps how many rows one HNSW scan returns, and the category / client filters
+-- apply after the scan, so the function raises it to doc_count for the call (otherwise a
+-- filtered top_docs can come back with fewer documents than asked for).
+
+alter table public.knowledge_documents
+  add column if not exists summary_embedding vector(1536),
+  add column if not exists summary_checksum text;
+
+create index if not exists knowledge_documents_summary_embedding_hnsw
+  on public.knowledge_documents using hnsw (summary_embedding vector_cosine_ops);
+
+create or replace function public.match_knowledge_chunks_two_tier(
+  query_embedding vector(1536),
+  match_count int,
+  doc_count int,
+  in_category text default null,
+  in_client uuid default null,
+  in_conversation uuid default null
+)
+returns table (
+  chunk_id uuid,
+  document_id uuid,
+  chunk_index int,
+  doc_title text,
+  source_url text,
+  category text,
+  client_id uuid,
+  similarity float,
+  content text
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  perform set_config('hnsw.ef_search', least(1000, greatest(doc_count, 40))::text, true);
+
+  return query
+  with top_docs as (
+    select kd.id
+    from public.knowledge_documents kd
+    where kd.summary_embedding is not null
+      and (in_category is null or kd.category = in_category)
+      and (in_client is null or kd.client_id = in_client)
+      and (kd.conversation_id is null or kd.conversation_id = in_conversation)
+    order by kd.summary_embedding <=> query_embedding
+    limit doc_count
+  ),
+  candidate_docs as (
+    select id from top_docs
+    union
+    select kd.id
+    from public.knowledge_documents kd
+    where kd.summary_embedding is null
+      and (in_category is null or kd.category = in_category)
+      and (in_client is null or kd.client_id = in_client)
+      and (kd.conversation_id is null or kd.conversation_id = in_conversation)
+  )
+  select
+    kc.id as chunk_id,
+    kc.document_id,
+    kc.chunk_index,
+    kd.title as doc_title,
+    kd.source_url,
+    kc.category,
+    kc.client_id,
+    (1 - (kc.embedding <=> query_embedding))::float as similarity,
+    kc.content
+  from candidate_docs cd
+  join public.knowledge_chunks kc on kc.document_id = cd.id
+  join public.knowledge_documents kd on kd.id = kc.document_id
+  where (in_category is null or kc.category = in_category)
+    and (in_client is null or kc.client_id = in_client)
+  -- exact ranking over the candidates' chunks: a descending similarity is not an HNSW
+  -- order, so the chunk index (and its ef_search cap) is not used with the document filter
+  order by 1 - (kc.embedding <=> query_embedding) desc
+  limit match_count;
+end;
+$$;
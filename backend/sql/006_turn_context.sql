@@ -0,0 +1,69 @@
+-- 006: everything a chat turn reads, in one round trip
+-- services/llm/turn_context.py calls this after inserting the user's message instead of
+-- separate queries for the conversation, client, summary, message count, upload count,
+-- recent history and the documents attached to that history.
+-- Attached document text is cut to doc_chars server side (the prompt only uses a snippet).
+-- Returns {"conversation": null, ...} when the conversation does not exist.
+
+create or replace function public.get_turn_context(
+  in_conversation uuid,
+  history_limit int default 10,
+  doc_chars int default 1600
+)
+returns jsonb
+language sql stable
+as $$
+  with convo as (
+    select c.id, c.client_id
+    from public.conversations c
+    where c.id = in_conversation
+  ),
+  recent as (
+    select m.id, m.role, m.content, m.created_at
+    from public.messages m
+    where m.conversation_id = in_conversation
+    order by m.created_at desc
+    limit history_limit
+  )
+  select jsonb_build_object(
+    'conversation', (select to_jsonb(c) from convo c),
+    'client', (
+      select to_jsonb(cl)
+      from public.clients cl
+      join convo c on cl.id = c.client_id
+    ),
+    'summary', (
+      select cs.summary
+      from public.conversation_summary cs
+      where cs.conversation_id = in_conversation
+      limit 1
+    ),
+    'message_count', (
+      select count(*) from public.messages m where m.conversation_id = in_conversation
+    ),
+    'upload_docs_count', (
+      select count(*)
+      from public.knowledge_documents kd
+      where kd.source = 'upload' and kd.conversation_id = in_conversation
+    ),
+    -- chronological, like the prompt wants it
+    'history', coalesce(
+      (select jsonb_agg(to_jsonb(r) order by r.created_at) from recent r),
+      '[]'::jsonb
+    ),
+    'attached_docs', coalesce(
+      (
+        select jsonb_agg(jsonb_build_object(
+          'message_id', md.message_id,
+          'document_id', kd.id,
+          'title', kd.title,
+          'raw_text', left(kd.raw_text, doc_chars)
+        ))
+        from public.message_documents md
+        join recent r on r.id = md.message_id
+        join public.knowledge_documents kd on kd.id = md.document_id
+      ),
+      '[]'::jsonb
+    )
+  );
+$$;
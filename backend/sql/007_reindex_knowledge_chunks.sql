@@ -0,0 +1,21 @@
+-- 007: move kept chunks to their new positions in one statement
+-- services/sync/chunk_diff.py calls this on re-sync instead of one UPDATE per moved row;
+-- every row gets its new chunk_index at once, so swaps (A@0, B@1 → B@0, A@1) need no ordering.
+-- Returns the number of rows updated.
+
+create or replace function public.reindex_knowledge_chunks(
+  in_ids uuid[],
+  in_indexes int[]
+)
+returns int
+language sql
+as $$
+  with moved as (
+    update public.knowledge_chunks kc
+    set chunk_index = m.chunk_index
+    from unnest(in_ids, in_indexes) as m(id, chunk_index)
+    where kc.id = m.id
+    returning kc.id
+  )
+  select count(*)::int from moved;
+$$;